@@ -0,0 +1,259 @@
+# coding: utf-8
+'''
+Acquisition worker for the GUI. The worker owns the connection to the
+scope and runs on its own QThread, so the Qt event loop never waits on the
+network, even during a 25 Mpt transfer. The GUI sends it commands through
+a queue and receives results through signals:
+
+    worker = AcquisitionWorker()
+    worker.connected.connect(...)
+    worker.start()
+    worker.submit('connect', '192.168.1.1')
+    worker.submit('measure', [1, 2])
+    worker.submit('live', [1, 2, 3, 4])
+    worker.cancel() #abort the running command, e.g. a long transfer
+
+Waveforms are scaled into preallocated buffers which are handed to the GUI
+without copying and recycled once it has moved on to a newer frame, see
+FrameSlot.
+'''
+from __future__ import print_function, division
+import threading
+import socket
+import queue
+import numpy as np
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+from lecrunch.scaling import decimate
+
+
+class Frame(object):
+    '''The full resolution buffers and the decimated (t, volts) traces of
+    one live frame, both keyed by channel.
+    '''
+    def __init__(self):
+        self.buffers = {}
+        self.traces = {}
+
+
+class FrameSlot(object):
+    '''Pass the newest frame from the worker to the GUI.
+    There are three frames: one being filled by the worker, one waiting to
+    be shown and one being shown. Publishing a frame before the previous
+    one was taken drops the previous one and reuses its buffers, so the
+    worker never waits for the display and stale frames never queue up.
+    '''
+    def __init__(self, nsets=3):
+        self.lock = threading.Lock()
+        self.free = [Frame() for i in range(nsets)]
+        self.latest = None
+        self.shown = None
+        self.dropped = 0
+
+    def get_free(self):
+        '''Return a frame whose buffers may be overwritten.
+        '''
+        with self.lock:
+            return self.free.pop()
+
+    def publish(self, frame):
+        with self.lock:
+            if self.latest is not None:
+                self.free.append(self.latest)
+                self.dropped += 1
+            self.latest = frame
+
+    def take(self):
+        '''Return the newest frame, which stays valid until the next call,
+        or None if there is no new frame.
+        '''
+        with self.lock:
+            if self.latest is None:
+                return None
+            if self.shown is not None:
+                self.free.append(self.shown)
+            self.shown, self.latest = self.latest, None
+            return self.shown
+
+
+class Cancelled(Exception):
+    pass
+
+
+class AcquisitionWorker(QObject):
+    '''Run scope commands from a queue on a background thread.
+    Results are emitted as signals; the frames of `live` go through
+    `frames` (a FrameSlot), with `frame_ready` emitted for each, so that
+    the GUI can take the newest one whenever it is ready to draw.
+    '''
+    connected = pyqtSignal(list) #active channels
+    wavedesc = pyqtSignal(int, object) #channel, wavedesc dictionary
+    waveform = pyqtSignal(int, object, object) #channel, TimeAxis, volts
+    frame_ready = pyqtSignal()
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    idle = pyqtSignal() #the command queue is empty
+
+    def __init__(self, parent=None):
+        super(AcquisitionWorker, self).__init__(parent)
+        self.commands = queue.Queue()
+        #cancel() bumps the generation; a command only runs and keeps
+        #running while the generation it was submitted in is current
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.running = None #generation of the running command
+        self.shut_down = False #cancel() shut the running transfer down
+        self.scope = None
+        self.address = None
+        self.width = 1000 #pixels live frames are decimated to
+        self.frames = FrameSlot()
+        self.buffers = {} #full resolution buffers for `measure`, by channel
+
+        self.thread = QThread()
+        self.moveToThread(self.thread)
+        self.thread.started.connect(self.run)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, command, *args):
+        '''Queue *command* (the name of a cmd_ method) with *args*.
+        '''
+        #read under the lock so a racing cancel() either drops the command
+        #or lets it run, never tags it with a generation already cancelled
+        with self.lock:
+            self.commands.put((self.generation, command, args))
+
+    def cancel(self):
+        '''Abort the running command and drop any queued ones. A transfer
+        in progress is aborted by shutting the connection down; the worker
+        reconnects on the next command.
+        '''
+        while True:
+            try:
+                self.commands.get_nowait()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.generation += 1
+            scope = self.scope
+            if self.running is not None and scope is not None:
+                try:
+                    scope.sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                self.shut_down = True
+
+    def stop(self):
+        '''Cancel everything and end the worker thread.
+        '''
+        self.cancel()
+        self.commands.put(None)
+        self.thread.quit()
+        self.thread.wait()
+
+    def run(self):
+        while True:
+            item = self.commands.get()
+            if item is None:
+                break
+            generation, command, args = item
+            with self.lock:
+                if generation != self.generation:
+                    #submitted before a cancel
+                    continue
+                self.running = generation
+            try:
+                getattr(self, 'cmd_' + command)(*args)
+            except Exception as e:
+                if self.is_cancelled():
+                    self.cancelled.emit()
+                else:
+                    self.error.emit('%s: %s' % (command, e))
+            finally:
+                with self.lock:
+                    self.running = None
+                    shut_down, self.shut_down = self.shut_down, False
+                if shut_down:
+                    #reconnect on the next command
+                    self.disconnect()
+            if self.commands.empty():
+                self.idle.emit()
+
+        self.disconnect()
+
+    def disconnect(self):
+        if self.scope is not None:
+            self.scope.sock.close()
+            self.scope = None
+
+    def is_cancelled(self):
+        '''Return whether the running command has been cancelled.
+        '''
+        with self.lock:
+            return self.running != self.generation
+
+    def check(self):
+        if self.is_cancelled():
+            raise Cancelled()
+
+    def get_scope(self):
+        if self.scope is None:
+            if self.address is None:
+                raise Exception('not connected to a scope.')
+            self.cmd_connect(self.address)
+        return self.scope
+
+    def cmd_connect(self, address):
+        from lecroy_interface import LecroyInterface
+        self.disconnect()
+        self.address = address
+        self.scope = LecroyInterface(address)
+        self.connected.emit(self.scope.getchannels())
+
+    def cmd_settings(self, settings):
+        self.get_scope().set_settings(settings)
+
+    def cmd_timebase(self, t):
+        self.get_scope().set_timebase(t)
+
+    def cmd_measure(self, channels):
+        '''Emit the descriptor and full waveform of each of *channels*.
+        The waveform arrays are reused by the next measure command.
+        '''
+        scope = self.get_scope()
+        for channel in channels:
+            self.check()
+            t, data = self.read(scope, channel, self.buffers)
+            self.wavedesc.emit(channel, scope.cached_wavedesc(channel))
+            self.waveform.emit(channel, t, data)
+
+    def cmd_live(self, channels):
+        '''Publish decimated frames of *channels* until cancelled or given
+        another command.
+        '''
+        scope = self.get_scope()
+        while self.commands.empty():
+            self.check()
+            frame = self.frames.get_free()
+            frame.traces.clear()
+            for channel in channels:
+                t, data = self.read(scope, channel, frame.buffers)
+                frame.traces[channel] = decimate(t, data, self.width)
+            self.frames.publish(frame)
+            self.frame_ready.emit()
+
+    def read(self, scope, channel, buffers):
+        '''Read *channel* in volts into buffers[channel], reallocating it
+        if the record length changed. Returns (t, volts).
+        '''
+        n = scope.cached_wavedesc(channel)['wave_array_count']
+        for attempt in range(2):
+            out = buffers.get(channel)
+            if out is None or len(out) != n:
+                out = buffers[channel] = np.empty(n, np.float32)
+            try:
+                return scope.measure_channel(channel, out=out)
+            except ValueError:
+                #the descriptor was refreshed with a new length
+                n = scope.cached_wavedesc(channel)['wave_array_count']
+        raise ValueError('record length of channel %i keeps changing' % channel)
@@ -12,6 +12,8 @@ import sys, os
 DEBUG = True
 SETTINGS_DIR = '.lecroy_plot'
 SETTINGS_FILE = 'lecroy_plot_config.txt'
+SCOPE_IP = '192.168.1.1'
+LIVE_FPS = 30 #refresh rate of the live view
 
 #Mac
 # if getattr(sys, 'frozen', None): #if py2app or cxfreeze used
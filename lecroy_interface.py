@@ -4,14 +4,15 @@ Created on 03.05.2012
 @author: john.schoenberger
 '''
 from __future__ import print_function, division
-from lecrunch.lecroy import LeCroyScope
+from lecrunch.lecroy import LeCroyScope, blocklength, decodewaveform
 from lecrunch.config import set_settings
 from lecrunch.config import get_settings
+from lecrunch.scaling import scale_waveform, time_axis
 import socket
 from matplotlib.pyplot import *
 
-from numpy import linspace
-import csv
+import numpy as np
+from lecrunch.export import export
 
 commands = ['TIME_DIV', 'COMM_FORMAT', 'COMM_HEADER', 'COMM_ORDER'] + \
     ['TRIG_DELAY', 'TRIG_SELECT', 'TRIG_MODE', 'TRIG_PATTERN', 'SEQUENCE'] + \
@@ -32,6 +33,9 @@ class LecroyInterface(LeCroyScope):
         #May possibly help if you get a timeout, then close an ipython window
         #http://stackoverflow.com/questions/3905832/python-closing-a-socket-already-opened-by-a-precedent-python-program-or-dirty
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) 
+
+        #(settings, wave descriptor) by channel, see cached_wavedesc()
+        self.wavedesc_cache = {}
         
         #self.scope = LeCroyScope(ip_address, timeout=20.0)
         #set channels 1,2 to AC coupling
@@ -48,19 +52,61 @@ class LecroyInterface(LeCroyScope):
         self.set_settings({'TIME_DIV':'TDIV %f' % t})
         
         
-    def measure_channel(self, channel):
+    def cached_wavedesc(self, channel, settings=None, refresh=False):
+        '''Return the wave descriptor of *channel*, only querying the scope
+        the first time, when *settings* (the replies to scale_queries())
+        differ from those it was queried with or if *refresh* is true.
+        '''
+        cached = self.wavedesc_cache.get(channel)
+        if refresh or cached is None or cached[0] != settings:
+            self.wavedesc_cache[channel] = (settings, self.getwavedesc(channel))
+        return self.wavedesc_cache[channel][1]
+    
+    def invalidate_wavedescs(self):
+        '''Forget the cached wave descriptors, e.g. after sending a command
+        which changes the record length or vertical scale.
+        '''
+        self.wavedesc_cache.clear()
+    
+    def scale_queries(self, channel):
+        '''Queries of the settings which the scaling of *channel* in its
+        wave descriptor depends on.
+        '''
+        return ['c%i:vdiv?' % channel, 'c%i:ofst?' % channel, 'tdiv?']
+    
+    def measure_channel(self, channel, dtype=np.float64, out=None):
+        '''Return the time axis and the waveform of *channel* in volts as
+        *dtype* (or in *out*). The time axis is a lecrunch.scaling.TimeAxis
+        which is only expanded to an array when used as one.
+        '''
         
         #print 'Plotting channel', channel
-        desc = self.getwavedesc(channel)
-        dy = desc['vertical_gain']
-        dx = desc['horiz_interval'] #between each sample
-        delta_y = desc['vertical_offset'] #yoffset
-        n_samples = desc['wave_array_count'] #number of samples
-    
-        data = self.getwaveform(channel, desc)*dy - delta_y
+        
+        #the scale settings are queried in the same write as the data, so
+        #a change behind our back (e.g. on the front panel) to V/div, offset
+        #or timebase refreshes the wave descriptor without a round trip
+        queries = self.scale_queries(channel)
+        self.sendmany(queries + ['c%i:wf? dat1' % channel])
+        settings = tuple(self.recv().decode().strip() for query in queries)
+        msg = self.recv_buffer()
+        
+        desc = self.cached_wavedesc(channel, settings)
+        
+        #the record length changed without changing the scale
+        nbytes = blocklength(msg)
+        if nbytes != desc['wave_array_count']*desc['dtype'].itemsize:
+            desc = self.cached_wavedesc(channel, settings, refresh=True)
+            if nbytes != desc['wave_array_count']*desc['dtype'].itemsize:
+                raise ValueError('channel %i sent %i bytes, but its wave '
+                                 'descriptor gives %i samples of %i bytes'
+                                 % (channel, nbytes, desc['wave_array_count'],
+                                    desc['dtype'].itemsize))
+        
+        #scale straight from the received bytes into a single float array
+        data = scale_waveform(decodewaveform(msg, channel, desc), desc, out, dtype)
         
         #Calculate the time axis
-        t = linspace(0, n_samples-1, n_samples)*dx #don't need to subtract delta_x unless you want to start with a -ve time
+        t = time_axis(desc, desc['wave_array_count'], t0=0.0) #don't need to subtract delta_x unless you want to start with a -ve time
 #        print 't', t
 #        T = n_samples*dx #length of the entire time slice
 #        print 'T', T
@@ -68,14 +114,12 @@ class LecroyInterface(LeCroyScope):
         return t, data
     
     
-    def save_data(self, data1, data2, filename):
-        '''Saves the data in arrays data1, data2 to file
+    def save_data(self, data1, data2, filename, t=None):
+        '''Saves the data in arrays data1, data2 (and the time axis t) to
+        file, in the format given by its extension (csv by default), see
+        lecrunch.export
         '''
-        data = [(data1[i], data2[i]) for i in range(data1.size)]
-        f = open(filename, 'wb')
-        out = csv.writer(f, delimiter=',')
-        out.writerows(data)
-        f.close()
+        export(filename, [data1, data2], t)
         
     ##Untested
     def set_trigger(self, channel, voltage):
@@ -102,6 +146,7 @@ class LecroyInterface(LeCroyScope):
         return settings
     
     def set_settings(self, settings):
+        self.invalidate_wavedescs()
         for command, setting in settings.items():
             print('sending {}'.format(command))
             self.send(setting)
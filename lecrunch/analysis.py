@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compute pulse features of every event in a run file saved by fetch on a
+pool of processes, and save them back to the file as a table per channel,
+'features/channel<n>', with one row per event:
+
+    baseline        mean of the first `baseline` samples (V)
+    baseline_rms    rms of the same samples (V)
+    height          largest excursion from the baseline in the direction
+                    of `polarity` (V, positive)
+    charge          integral of the pulse over `impedance` (C, positive)
+    peak_time       time of the largest excursion (s)
+    rise_time       10% to 90% rise time of the leading edge (s), NaN
+                    if the pulse does not start below 10% of its height
+
+Each dataset is split into ranges of whole chunks which the workers read
+and reduce independently, so memory use is bounded by a few blocks per
+worker whatever the size of the file. The features are spooled to a
+temporary file next to it as the ranges complete and copied into the run
+file once the workers are done reading it.
+
+Example:
+    >>> python -m lecrunch.analysis run.hdf5 -j 8
+    channel1: 100000 events.
+    channel2: 100000 events.
+    Analyzed 200000 events in 8.422 seconds.
+"""
+
+import os
+import time
+import tempfile
+import numpy as np
+import h5py
+from concurrent.futures import ProcessPoolExecutor
+from .reader import RunFile
+
+feature_dtype = np.dtype([('baseline', 'f4'), ('baseline_rms', 'f4'),
+                          ('height', 'f4'), ('charge', 'f4'),
+                          ('peak_time', 'f8'), ('rise_time', 'f4')])
+
+def crossing(y, level, index):
+    """
+    Returns the fractional sample at which each row of `y` crosses `level`
+    between samples `index`-1 and `index`, interpolating linearly.
+    """
+    rows = np.arange(len(y))
+    before = y[rows, np.maximum(index - 1, 0)]
+    after = y[rows, index]
+    step = after - before
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(step != 0, (level - before)/step, 0.0)
+    return index - 1 + np.clip(fraction, 0.0, 1.0)
+
+def features(events, t0, dt, baseline=50, polarity=-1, impedance=50.0,
+             out=None):
+    """
+    Returns the features (see `feature_dtype`) of each event in the 2-d
+    array `events` in volts, sampled at t0 + i*dt, in `out` or a new
+    array. The baseline is taken from the first `baseline` samples and
+    pulses go in the direction of the sign of `polarity`.
+    """
+    nevents, nsamples = events.shape
+    if out is None:
+        out = np.empty(nevents, feature_dtype)
+    if nevents == 0:
+        return out
+
+    pedestal = events[:, :baseline]
+    mean = pedestal.mean(axis=1, dtype=np.float64)
+    out['baseline'] = mean
+    out['baseline_rms'] = pedestal.std(axis=1, dtype=np.float64)
+
+    # pulses made positive with the baseline removed
+    y = events - mean[:, np.newaxis].astype(events.dtype)
+    if polarity < 0:
+        np.negative(y, out=y)
+
+    peak = y.argmax(axis=1)
+    height = y[np.arange(nevents), peak]
+    out['height'] = height
+    out['peak_time'] = t0 + peak*dt
+    out['charge'] = y.sum(axis=1, dtype=np.float64)*dt/impedance
+
+    # first sample at or above 90% of the peak, which is never after it
+    i90 = (y >= 0.9*height[:, np.newaxis]).argmax(axis=1)
+
+    # last sample below 10% of the peak before that
+    samples = np.arange(nsamples)
+    below = (y < 0.1*height[:, np.newaxis]) & \
+        (samples < i90[:, np.newaxis])
+    last = nsamples - 1 - below[:, ::-1].argmax(axis=1)
+    i10 = np.where(below.any(axis=1), last + 1, 0)
+
+    t90 = crossing(y, 0.9*height, i90)
+    t10 = crossing(y, 0.1*height, i10)
+    # no leading edge when nothing is below 10% before it, e.g. i90 == 0
+    out['rise_time'] = np.where(below.any(axis=1),
+                                np.maximum(t90 - t10, 0.0)*dt, np.nan)
+
+    return out
+
+# the run file of each worker process, opened once by `open_run`
+run = None
+
+def open_run(filename, group):
+    global run
+    run = RunFile(filename, group)
+
+def process_range(args):
+    """Returns the features of events `start` to `stop` of `channel`."""
+    channel, start, stop, kwargs = args
+    channel = run[channel]
+    out = np.empty(stop - start, feature_dtype)
+    for i, events in channel.iter_blocks(start, stop):
+        features(events, channel.time.t0, channel.time.dt,
+                 out=out[i-start:i-start+len(events)], **kwargs)
+    return out
+
+def ranges(length, chunkrows, rows):
+    """
+    Split `length` events into (start, stop) ranges of about `rows` events
+    rounded to whole chunks of `chunkrows`.
+    """
+    rows = chunkrows*max(1, rows//chunkrows)
+    return [(start, min(start + rows, length)) for start in
+            range(0, length, rows)]
+
+def analyze(filename, channels=None, processes=None, rows=None, group='/',
+            baseline=50, polarity=-1, impedance=50.0):
+    """
+    Compute the features of every event of `channels` (default all) in
+    the run file `filename` on `processes` worker processes (default one
+    per cpu) and save them as 'features/channel<n>' in `group` of the
+    file. Work is split into ranges of about `rows` events (default 8
+    chunks). Returns a dictionary of the number of events analyzed keyed
+    by channel.
+    """
+    kwargs = { 'baseline' : baseline, 'polarity' : polarity,
+               'impedance' : impedance }
+
+    with RunFile(filename, group) as runfile:
+        if channels is None:
+            channels = list(runfile)
+        tasks = []
+        lengths = {}
+        for channel in channels:
+            lengths[channel] = len(runfile[channel])
+            chunkrows = runfile[channel].chunkrows
+            for start, stop in ranges(lengths[channel], chunkrows,
+                                      rows or 8*chunkrows):
+                tasks.append((channel, start, stop, kwargs))
+
+    # the workers hold the run file open for reading until the pool is done
+    fd, spoolname = tempfile.mkstemp('.hdf5', 'features',
+        os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+
+    try:
+        with h5py.File(spoolname, 'w') as spool:
+            for channel in channels:
+                spool.create_dataset('channel%i' % channel,
+                                     (lengths[channel],), feature_dtype,
+                                     chunks=True, compression='gzip')
+
+            time0 = time.time()
+            with ProcessPoolExecutor(processes, initializer=open_run,
+                                     initargs=(filename, group)) as pool:
+                for (channel, start, stop, _), out in zip(tasks,
+                        pool.map(process_range, tasks)):
+                    spool['channel%i' % channel][start:stop] = out
+            elapsed = time.time() - time0
+
+            with h5py.File(filename, 'a') as f:
+                group = f[group].require_group('features')
+                for channel in channels:
+                    name = 'channel%i' % channel
+                    if name in group:
+                        del group[name]
+                    spool.copy(spool[name], group, name)
+                    for key, value in kwargs.items():
+                        group[name].attrs[key] = value
+                    print('%s: %i events.' % (name, lengths[channel]))
+    finally:
+        os.remove(spoolname)
+
+    # the ranges of every channel share the pool, so only the total time
+    # is meaningful
+    print('Analyzed %i events in %.3f seconds.' %
+          (sum(lengths.values()), elapsed))
+
+    return lengths
+
+if __name__ == '__main__':
+    import sys
+    import optparse
+
+    parser = optparse.OptionParser('%prog <filename> [-j] [-c]')
+    parser.add_option('-j', type='int', dest='processes',
+                      help='worker processes (default one per cpu)',
+                      default=None)
+    parser.add_option('-c', type='int', dest='channels', action='append',
+                      help='channel to analyze (repeat; default all)',
+                      default=None)
+    parser.add_option('-g', dest='group', help='group holding the channels',
+                      default='/')
+    parser.add_option('--rows', type='int', dest='rows',
+                      help='events per work unit', default=None)
+    parser.add_option('--baseline', type='int', dest='baseline',
+                      help='samples used for the baseline', default=50)
+    parser.add_option('--polarity', type='int', dest='polarity',
+                      help='sign of the pulses', default=-1)
+    parser.add_option('--impedance', type='float', dest='impedance',
+                      help='termination in ohms', default=50.0)
+    options, args = parser.parse_args()
+
+    if len(args) < 1 or not os.path.exists(args[0]):
+        sys.exit(parser.format_help())
+
+    analyze(args[0], options.channels, options.processes, options.rows,
+            options.group, options.baseline, options.polarity,
+            options.impedance)
@@ -0,0 +1,241 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+An asyncio client for LeCroy scopes over VICP with the same methods as
+`sock.Socket` and `lecroy.LeCroyScope`, as coroutines. Several scopes can be
+driven concurrently from one event loop:
+
+    >>> async def main():
+    ...     scopes = await asyncio.gather(*(AsyncLeCroyScope.open(host)
+    ...                                     for host in hosts))
+    ...     await asyncio.gather(*(scope.trigger() for scope in scopes))
+"""
+
+import socket
+import asyncio
+from .sock import pack_messages, last_command_error, series_views
+from .config import commands, settings_query, parse_settings
+from .lecroy import decodewavedesc, decodewaveform, decodesequence, \
+    comm_formats
+
+class AsyncSocket(object):
+    """A non-blocking VICP connection to the oscilloscope."""
+    def __init__(self, host, port=1861, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.wait_for(loop.sock_connect(self.sock,
+            (self.host, self.port)), self.timeout)
+
+    async def clear(self, timeout=0.5):
+        """
+        Clear any bytes in the oscilloscope's output queue by receiving
+        packets until the connection blocks for more than `timeout` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.wait_for(loop.sock_recv(self.sock, 4096),
+                                       timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def send(self, msg):
+        """Format and send the string `msg`."""
+        await self.sendmany([msg])
+
+    async def sendmany(self, msgs):
+        """Format each string in `msgs` and send them back-to-back."""
+        loop = asyncio.get_running_loop()
+        await asyncio.wait_for(loop.sock_sendall(self.sock,
+            pack_messages(msgs)), self.timeout)
+
+    async def check_last_command(self):
+        """
+        Check that the last command sent was received okay; if not, raise
+        an exception with details about the error.
+        """
+        await self.send('cmr?')
+        error = last_command_error(await self.recv())
+
+        if error is not None:
+            self.close()
+            raise Exception(error)
+
+    async def _recv_exact(self, view):
+        loop = asyncio.get_running_loop()
+        while view:
+            nbytes = await asyncio.wait_for(loop.sock_recv_into(self.sock,
+                view), self.timeout)
+            if nbytes == 0:
+                raise socket.error('connection closed by the oscilloscope.')
+            view = view[nbytes:]
+
+    async def recv_buffer(self, buffer=None):
+        """
+        Receive a 'logical series' of blocks into a single bytearray and
+        return a memoryview of it, as `sock.Socket.recv_buffer`.
+        """
+        series = series_views(buffer)
+        view = next(series)
+        while True:
+            await self._recv_exact(view)
+            view.release()
+            try:
+                view = next(series)
+            except StopIteration as e:
+                return e.value
+
+    async def recv(self):
+        """Return a message from the scope."""
+        with await self.recv_buffer() as reply:
+            return reply.tobytes()
+
+    def close(self):
+        self.sock.close()
+
+class AsyncLeCroyScope(AsyncSocket):
+    """
+    A coroutine version of `lecroy.LeCroyScope`. Create it with
+    `await AsyncLeCroyScope.open(host)`.
+    """
+    def __init__(self, *args, **kwargs):
+        super(AsyncLeCroyScope, self).__init__(*args, **kwargs)
+        self.buffer = bytearray()
+
+    @classmethod
+    async def open(cls, *args, comm_format='BYTE', **kwargs):
+        """Connect to the scope and set the communication format, 'BYTE'
+        or 'WORD'."""
+        if comm_format.upper() not in comm_formats:
+            raise Exception('comm_format must be one of %s.' %
+                            ', '.join(comm_formats))
+        scope = cls(*args, **kwargs)
+        await scope.connect()
+        await scope.send('comm_header short')
+        await scope.check_last_command()
+        await scope.send('comm_format DEF9,%s,BIN' % comm_format.upper())
+        await scope.check_last_command()
+        return scope
+
+    async def getchannels(self):
+        """Returns a list of the active channels on the scope."""
+        await self.sendmany(['c%i:trace?' % i for i in range(1, 5)])
+        channels = []
+        for i in range(1, 5):
+            if 'ON' in (await self.recv()).decode():
+                channels.append(i)
+        return channels
+
+    async def get_settings(self, batch=16):
+        """Returns the scope configuration as `config.get_settings`."""
+        settings = {}
+        for i in range(0, len(commands), max(batch, 1)):
+            group = commands[i:i+max(batch, 1)]
+            if batch > 1:
+                await self.send(settings_query(group))
+                replies = parse_settings(group, await self.recv())
+                if replies is not None:
+                    settings.update(replies)
+                    continue
+            # one by one, to find the failing query
+            for command in group:
+                await self.send(command + '?')
+                settings[command] = (await self.recv()).strip()
+                await self.check_last_command()
+        return settings
+
+    async def trigger(self):
+        """Trigger the oscilloscope and wait for an acquisition."""
+        await self.send('arm;wait')
+
+    async def getwavedesc(self, channel):
+        if channel not in range(1, 5):
+            raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        await self.send('c%s:wf? desc' % str(channel))
+
+        return decodewavedesc(await self.recv_buffer(), channel)
+
+    async def getwaveform(self, channel, wavedesc, out=None):
+        """
+        Request and return the waveform for `channel` as a numpy array, as
+        `lecroy.LeCroyScope.getwaveform`.
+        """
+        if channel not in range(1, 5):
+            raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        await self.send('c%s:wf? dat1' % str(channel))
+
+        return await self.readwaveform(channel, wavedesc, out)
+
+    async def getwaveforms(self, channels, wavedescs, out=None):
+        """
+        Request the waveforms of every channel in `channels` at once and
+        return a dictionary of numpy arrays keyed by channel number, as
+        `lecroy.LeCroyScope.getwaveforms`.
+        """
+        for channel in channels:
+            if channel not in range(1, 5):
+                raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        await self.sendmany(['c%i:wf? dat1' % channel for channel in channels])
+
+        waveforms = {}
+        for channel in channels:
+            waveforms[channel] = await self.readwaveform(
+                channel, wavedescs[channel],
+                None if out is None else out[channel])
+        return waveforms
+
+    async def getsequences(self, channels):
+        """
+        Request 'wf? all' for every channel in `channels` at once and
+        return a dictionary of (wavedesc, waveforms, trigtimes) tuples keyed
+        by channel number, as `lecroy.LeCroyScope.getsequences`.
+        """
+        for channel in channels:
+            if channel not in range(1, 5):
+                raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        await self.sendmany(['c%i:wf? all' % channel for channel in channels])
+
+        sequences = {}
+        for channel in channels:
+            sequences[channel] = decodesequence(await self.recv_buffer(),
+                                                channel)
+        return sequences
+
+    async def readwaveform(self, channel, wavedesc, out=None):
+        """
+        Receive and decode the reply to a 'wf? dat1' query for `channel`.
+        """
+        if out is None:
+            return decodewaveform(await self.recv_buffer(), channel, wavedesc)
+
+        msg = await self.recv_buffer(self.buffer)
+        # reuse the buffer if it had to be replaced by a larger one
+        self.buffer = msg.obj
+        try:
+            return decodewaveform(msg, channel, wavedesc, out)
+        finally:
+            msg.release()
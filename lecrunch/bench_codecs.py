@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Benchmark the compression codecs available to fetch on synthetic PMT
+waveforms in BYTE (int8) and WORD (int16) format. Each codec writes the same
+events through `writer.EventWriter` and reports the write throughput and the
+compression ratio.
+
+Example:
+    >>> python -m lecrunch.bench_codecs -n 2000 -s 2500 -j 4
+"""
+
+import os
+import time
+import tempfile
+import h5py
+import numpy as np
+from .emulator import pmt_waveforms
+from .writer import EventWriter, compression_options, hdf5plugin
+
+def benchmark(filename, events, codec, shuffle=False, threads=0, batch=100):
+    """
+    Write `events` to a new dataset in `filename` and return the tuple
+    (seconds, bytes on disk).
+    """
+    nevents, nsamples = events.shape
+    with h5py.File(filename, 'w') as f:
+        dataset = f.create_dataset('channel1', events.shape, events.dtype,
+                                   chunks=(min(100, nevents), nsamples),
+                                   **compression_options(codec, shuffle))
+        writer = EventWriter({1 : dataset}, batch, threads=threads)
+
+        t0 = time.time()
+        for i in range(0, nevents, batch):
+            n = min(batch, nevents - i)
+            writer.put(i, n, { 1 : events[i:i+n] })
+        writer.close()
+        f.flush()
+        elapsed = time.time() - t0
+
+        size = dataset.id.get_storage_size()
+
+    return elapsed, size
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser('%prog [-n] [-s] [-j]')
+    parser.add_option('-n', type='int', dest='nevents',
+                      help='number of events', default=2000)
+    parser.add_option('-s', type='int', dest='nsamples',
+                      help='samples per event', default=2500)
+    parser.add_option('-j', type='int', dest='threads',
+                      help='threads for parallel gzip', default=4)
+    options, args = parser.parse_args()
+
+    codecs = [('none', False, 0), ('lzf', False, 0), ('lzf', True, 0),
+              ('gzip:1', False, 0), ('gzip:4', False, 0),
+              ('gzip:4', True, 0), ('gzip:9', False, 0),
+              ('gzip:4', False, options.threads),
+              ('gzip:4', True, options.threads)]
+    if hdf5plugin is not None:
+        codecs += [('zstd:1', False, 0), ('zstd:3', True, 0),
+                   ('blosc:lz4', False, 0), ('blosc:zstd', False, 0)]
+
+    rng = np.random.default_rng(0)
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'bench.hdf5')
+
+    try:
+        for bits in (8, 16):
+            events = pmt_waveforms(options.nevents, options.nsamples, bits,
+                                   rng).astype('i%i' % (bits//8))
+            print('%i events x %i samples, int%i (%.1f MB)' %
+                  (options.nevents, options.nsamples, bits,
+                   events.nbytes/1e6))
+            for codec, shuffle, threads in codecs:
+                elapsed, size = benchmark(filename, events, codec, shuffle,
+                                          threads)
+                name = codec + ('+shuffle' if shuffle else '') + \
+                    (' x%i threads' % threads if threads else '')
+                print('  %-28s %8.1f MB/s  ratio %5.2f' %
+                      (name, events.nbytes/elapsed/1e6, events.nbytes/size))
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rmdir(tmpdir)
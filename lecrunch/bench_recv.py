@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Benchmark the receive path of `sock.Socket` against the original
+concatenating implementation, using a loopback stand-in for the scope which
+answers every message with a fixed size reply split into VICP blocks.
+
+Example:
+    >>> python -m lecrunch.bench_recv -s 10000000 -b 1000000 -n 5
+    legacy recv:     5 x 10000000 bytes in 0.204 s (245.0 MB/s)
+    recv:            5 x 10000000 bytes in 0.198 s (253.0 MB/s)
+    recv_buffer:     5 x 10000000 bytes in 0.054 s (920.4 MB/s)
+"""
+
+import time
+import struct
+import socket
+import threading
+from .sock import Socket, headerformat
+
+def serve(server, size, blocksize):
+    """
+    Accept a single connection on `server` and answer every VICP message
+    with `size` bytes split into blocks of at most `blocksize` bytes.
+    """
+    conn, addr = server.accept()
+    payload = bytes(bytearray(range(256))*(size//256 + 1))[:size]
+    try:
+        while True:
+            header = conn.recv(8)
+            if len(header) < 8:
+                break
+            totalbytes = struct.unpack(headerformat, header)[-1]
+            while totalbytes:
+                totalbytes -= len(conn.recv(totalbytes))
+
+            for i in range(0, size, blocksize):
+                block = payload[i:i+blocksize]
+                operation = 129 if i + blocksize >= size else 128
+                conn.sendall(struct.pack(headerformat, operation, 1, 1, 0,
+                                         len(block)))
+                conn.sendall(block)
+    except socket.error:
+        pass
+    finally:
+        conn.close()
+
+def legacy_recv(scope):
+    """The original `Socket.recv`, which concatenates immutable bytes."""
+    reply = b''
+    while True:
+        header = b''
+        while len(header) < 8:
+            header += scope.sock.recv(8 - len(header))
+
+        operation, headerver, seqnum, spare, totalbytes = \
+            struct.unpack(headerformat, header)
+
+        buffer = b''
+        while len(buffer) < totalbytes:
+            buffer += scope.sock.recv(totalbytes - len(buffer))
+
+        reply += buffer
+
+        if operation % 2:
+            break
+
+    return reply
+
+def pooled_recv(scope, _pool=[bytearray()]):
+    with scope.recv_buffer(_pool[0]) as reply:
+        _pool[0] = reply.obj
+        return len(reply)
+
+def benchmark(recv, size, blocksize, n):
+    """Return the seconds taken to receive `n` replies of `size` bytes."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    thread = threading.Thread(target=serve,
+                              args=(server, size, blocksize))
+    thread.daemon = True
+    thread.start()
+
+    scope = Socket('127.0.0.1', server.getsockname()[1], timeout=60.0)
+
+    t0 = time.time()
+    for i in range(n):
+        scope.send('c1:wf? dat1')
+        recv(scope)
+    elapsed = time.time() - t0
+
+    scope.sock.close()
+    thread.join()
+    server.close()
+
+    return elapsed
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser('%prog [-s] [-b] [-n]')
+    parser.add_option('-s', type='int', dest='size',
+                      help='bytes per reply', default=10000000)
+    parser.add_option('-b', type='int', dest='blocksize',
+                      help='bytes per VICP block', default=1000000)
+    parser.add_option('-n', type='int', dest='n',
+                      help='number of replies', default=10)
+    parser.add_option('--skip-legacy', action='store_true', dest='skip',
+                      help='skip the (slow) original implementation',
+                      default=False)
+    options, args = parser.parse_args()
+
+    recvs = [('recv', Socket.recv), ('recv_buffer', pooled_recv)]
+    if not options.skip:
+        recvs.insert(0, ('legacy recv', legacy_recv))
+
+    for name, recv in recvs:
+        elapsed = benchmark(recv, options.size, options.blocksize, options.n)
+        print('%-16s %i x %i bytes in %.3f s (%.1f MB/s)' %
+              (name + ':', options.n, options.size, elapsed,
+               options.n*options.size/elapsed/1e6))
@@ -21,8 +21,8 @@ attributes to a hdf5 file. Settings can be loaded from either source.
 
 Examples:
     Save/load settings to/from a pickled dictionary.
-    >>> config.py save mysettings.pkl
-    >>> config.py load mysettings.pkl
+    >>> python -m lecrunch.config save mysettings.pkl
+    >>> python -m lecrunch.config load mysettings.pkl
     sending TIME_DIV
     sending COMM_FORMAT
     ...
@@ -39,6 +39,8 @@ Examples:
     ...
 """
 
+from .lecroy import blockoffset, blocklength
+
 commands = ['TIME_DIV', 'COMM_FORMAT', 'COMM_HEADER', 'COMM_ORDER'] + \
     ['TRIG_DELAY', 'TRIG_SELECT', 'TRIG_MODE', 'TRIG_PATTERN', 'SEQUENCE'] + \
     ['C%i:COUPLING' % i for i in range(1,5)] + \
@@ -49,7 +51,49 @@ commands = ['TIME_DIV', 'COMM_FORMAT', 'COMM_HEADER', 'COMM_ORDER'] + \
     ['C%i:TRIG_SLOPE' % i for i in range(1,5)] + \
     ['C%i:TRACE' % i for i in range(1,5)]
 
-def get_settings(scope):
+# attribute/key under which a panel setup dump is saved alongside settings
+PANEL = 'PANEL_SETUP'
+
+def settings_query(group):
+    """Returns a single message querying each command in `group`,
+    followed by 'cmr?'."""
+    return ';'.join([command + '?' for command in group] + ['cmr?'])
+
+def parse_settings(group, reply):
+    """
+    Returns a dictionary of the replies to a `settings_query` of `group`
+    keyed by command, or None if any of the queries failed.
+    """
+    replies = reply.strip().split(b';')
+    if len(replies) != len(group) + 1 or \
+            int(replies[-1].split(b' ')[-1]) != 0:
+        return None
+    return dict(zip(group, replies[:-1]))
+
+def get_settings(scope, batch=16):
+    """
+    Returns a dictionary of the replies to the queries in `commands`. The
+    queries are sent `batch` at a time joined by semicolons in a single
+    message, with a 'cmr?' at the end, so that each batch costs one round
+    trip. With `batch` <= 1 each query and its 'cmr?' is sent on its own.
+    """
+    if batch <= 1:
+        return get_settings_serial(scope, commands)
+
+    settings = {}
+    for i in range(0, len(commands), batch):
+        group = commands[i:i+batch]
+        scope.send(settings_query(group))
+        replies = parse_settings(group, scope.recv())
+
+        if replies is None:
+            # a query failed; repeat the batch one by one to find which
+            replies = get_settings_serial(scope, group)
+
+        settings.update(replies)
+    return settings
+
+def get_settings_serial(scope, commands):
     settings = {}
     for command in commands:
         scope.send(command + '?')
@@ -57,12 +101,53 @@ def get_settings(scope):
         scope.check_last_command()
     return settings
 
-def set_settings(scope, settings):
-    for command, setting in settings.items():
+def set_settings(scope, settings, batch=16):
+    """
+    Send each setting in the dictionary `settings`, as saved by
+    `get_settings`, to the scope. Settings are sent `batch` at a time in a
+    single message followed by a 'cmr?'.
+    """
+    items = [(command, setting.decode() if isinstance(setting, bytes) else
+              str(setting)) for command, setting in settings.items()
+             if command != PANEL]
+
+    if batch <= 1:
+        set_settings_serial(scope, items)
+        return
+
+    for i in range(0, len(items), batch):
+        group = items[i:i+batch]
+        for command, setting in group:
+            print('sending %s' % command)
+        scope.send(';'.join([setting for command, setting in group] +
+                            ['cmr?']))
+        reply = scope.recv().decode()
+
+        if int(reply.split(' ')[-1].rstrip('\n')) != 0:
+            # resend the batch one by one to report the bad setting
+            set_settings_serial(scope, group)
+
+def set_settings_serial(scope, items):
+    for command, setting in items:
         print('sending %s' % command)
         scope.send(setting)
         scope.check_last_command()
 
+def get_panel(scope):
+    """
+    Returns the scope's complete panel setup ('pnsu?') as a single binary
+    blob, which `set_panel` restores.
+    """
+    scope.send('pnsu?')
+    reply = memoryview(scope.recv())
+    offset = blockoffset(reply)
+    return reply[offset:offset+blocklength(reply)].tobytes()
+
+def set_panel(scope, panel):
+    """Restore a panel setup saved by `get_panel`."""
+    scope.send(b'PNSU #9%09i' % len(panel) + panel)
+    scope.check_last_command()
+
 if __name__ == '__main__':
     import sys
     import optparse
@@ -71,34 +156,47 @@ if __name__ == '__main__':
 
     usage = '%prog <save/load> filename'
     parser = optparse.OptionParser(usage)
+    parser.add_option('--panel', action='store_true', dest='panel',
+                      help='also save/restore the full panel setup (pnsu?)',
+                      default=False)
+    parser.add_option('--batch', type='int', dest='batch',
+                      help='commands per message (1 sends them one by one)',
+                      default=16)
     options, args = parser.parse_args()
 
     if len(args) < 2:
         sys.exit(parser.format_help())
 
-    import setup
-    from sock import Socket
+    from . import setup
+    from .sock import Socket
 
     scope = Socket(setup.scope_ip, timeout=20.0)
     scope.clear()
 
     if args[0] == 'save':
-        settings = get_settings(scope)
+        settings = get_settings(scope, options.batch)
         for command, setting in settings.items():
             print('%s, %s' % (command, setting))
+        if options.panel:
+            settings[PANEL] = get_panel(scope)
         f = open(args[1], 'wb')
         pickle.dump(settings, f)
         f.close()
     elif args[0] == 'load':
         try:
             f = h5py.File(args[1], 'r')
-            settings = dict(f.attrs)
+            settings = dict((key, value) for key, value in f.attrs.items()
+                            if key in commands or key == PANEL)
             f.close()
-        except h5py.h5e.LowLevelIOError:
-            f = open(args[1], 'r')
+        except OSError:
+            f = open(args[1], 'rb')
             settings = pickle.load(f)
             f.close()
 
-        set_settings(scope, settings)
+        if options.panel and PANEL in settings:
+            print('sending %s' % PANEL)
+            set_panel(scope, bytes(settings[PANEL]))
+        else:
+            set_settings(scope, settings, options.batch)
     else:
         raise Exception('unrecognized command %s' % args[0])
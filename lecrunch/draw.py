@@ -1,43 +1,100 @@
 #!/usr/bin/env python
-import h5py
+"""
+Overlay the events saved in a run file, a subplot per channel, either as
+lines or as a persistence display: a 2-d histogram of how often each
+pixel was crossed, like the persistence mode of a scope.
+
+Lines of all events are drawn as a single LineCollection, with long records
+decimated to a min/max envelope at about the resolution of the screen. The
+persistence display is accumulated a block of raw events at a time, so any
+number of events can be drawn in bounded memory.
+
+Example:
+    >>> python -m lecrunch.draw run.hdf5 -n 10000 -p
+"""
+
 import numpy as np
 import matplotlib.pyplot as plt
-from itertools import cycle, islice
+from matplotlib.collections import LineCollection
+from .reader import RunFile
+from .scaling import decimate
+
+def overlay(ax, x, y, width=1000, **kwargs):
+    """
+    Draw each row of `y` against `x` on `ax` as one LineCollection after
+    decimating to `width` pixels. Returns the collection.
+    """
+    x, y = decimate(np.asarray(x), y, width)
+
+    segments = np.empty(y.shape + (2,), np.float32)
+    segments[..., 0] = x
+    segments[..., 1] = y
+
+    kwargs.setdefault('colors', 'black')
+    kwargs.setdefault('linewidths', 0.5)
+    lines = LineCollection(segments, **kwargs)
+    ax.add_collection(lines)
+    ax.autoscale_view()
+    return lines
+
+def persistence(channel, nevents=None, width=1000, height=256):
+    """
+    Returns a (`height`, `width`) histogram of the samples of the first
+    `nevents` events of a `reader.Channel` over its time axis and the full
+    vertical range of the digitizer, and the (left, right, bottom, top)
+    extent of the histogram in seconds and volts.
+    """
+    wavedesc = channel.wavedesc
+    nsamples = channel.shape[1]
+
+    # raw codes span min_value to max_value, or the whole integer range
+    if wavedesc.min_value is not None and wavedesc.max_value is not None:
+        low, high = wavedesc.min_value, wavedesc.max_value + 1
+    else:
+        info = np.iinfo(channel.raw_dtype)
+        low, high = info.min, info.max + 1
+
+    # column of each sample, the same for every event
+    columns = (np.arange(nsamples)*width)//nsamples
 
-def roundrobin(*iterables):
-    pending = len(iterables)
-    nexts = cycle(iter(it).next for it in iterables)
+    hist = np.zeros(height*width, np.int64)
+    for i, events in channel.iter_blocks(0, nevents, raw=True):
+        rows = np.subtract(events, low, dtype=np.float32)
+        rows *= height/(high - low)
+        rows = np.clip(rows, 0, height - 1).astype(np.intp)
+        rows *= width
+        rows += columns
+        hist += np.bincount(rows.ravel(), minlength=height*width)
 
-    while pending:
-        try:
-            for next in nexts:
-                yield next()
-        except StopIteration:
-            pending -= 1
-            nexts = cycle(islice(nexts, pending))
+    t = channel.time
+    extent = (t.t0, t.t0 + t.dt*nsamples,
+              low*channel.gain - channel.offset,
+              high*channel.gain - channel.offset)
+    return hist.reshape(height, width), extent
 
-def draw(filename, nevents):
-    f = h5py.File(filename, 'r')
+def draw(filename, nevents, persist=False, width=1000, height=256):
+    run = RunFile(filename)
 
     fig = plt.figure()
-    for i, dataset in enumerate((f[name] for name in f)):
-        plt.subplot(len(f), 1, i+1)
-        nevents = min(options.nevents, len(dataset))
-        nsamples = dataset.attrs['wave_array_count']//dataset.attrs['nom_subarray_count']
-        dx = dataset.attrs['horiz_interval']
-        dy = dataset.attrs['vertical_gain']
-        xoffset = dataset.attrs['horiz_offset']
-        yoffset = dataset.attrs['vertical_offset']
+    for i, number in enumerate(run):
+        channel = run[number]
+        ax = fig.add_subplot(len(run.channels), 1, i+1)
 
-        x = np.tile(np.linspace(xoffset, xoffset+dx*nsamples, nsamples)*1e9, (nevents,1))
-        y = dataset[:nevents]*dy - yoffset
+        if persist:
+            hist, extent = persistence(channel, nevents, width, height)
+            left, right, bottom, top = extent
+            ax.imshow(np.log1p(hist), origin='lower', aspect='auto',
+                      extent=(left*1e9, right*1e9, bottom, top),
+                      cmap='inferno', interpolation='nearest')
+        else:
+            overlay(ax, np.asarray(channel.time)*1e9, channel[:nevents],
+                    width)
 
-        plt.plot(*roundrobin(x, y), color='black')
-        plt.xlabel('Time (ns)')
-        plt.ylabel('Voltage (V)')
-        plt.title(dataset.name)
+        ax.set_xlabel('Time (ns)')
+        ax.set_ylabel('Voltage (V)')
+        ax.set_title(channel.name)
 
-    f.close()
+    run.close()
 
     return fig
 
@@ -47,6 +104,10 @@ if __name__ == '__main__':
 
     parser = optparse.OptionParser('%prog file [...]')
     parser.add_option('-n', type='int', dest='nevents', default=100)
+    parser.add_option('-p', action='store_true', dest='persist',
+                      help='draw a persistence histogram', default=False)
+    parser.add_option('--width', type='int', dest='width',
+                      help='horizontal resolution in pixels', default=1000)
     options, args = parser.parse_args()
 
     if len(args) < 1:
@@ -54,6 +115,7 @@ if __name__ == '__main__':
 
     figures = []
     for filename in args:
-        figures.append(draw(filename, options.nevents))
+        figures.append(draw(filename, options.nevents, options.persist,
+                            options.width))
 
     plt.show()
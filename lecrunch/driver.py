@@ -0,0 +1,96 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The interface between a scope and the acquisition loop in `engine`, which
+`lecroy.LeCroyScope` and `tektronix.TekScope` implement. A run goes:
+
+    channels = scope.active_channels()
+    settings = scope.settings()
+    nrows = scope.events_per_trigger()
+    descriptors = scope.descriptors(channels)
+    scope.arm()
+    while ...:
+        n = scope.read_batch(channels, buffers, rearm=True)
+
+where `buffers` holds an array of `nrows` events for each channel, and a
+record array of `lecroy.trigtime_dtype` keyed by ('trigtime', channel) if
+`nrows` > 1 (see `engine.create_datasets`). A driver which does not
+implement every method fails when it is constructed.
+"""
+
+from abc import ABC, abstractmethod
+
+class Driver(ABC):
+    @abstractmethod
+    def active_channels(self):
+        """Returns a list of the numbers of the channels which are on."""
+
+    @abstractmethod
+    def settings(self):
+        """Returns a dictionary of the scope settings, saved as the
+        attributes of a run."""
+
+    @abstractmethod
+    def descriptors(self, channels):
+        """
+        Returns a dictionary keyed by channel of the LeCroy style wavedesc
+        of each of `channels`, with at least the fields 'dtype',
+        'wave_array_count' (samples per trigger), 'vertical_gain',
+        'vertical_offset', 'horiz_interval' and 'horiz_offset'.
+        """
+
+    @abstractmethod
+    def events_per_trigger(self):
+        """Returns the number of events (segments or frames) read per
+        trigger."""
+
+    @abstractmethod
+    def arm(self):
+        """Start an acquisition without waiting for it."""
+
+    @abstractmethod
+    def read_batch(self, channels, buffers, rearm=False):
+        """
+        Wait for the armed acquisition and receive every event of it into
+        `buffers`. If `rearm` is true the next acquisition is armed as soon
+        as the scope is done with this one, without waiting for the data
+        to arrive. Returns the number of events read by every channel,
+        which may be fewer than `events_per_trigger()`; only that many rows
+        of `buffers` are written.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """Discard any replies waiting to be read."""
+
+def store_sequences(sequences, buffers):
+    """
+    Copy the segments and trigger times of `sequences`, as returned by
+    `LeCroyScope.getsequences`, into the event `buffers` of the datasets
+    made by `engine.create_datasets`. Returns the number of events which
+    every channel filled, i.e. the rows of `buffers` which hold this
+    acquisition; the rest hold stale events.
+    """
+    nrows = None
+    for channel, (wavedesc, waveforms, trigtimes) in sequences.items():
+        if len(waveforms) > len(buffers[channel]):
+            raise Exception('scope returned %i segments; expected %i.' %
+                            (len(waveforms), len(buffers[channel])))
+        buffers[channel][:len(waveforms)] = waveforms
+        buffers[('trigtime', channel)][:len(trigtimes)] = trigtimes
+        n = min(len(waveforms), len(trigtimes))
+        nrows = n if nrows is None else min(nrows, n)
+    return nrows or 0
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+"""
+A local stand-in for a LeCroy X-stream oscilloscope which speaks the VICP
+protocol on a TCP socket. It answers the queries used by `sock`, `lecroy`,
+`config` and `fetch` with synthetic PMT-like waveforms so that benchmarks
+and regression checks can run without a real scope.
+
+Examples:
+    Run an emulator on the VICP port with 4 channels of 10000 samples in
+    WORD format and 100 segments per acquisition.
+    >>> python -m lecrunch.emulator -s 10000 --segments 100 --word
+    emulating LeCroy scope on 127.0.0.1:1861
+
+    Run one in a background thread from python.
+    >>> from lecrunch.emulator import start
+    >>> server = start(port=0, nsamples=1000)
+    >>> scope = LeCroyScope(*server.server_address)
+    >>> server.shutdown()
+"""
+
+import time
+import struct
+import socket
+import threading
+import socketserver
+import numpy as np
+from .sock import headerformat
+from .lecroy import wavedesc_template, wavedesc_structs, wavedesclength, \
+    trigtime_dtype, String, UnitDefinition, TimeStamp
+
+# long command headers and the short form the scope answers with when
+# comm_header is short
+aliases = { 'TIME_DIV'      : 'TDIV',
+            'COMM_FORMAT'   : 'CFMT',
+            'COMM_HEADER'   : 'CHDR',
+            'COMM_ORDER'    : 'CORD',
+            'TRIG_DELAY'    : 'TRDL',
+            'TRIG_SELECT'   : 'TRSE',
+            'TRIG_MODE'     : 'TRMD',
+            'TRIG_PATTERN'  : 'TRPA',
+            'SEQUENCE'      : 'SEQ',
+            'COUPLING'      : 'CPL',
+            'VOLT_DIV'      : 'VDIV',
+            'OFFSET'        : 'OFST',
+            'TRIG_COUPLING' : 'TRCP',
+            'TRIG_LEVEL'    : 'TRLV',
+            'TRIG_SLOPE'    : 'TRSL',
+            'TRACE'         : 'TRA',
+            'DISPLAY'       : 'DISP',
+            'PANEL_SETUP'   : 'PNSU',
+            'WAVEFORM_SETUP': 'WFSU',
+            'WAVEFORM'      : 'WF' }
+
+defaults = { 'TDIV' : '1E-6 S',
+             'CFMT' : 'DEF9,BYTE,BIN',
+             'CHDR' : 'SHORT',
+             'CORD' : 'LO',
+             'TRDL' : '0 PCT',
+             'TRSE' : 'EDGE,SR,C1,HT,OFF',
+             'TRMD' : 'NORM',
+             'TRPA' : 'X,X,X,X,X,STATE,AND',
+             'SEQ'  : 'OFF,1,10E+3 SAMPLE',
+             'DISP' : 'ON',
+             'WFSU' : 'SP,0,NP,0,FP,0,SN,0' }
+for i in range(1, 5):
+    defaults.update({ 'C%i:CPL' % i  : 'D50',
+                      'C%i:VDIV' % i : '5E-3 V',
+                      'C%i:OFST' % i : '0 V',
+                      'C%i:TRCP' % i : 'DC',
+                      'C%i:TRLV' % i : '-5E-3 V',
+                      'C%i:TRSL' % i : 'NEG',
+                      'C%i:TRA' % i  : 'ON' })
+
+def normalize(header):
+    """Return the short form of the command header `header`."""
+    query = header.endswith('?')
+    parts = header.upper().rstrip('?').split(':')
+    return ':'.join(aliases.get(part, part) for part in parts) + \
+        ('?' if query else '')
+
+def pack_wavedesc(wavedesc, endian):
+    """Pack the dictionary `wavedesc` into a WAVEDESC block."""
+    values = []
+    for name, pos, datatype in wavedesc_template:
+        if datatype in (TimeStamp,):
+            values.extend(wavedesc.get(name, (0.0, 0, 0, 0, 0, 0, 0)))
+        elif datatype in (String, UnitDefinition):
+            values.append(wavedesc.get(name, b''))
+        else:
+            values.append(wavedesc.get(name, 0))
+    return wavedesc_structs[endian].pack(*values)
+
+def pmt_waveforms(nevents, nsamples, bits, rng):
+    """
+    Return `nevents` synthetic PMT traces of `nsamples` raw samples: a noisy
+    baseline with a negative going pulse of random height near the middle
+    of the record.
+    """
+    full = 2**(bits-1) - 1
+    t = np.arange(nsamples) - nsamples//2
+    width = max(1.0, nsamples/200.0)
+    heights = rng.exponential(0.3*full, size=(nevents, 1))
+    y = -heights*np.exp(-0.5*(t/width)**2)
+    y += rng.normal(0, 0.01*full, size=(nevents, nsamples))
+    return np.clip(np.round(y), -full-1, full)
+
+class VICPHandler(socketserver.BaseRequestHandler):
+    """Answer VICP messages on one connection to the emulator."""
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def recv_exact(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def recv_message(self):
+        """Return the next logical series from the client as a string."""
+        msg = b''
+        while True:
+            operation, headerver, seqnum, spare, totalbytes = \
+                struct.unpack(headerformat, self.recv_exact(8))
+            msg += self.recv_exact(totalbytes)
+            if operation % 2:
+                return msg.decode('latin-1')
+
+    def send_reply(self, reply):
+        """
+        Send `reply` to the client as a logical series of blocks of at most
+        `server.blocksize` bytes, throttled to `server.bandwidth` bytes/s.
+        """
+        server = self.server
+        t0 = time.time()
+        for i in range(0, max(len(reply), 1), server.blocksize):
+            block = reply[i:i+server.blocksize]
+            eoi = i + server.blocksize >= len(reply)
+            header = struct.pack(headerformat, 129 if eoi else 128, 1, 1, 0,
+                                 len(block))
+            self.request.sendall(header + block)
+
+            if server.bandwidth:
+                delay = (i + len(block))/server.bandwidth - (time.time() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def handle(self):
+        try:
+            while True:
+                msg = self.recv_message()
+                text = []
+                if normalize(msg.split(' ')[0]) == 'PNSU':
+                    # a panel setup block may contain anything
+                    commands = [msg]
+                else:
+                    commands = msg.strip().split(';')
+                for command in commands:
+                    if not command.strip():
+                        continue
+                    reply = self.server.execute(command.strip())
+                    if isinstance(reply, bytes):
+                        self.send_reply(reply)
+                    elif reply is not None:
+                        text.append(reply)
+                if text:
+                    self.send_reply((';'.join(text) + '\n').encode())
+        except (EOFError, ConnectionError):
+            pass
+
+class Emulator(socketserver.ThreadingTCPServer):
+    """
+    A threaded VICP server emulating a four channel LeCroy scope.
+
+    Args:
+        - address: (host, port)
+            Address to listen on; use port 0 to pick a free port.
+        - nsamples: int
+            Samples per segment in each waveform.
+        - segments: int
+            Segments per acquisition; more than one turns on sequence mode.
+        - word: bool
+            Start in WORD (16 bit) rather than BYTE comm_format.
+        - bits: int
+            Resolution of the samples in WORD format, which are sent in
+            the high bits of each word as by 12 bit HD scopes.
+        - trigger_latency: float
+            Seconds between `arm;wait` and the acquisition completing.
+        - bandwidth: float
+            Maximum bytes per second sent to the client (None for no limit).
+        - blocksize: int
+            Maximum bytes in a single VICP block.
+        - pool: int
+            Number of distinct acquisitions to cycle through.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 1861), nsamples=1000,
+                 segments=1, word=False, trigger_latency=0.0,
+                 bandwidth=None, blocksize=1 << 20, pool=8, seed=0,
+                 bits=16):
+        socketserver.ThreadingTCPServer.__init__(self, address, VICPHandler)
+        self.nsamples = nsamples
+        self.bits = bits
+        self.trigger_latency = trigger_latency
+        self.bandwidth = bandwidth
+        self.blocksize = blocksize
+        self.pool = pool
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.settings = dict(defaults)
+        self.cmr = 0
+        self.acquisition = 0
+        self.waveforms = {}
+        self.settings['SEQ'] = '%s,%i,%i SAMPLE' % \
+            ('ON' if segments > 1 else 'OFF', segments, nsamples)
+        if word:
+            self.settings['CFMT'] = 'DEF9,WORD,BIN'
+
+    @property
+    def segments(self):
+        state, count = self.settings['SEQ'].split(',')[:2]
+        return int(count) if state.strip().upper() == 'ON' else 1
+
+    @property
+    def comm_type(self):
+        return 1 if 'WORD' in self.settings['CFMT'].upper() else 0
+
+    @property
+    def endian(self):
+        return '<' if self.settings['CORD'].upper().startswith('L') else '>'
+
+    def value(self, header):
+        """Return the numeric part of the setting `header`."""
+        return float(self.settings[header].split()[0])
+
+    def channels(self):
+        return [i for i in range(1, 5) if
+                self.settings['C%i:TRA' % i].upper() == 'ON']
+
+    def waveform(self, channel):
+        """Return the raw samples of the current acquisition on `channel`."""
+        key = (channel, self.comm_type, self.segments, self.nsamples)
+        if key not in self.waveforms:
+            bits = self.bits if self.comm_type else 8
+            data = pmt_waveforms(self.pool*self.segments, self.nsamples,
+                                 bits, self.rng)
+            if self.comm_type:
+                data = data.astype(np.int16) << (16 - bits)
+            self.waveforms[key] = data.astype('i%i' % (1 + self.comm_type))
+        data = self.waveforms[key]
+        i = self.acquisition % self.pool
+        return data[i*self.segments:(i+1)*self.segments]
+
+    def waveform_setup(self):
+        """Return the (sparsing, npoints, first) points of each segment sent
+        by 'wf?', see WAVEFORM_SETUP."""
+        fields = self.settings['WFSU'].split(',')
+        setup = dict((key.strip().upper(), int(value)) for key, value in
+                     zip(fields[0::2], fields[1::2]))
+        sparsing = max(1, setup.get('SP', 0))
+        first = min(setup.get('FP', 0), self.nsamples)
+        npoints = len(range(first, self.nsamples, sparsing))
+        if setup.get('NP', 0):
+            npoints = min(npoints, setup['NP'])
+        return sparsing, npoints, first
+
+    def transfer(self, channel):
+        """Return the raw samples of `channel` sent by 'wf?'."""
+        sparsing, npoints, first = self.waveform_setup()
+        data = self.waveform(channel)[:, first::sparsing][:, :npoints]
+        return np.ascontiguousarray(data)
+
+    def trigtimes(self):
+        """
+        Returns the trigtime array of the current acquisition: segments
+        triggered at random about every 10 us, each sampled from a random
+        fraction of a sample after its trigger.
+        """
+        rng = np.random.default_rng(self.acquisition)
+        trigtimes = np.empty(self.segments, trigtime_dtype)
+        trigtimes['trigger_time'][0] = 0.0
+        trigtimes['trigger_time'][1:] = np.cumsum(
+            rng.exponential(10e-6, self.segments - 1))
+        trigtimes['trigger_offset'] = -5.0*self.value('TDIV') - \
+            rng.uniform(0, 10.0*self.value('TDIV')/self.nsamples,
+                        self.segments)
+        return trigtimes
+
+    def wavedesc(self, channel):
+        """Return the descriptor of the current acquisition on `channel`."""
+        nbytes = 2 if self.comm_type else 1
+        sparsing, npoints, first = self.waveform_setup()
+        count = npoints*self.segments
+        vdiv = self.value('C%i:VDIV' % channel)
+        tdiv = self.value('TDIV')
+        return { 'descriptor_name'    : b'WAVEDESC',
+                 'template_name'      : b'LECROY_2_3',
+                 'comm_type'          : self.comm_type,
+                 'comm_order'         : 1 if self.endian == '<' else 0,
+                 'wave_descriptor'    : wavedesclength,
+                 'trigtime_array'     : 16*self.segments
+                                        if self.segments > 1 else 0,
+                 'wave_array_1'       : count*nbytes,
+                 'instrument_name'    : b'LECROY EMULATOR',
+                 'trace_label'        : b'',
+                 'wave_array_count'   : count,
+                 'pnts_per_screen'    : self.nsamples,
+                 'last_valid_pnt'     : count - 1,
+                 'first_point'        : first,
+                 'sparsing_factor'    : sparsing,
+                 'subarray_count'     : self.segments,
+                 'sweeps_per_acq'     : 1,
+                 'vertical_gain'      : vdiv/25.0/(256 if nbytes == 2 else 1),
+                 'vertical_offset'    : self.value('C%i:OFST' % channel),
+                 'max_value'          : 127.0*(256 if nbytes == 2 else 1),
+                 'min_value'          : -128.0*(256 if nbytes == 2 else 1),
+                 'nominal_bits'       : self.bits if nbytes == 2 else 8,
+                 'nom_subarray_count' : self.segments,
+                 'horiz_interval'     : 10.0*tdiv/self.nsamples,
+                 'horiz_offset'       : -5.0*tdiv,
+                 'vertunit'           : b'V',
+                 'horunit'            : b'S',
+                 'trigger_time'       : (0.0, 0, 0, 1, 1, 2010, 0),
+                 'acq_duration'       : 10.0*tdiv*self.segments,
+                 'record_type'        : 0,
+                 'timebase'           : 0,
+                 'vert_coupling'      : 0,
+                 'probe_att'          : 1.0,
+                 'bandwidth_limit'    : 0,
+                 'vertical_vernier'   : 1.0,
+                 'wave_source'        : channel - 1 }
+
+    def block(self, header, payload):
+        """Format `payload` as a definite length block answering `header`."""
+        return ('%s,#9%09i' % (header, len(payload))).encode() + payload + \
+            b'\n'
+
+    def panel(self):
+        """Returns the reply to 'pnsu?': every setting in a binary block."""
+        payload = '\n'.join('%s %s' % item for item in
+                             sorted(self.settings.items())).encode()
+        return ('PNSU #9%09i' % len(payload)).encode() + payload + b'\n'
+
+    def restore_panel(self, block):
+        """Restore the settings from a 'PNSU #9<length><panel>' block."""
+        try:
+            length = int(block[2:11])
+            for line in block[11:11+length].decode().split('\n'):
+                key, _, value = line.partition(' ')
+                if key not in self.settings:
+                    raise ValueError(key)
+                self.settings[key] = value
+        except ValueError:
+            self.cmr = 10
+
+    def query_waveform(self, channel, what):
+        wavedesc = self.wavedesc(channel)
+        endian = self.endian
+        if what == 'DESC':
+            payload = pack_wavedesc(wavedesc, endian)
+        elif what == 'DAT1':
+            data = self.transfer(channel).ravel()
+            payload = data.astype(data.dtype.newbyteorder(endian)).tobytes()
+        elif what == 'ALL':
+            data = self.transfer(channel).ravel()
+            payload = pack_wavedesc(wavedesc, endian)
+            if wavedesc['trigtime_array']:
+                payload += self.trigtimes().astype(
+                    trigtime_dtype.newbyteorder(endian)).tobytes()
+            payload += data.astype(data.dtype.newbyteorder(endian)).tobytes()
+        else:
+            return None
+        return self.block('C%i:WF %s' % (channel, what), payload)
+
+    def execute(self, command):
+        """
+        Execute a single `command` and return its reply: a string for text
+        queries, bytes for waveform queries or None for commands.
+        """
+        header, _, args = command.partition(' ')
+        header = normalize(header)
+        args = args.strip()
+
+        with self.lock:
+            if header == 'CMR?':
+                cmr, self.cmr = self.cmr, 0
+                return 'CMR %i' % cmr
+            if header == '*IDN?':
+                return '*IDN LECROY,EMULATOR,0,1.0'
+            if header in ('ARM', 'WAIT', 'TRIG', 'FRTR'):
+                if header != 'WAIT':
+                    self.acquisition += 1
+                if self.trigger_latency and header in ('WAIT', 'FRTR'):
+                    time.sleep(self.trigger_latency)
+                return None
+            if header == 'PNSU?':
+                return self.panel()
+            if header == 'PNSU':
+                self.restore_panel(args.encode('latin-1'))
+                return None
+            if header.endswith(':WF?'):
+                channel = int(header[1])
+                reply = self.query_waveform(channel, args.upper())
+                if reply is None:
+                    self.cmr = 5
+                return reply
+            if header.endswith('?'):
+                key = header[:-1]
+                if key not in self.settings:
+                    self.cmr = 1
+                    return None
+                return '%s %s' % (key, self.settings[key])
+            if header in self.settings:
+                self.settings[header] = args
+                return None
+
+        self.cmr = 1
+        return None
+
+def start(host='127.0.0.1', port=0, **kwargs):
+    """
+    Start an `Emulator` on a background thread and return it. Use
+    `server.server_address` to connect and `server.shutdown()` to stop it.
+    """
+    server = Emulator((host, port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser('%prog [options]')
+    parser.add_option('--host', dest='host', default='127.0.0.1')
+    parser.add_option('-p', type='int', dest='port', default=1861)
+    parser.add_option('-s', type='int', dest='nsamples',
+                      help='samples per segment', default=1000)
+    parser.add_option('--segments', type='int', dest='segments',
+                      help='segments per acquisition', default=1)
+    parser.add_option('--word', action='store_true', dest='word',
+                      help='start in WORD comm_format', default=False)
+    parser.add_option('--bits', type='int', dest='bits',
+                      help='resolution of WORD samples', default=16)
+    parser.add_option('--latency', type='float', dest='latency',
+                      help='trigger latency in seconds', default=0.0)
+    parser.add_option('--bandwidth', type='float', dest='bandwidth',
+                      help='bandwidth limit in bytes/s', default=None)
+    parser.add_option('--blocksize', type='int', dest='blocksize',
+                      help='bytes per VICP block', default=1 << 20)
+    options, args = parser.parse_args()
+
+    server = Emulator((options.host, options.port),
+                      nsamples=options.nsamples, segments=options.segments,
+                      word=options.word, bits=options.bits,
+                      trigger_latency=options.latency,
+                      bandwidth=options.bandwidth,
+                      blocksize=options.blocksize)
+    print('emulating LeCroy scope on %s:%i' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
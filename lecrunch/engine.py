@@ -0,0 +1,259 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The acquisition loop shared by every scope driver (see `driver`): trigger,
+read every event of every active channel into a free set of buffers and
+hand them to a `writer.EventWriter`, rolling over to a new file by size or
+age. The next acquisition is armed as soon as the scope has the read
+queries, so triggering overlaps the transfer and the writing of the last
+one.
+
+Files have the same layout whatever the scope: the settings as attributes
+of the root group, a dataset 'channel<n>' of raw events per channel with
+its wavedesc as attributes and, when a trigger gives several events, their
+trigger times in 'trigtime/channel<n>'.
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import h5py
+import numpy as np
+from .lecroy import trigtime_dtype
+from .writer import EventWriter, compression_options, chunk_shape
+from .packing import Packer
+
+def acquire(scope, filename, nevents, runattrs=None, nbuffers=0,
+            codec='gzip', threads=0, chunkbytes=1 << 20, batch=None,
+            maxbytes=None, maxtime=None, settings=None, packing='none',
+            maxretries=5):
+    """
+    Save `nevents` events (None to keep going until interrupted) from the
+    `driver.Driver` `scope` to `filename`. `settings` defaults to
+    `scope.settings()`; see `fetch.fetch` for the other arguments.
+    A failed read is retried after clearing and rearming the scope, up to
+    `maxretries` times in a row before the error is raised.
+    Returns the list of files written.
+    """
+    channels = scope.active_channels()
+
+    if settings is None:
+        settings = scope.settings()
+
+    nrows = scope.events_per_trigger()
+    wavedesc = scope.descriptors(channels)
+
+    rollover = maxbytes is not None or maxtime is not None
+
+    def open_run(run):
+        """Open the next output file and its writer."""
+        if rollover:
+            root, ext = os.path.splitext(filename)
+            name = '%s_%04i%s' % (root, run, ext or '.hdf5')
+        else:
+            name = filename
+
+        f, datasets = create_file(name, settings, wavedesc, nrows, nevents,
+                                  runattrs, codec, chunkbytes, packing)
+        writer = EventWriter(datasets, nrows, nbuffers, threads, batch)
+        return name, f, writer
+
+    def close_run(f, writer, nrows):
+        """
+        Flush `writer` and trim the datasets of `f` to `nrows` events. The
+        file is trimmed and closed even if the writer failed.
+        """
+        try:
+            writer.close()
+        finally:
+            try:
+                for dataset in writer.datasets.values():
+                    dataset.resize(nrows, axis=0)
+            finally:
+                f.close()
+
+    run = 0
+    name, f, writer = open_run(run)
+    filenames = [name]
+
+    # start a timer
+    time0 = time.time()
+    runtime0 = time0
+
+    # events saved in total and in the current file
+    i = 0
+    j = 0
+
+    # consecutive failed reads
+    retries = 0
+
+    scope.arm()
+
+    try:
+        while True:
+            if nbuffers > 0:
+                print('\rsaving event: %i (queue %i/%i)' %
+                      (i, writer.depth(), nbuffers), end=' ')
+            else:
+                print('\rsaving event: %i' % i, end=' ')
+            sys.stdout.flush()
+
+            # blocks while every buffer is waiting on the writer
+            buffers = writer.getbuffers()
+
+            last = nevents is not None and i + nrows >= nevents
+
+            try:
+                n = scope.read_batch(channels, buffers, rearm=not last)
+            except (socket.error, struct.error) as e:
+                print('\n' + str(e))
+                writer.release(buffers)
+                retries += 1
+                if retries > maxretries:
+                    print('giving up after %i failed reads.' % retries)
+                    raise
+                scope.clear()
+                scope.arm()
+                continue
+
+            retries = 0
+
+            if nevents is not None:
+                n = min(n, nevents - i)
+            writer.put(j, n, buffers)
+
+            i += n
+            j += n
+
+            if nevents is not None and i >= nevents:
+                print('\rsaving event: %i' % i, end=' ')
+                break
+
+            if last:
+                # the scope returned fewer events than a full trigger and
+                # was not rearmed
+                scope.arm()
+
+            if (maxbytes is not None and f.id.get_filesize() >= maxbytes) or \
+                    (maxtime is not None and time.time() - runtime0 >= maxtime):
+                # forget the run before closing it, so that the finally
+                # below does not close it again if this or the next
+                # open_run fails, hiding the error
+                run_f, run_writer = f, writer
+                f = writer = None
+                close_run(run_f, run_writer, j)
+                run += 1
+                name, f, writer = open_run(run)
+                filenames.append(name)
+                runtime0 = time.time()
+                j = 0
+
+        print()
+
+    except KeyboardInterrupt:
+        print('\nwaiting for writer...')
+        raise
+
+    finally:
+        if writer is not None:
+            close_run(f, writer, j)
+
+        elapsed = time.time() - time0
+
+        if i > 0:
+            print('Completed %i events in %.3f seconds.' % (i, elapsed))
+            print('Averaged %.5f seconds per acquisition.' % (elapsed/i))
+            if nbuffers > 0 and writer is not None:
+                print('Peak writer queue depth %i/%i.' %
+                      (writer.maxdepth, nbuffers))
+            for name in filenames:
+                print("Wrote to file '%s'." % name)
+
+    return filenames
+
+def create_file(filename, settings, wavedesc, sequence_count, nevents,
+                runattrs=None, codec='gzip', chunkbytes=1 << 20,
+                packing='none'):
+    """
+    Create the hdf5 file `filename` with the scope `settings` as attributes
+    and a dataset for each channel in `wavedesc` (see `create_datasets`).
+    Returns the file and a dictionary of the datasets keyed by channel
+    number.
+    """
+    f = h5py.File(filename, 'w')
+
+    datasets = create_datasets(f, settings, wavedesc, sequence_count,
+                               nevents, codec, chunkbytes, packing)
+
+    if runattrs is not None:
+        for name in runattrs:
+            for key, value in runattrs[name].items():
+                f[name].attrs[key] = value
+
+    return f, datasets
+
+def create_datasets(group, settings, wavedesc, sequence_count, nevents,
+                    codec='gzip', chunkbytes=1 << 20, packing='none'):
+    """
+    Attach the scope `settings` to the hdf5 `group` and create a dataset
+    'channel<n>' in it for each channel in `wavedesc`. The datasets can
+    grow without limit along the event axis; their initial length is
+    `nevents`, or 0 if `nevents` is None. Returns a dictionary of the
+    datasets keyed by channel number.
+
+    In sequence mode the trigger time and offset of each segment are saved
+    event for event in a parallel dataset 'trigtime/channel<n>', keyed by
+    ('trigtime', channel).
+
+    Channels of 16 bit samples are stored with `packing` (see `packing`);
+    'int16' turns on the shuffle filter.
+    """
+    # set scope configuration
+    for command, setting in settings.items():
+        group.attrs[command] = setting
+
+    datasets = {}
+    for channel in sorted(wavedesc):
+        nsamples = wavedesc[channel]['wave_array_count']//sequence_count
+        dtype = wavedesc[channel]['dtype']
+        attrs = wavedesc[channel]
+        width = nsamples
+        shuffle = False
+
+        if packing != 'none' and np.dtype(dtype).itemsize == 2:
+            packer = Packer(packing, nsamples, attrs.get('nominal_bits', 16),
+                            dtype)
+            attrs = packer.wavedesc(attrs)
+            attrs.update(packer.attrs())
+            dtype = packer.dtype
+            width = packer.width
+            shuffle = packing == 'int16'
+
+        datasets[channel] = group.create_dataset('channel%i' % channel, (nevents or 0, width), dtype=dtype, maxshape=(None, width), chunks=chunk_shape(width, dtype, nevents, chunkbytes), **compression_options(codec, shuffle))
+
+        for key, value in attrs.items():
+            try:
+                datasets[channel].attrs[key] = value
+            except (ValueError, TypeError):
+                pass
+
+        if sequence_count > 1:
+            chunks = chunk_shape(1, trigtime_dtype, nevents, chunkbytes)[:1]
+            datasets[('trigtime', channel)] = group.require_group('trigtime').create_dataset('channel%i' % channel, (nevents or 0,), dtype=trigtime_dtype, maxshape=(None,), chunks=chunks, **compression_options(codec))
+
+    return datasets
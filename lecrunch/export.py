@@ -0,0 +1,203 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Export waveforms of one or more channels, and optionally their time axis,
+to files other programs can read. The format follows the file extension:
+
+    .npy                a (columns, samples) array, time first
+    .npz                one array per channel (and 'time', or t0/dt)
+    .parquet            one column per channel, requires pyarrow
+    .arrow / .feather   Arrow IPC file, requires pyarrow
+    .bin / .raw         the channels back to back as raw binary with a
+                        .json sidecar giving their dtype, length and time
+                        axis, so it can be opened with np.memmap
+    .csv (or other)     comma separated text, one row per sample
+
+Data is written a chunk of samples at a time, so at most one chunk is ever
+held as text or python objects. A `scaling.TimeAxis` is stored as t0/dt where the
+format allows and only expanded a chunk at a time otherwise.
+
+Example:
+    >>> t, y1 = scope.measure_channel(1)
+    >>> t, y2 = scope.measure_channel(2)
+    >>> export('capture.npz', {'vbus' : y1, 'iin' : y2}, t)
+"""
+
+import os
+import json
+import numpy as np
+from .scaling import TimeAxis
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+formats = { '.npy'     : 'npy',
+            '.npz'     : 'npz',
+            '.parquet' : 'parquet',
+            '.arrow'   : 'arrow',
+            '.feather' : 'arrow',
+            '.bin'     : 'raw',
+            '.raw'     : 'raw',
+            '.csv'     : 'csv' }
+
+def columns(channels):
+    """
+    Returns a list of (name, 1-d array) for `channels`, a dictionary of
+    arrays keyed by name or a sequence of arrays named channel1, ...
+    """
+    if isinstance(channels, dict):
+        items = list(channels.items())
+    else:
+        items = [('channel%i' % (i+1), data) for i, data in
+                 enumerate(channels)]
+
+    items = [(str(name), np.ravel(data)) for name, data in items]
+
+    if len(set(len(data) for name, data in items)) > 1:
+        raise Exception('every channel must have the same number of samples.')
+
+    return items
+
+def time_chunk(t, start, stop):
+    """Returns the times of samples `start` to `stop` as an array."""
+    return np.asarray(t[start:stop], dtype=np.float64)
+
+def export(filename, channels, t=None, format=None, chunk=1 << 20):
+    """
+    Write `channels` (see `columns`) and the time axis `t` (an array or a
+    `scaling.TimeAxis`, may be None) to `filename`. The format is taken
+    from the extension unless `format` is given as one of 'npy', 'npz',
+    'parquet', 'arrow', 'raw' or 'csv'. Samples are written `chunk` at a
+    time.
+    """
+    items = columns(channels)
+
+    if format is None:
+        format = formats.get(os.path.splitext(filename)[1].lower(), 'csv')
+
+    if format == 'npy':
+        export_npy(filename, items, t, chunk)
+    elif format == 'npz':
+        export_npz(filename, items, t)
+    elif format in ('parquet', 'arrow'):
+        export_arrow(filename, items, t, format, chunk)
+    elif format == 'raw':
+        export_raw(filename, items, t)
+    elif format == 'csv':
+        export_csv(filename, items, t, chunk)
+    else:
+        raise Exception('unknown export format %s.' % format)
+
+def export_npy(filename, items, t, chunk):
+    nsamples = len(items[0][1]) if items else 0
+    rows = [data for name, data in items]
+
+    dtype = np.result_type(*rows) if rows else np.float64
+    if t is not None:
+        dtype = np.result_type(dtype, np.float64)
+        rows.insert(0, t)
+
+    out = np.lib.format.open_memmap(filename, 'w+', dtype,
+                                    (len(rows), nsamples))
+    try:
+        for i, data in enumerate(rows):
+            for start in range(0, nsamples, chunk):
+                stop = min(start + chunk, nsamples)
+                if data is t:
+                    out[i, start:stop] = time_chunk(t, start, stop)
+                else:
+                    out[i, start:stop] = data[start:stop]
+        out.flush()
+    finally:
+        del out
+
+def export_npz(filename, items, t):
+    arrays = dict(items)
+    if isinstance(t, TimeAxis):
+        arrays['t0'] = np.float64(t.t0)
+        arrays['dt'] = np.float64(t.dt)
+    elif t is not None:
+        arrays['time'] = np.asarray(t)
+    np.savez(filename, **arrays)
+
+def export_arrow(filename, items, t, format, chunk):
+    if pyarrow is None:
+        raise Exception('%s export requires the pyarrow package.' % format)
+
+    metadata = {}
+    if isinstance(t, TimeAxis):
+        metadata = { b't0' : repr(t.t0).encode(),
+                     b'dt' : repr(t.dt).encode() }
+    elif t is not None:
+        items = [('time', np.asarray(t))] + items
+
+    # arrays of numbers are wrapped without copying
+    table = pyarrow.table(dict((name, pyarrow.array(data)) for name, data in
+                               items)).replace_schema_metadata(metadata)
+
+    if format == 'parquet':
+        pyarrow.parquet.write_table(table, filename, row_group_size=chunk)
+    else:
+        pyarrow.feather.write_feather(table, filename, chunksize=chunk)
+
+def export_raw(filename, items, t):
+    sidecar = { 'order'    : 'channels back to back, each of nsamples',
+                'dtype'    : [],
+                'names'    : [],
+                'offsets'  : [],
+                'nsamples' : len(items[0][1]) if items else 0 }
+
+    if isinstance(t, TimeAxis):
+        sidecar['t0'] = t.t0
+        sidecar['dt'] = t.dt
+    elif t is not None:
+        items = [('time', np.asarray(t))] + items
+
+    with open(filename, 'wb') as f:
+        for name, data in items:
+            sidecar['names'].append(name)
+            sidecar['dtype'].append(data.dtype.str)
+            sidecar['offsets'].append(f.tell())
+            np.ascontiguousarray(data).tofile(f)
+
+    with open(os.path.splitext(filename)[0] + '.json', 'w') as f:
+        json.dump(sidecar, f, indent=4)
+
+def export_csv(filename, items, t, chunk):
+    names = [name for name, data in items]
+    if t is not None:
+        names.insert(0, 'time')
+
+    nsamples = len(items[0][1]) if items else 0
+
+    # formatting a whole block with one % is several times faster than
+    # np.savetxt, which formats each row separately
+    chunk = min(chunk, 1 << 16)
+    row = ','.join(['%.9g']*len(names)) + '\n'
+
+    with open(filename, 'w') as f:
+        f.write(','.join(names) + '\n')
+        for start in range(0, nsamples, chunk):
+            stop = min(start + chunk, nsamples)
+            block = [data[start:stop] for name, data in items]
+            if t is not None:
+                block.insert(0, time_chunk(t, start, stop))
+            block = np.column_stack(block).astype(np.float64)
+            f.write(row*len(block) % tuple(block.ravel().tolist()))
@@ -15,17 +15,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os
 import sys
 import time
-import socket
-import struct
-import h5py
-import setup
-from lecroy import LeCroyScope
-from config import get_settings
-
-def fetch(filename, nevents, runattrs=None):
+import numpy as np
+from . import setup
+from .lecroy import LeCroyScope
+from .config import get_panel, PANEL
+from .engine import acquire, create_file, create_datasets
+from .driver import store_sequences
+from .packing import packings
+
+def fetch(filename, nevents, runattrs=None, nbuffers=0, codec='gzip',
+          threads=0, chunkbytes=1 << 20, batch=None, maxbytes=None,
+          maxtime=None, panel=False, comm_format='BYTE', packing='none',
+          window=None, sparsing=1):
     """
     Fetch and save waveform traces from the oscilloscope.
 
@@ -33,133 +36,125 @@ def fetch(filename, nevents, runattrs=None):
         - filename: str
             Filename to store traces in (in hdf5 format).
         - nevents: int
-            Number of triggered events to save in `filename`.
+            Number of triggered events to save in `filename`, or None to
+            keep saving events until interrupted.
+        - nbuffers: int
+            Number of event buffers queued to a background writer thread;
+            0 writes each event inline.
+        - codec: str
+            Compression of the datasets, see `writer.compression_options`.
+        - threads: int
+            Compress chunks on a pool of this many threads with direct
+            chunk writes (gzip only); 0 lets hdf5 compress inline.
+        - chunkbytes: int
+            Target size in bytes of each hdf5 chunk.
+        - batch: int
+            Events per channel staged in memory before each write; None
+            writes a whole chunk of events at a time.
+        - maxbytes: int
+            Start a new file once the current one is this many bytes.
+        - maxtime: float
+            Start a new file once the current one is this many seconds old.
+        - panel: bool
+            Also save the scope's full panel setup ('pnsu?') as the binary
+            attribute PANEL_SETUP, see `config.get_panel`.
+        - comm_format: str
+            Transfer 'BYTE' (8 bit) or 'WORD' (16 bit) samples.
+        - packing: str
+            How WORD samples are stored: 'none', 'int16' (shifted to
+            their nominal bits, with the shuffle filter) or 'pack12' (12
+            bit samples bit-packed), see `packing`.
+        - window: (float, float)
+            Transfer only the samples from window[0] to window[1] seconds
+            after the trigger (either may be None).
+        - sparsing: int
+            Transfer only every `sparsing` samples.
+
+    If either `maxbytes` or `maxtime` is given the files are numbered, i.e.
+    run.hdf5 is saved as run_0000.hdf5, run_0001.hdf5, ...
     """
-    scope = LeCroyScope(setup.scope_ip, timeout=20.0)
+    scope = LeCroyScope(setup.scope_ip, timeout=20.0,
+                        comm_format=comm_format)
 
     # turn off the display
     scope.send('display off')
     scope.check_last_command()
 
-    # clear the output queue
-    scope.clear()
-
-    # get active channels
-    channels = scope.getchannels()
-
-    # get scope configuration
-    settings = get_settings(scope)
-
-    # get wave descriptors for each channel
-    # important to do this before queue is primed!
-    # need to trigger in order to get correct wave_array_count
-    scope.trigger()
-
-    time.sleep(5.0)
-
-    wavedesc = {}
-    for channel in channels:
-        wavedesc[channel] = scope.getwavedesc(channel)
-
-    # open up the output file
-    f = h5py.File(filename, 'w')
-
-    # set scope configuration
-    for command, setting in settings.items():
-        f.attrs[command] = setting
-
-    if 'ON' in f.attrs['SEQUENCE']:
-        sequence_count = int(f.attrs['SEQUENCE'].split(',')[1])
-
-        if sequence_count < 1:
-            raise Exception('sequence count must be a positive number.')
-    else:
-        sequence_count = 1
-
-    for channel in channels:
-        nsamples = wavedesc[channel]['wave_array_count']//sequence_count
-
-        f.create_dataset('channel%i' % channel, (nevents, nsamples), dtype=wavedesc[channel]['dtype'], chunks=(max(1,min(100, nevents//100)), nsamples), compression='gzip')
-
-        for key, value in wavedesc[channel].items():
-            try:
-                f['channel%i' % channel].attrs[key] = value
-            except ValueError:
-                pass
-
-    if runattrs is not None:
-        for name in runattrs:
-            for key, value in runattrs[name].items():
-                f[name].attrs[key] = value
-
-    # start a timer
-    time0 = time.time()
+    waveform_setup = None
 
     try:
-        i = 0
-        while True:
-            print '\rsaving event: %i' % i,
-            sys.stdout.flush()
-
-            try:
-                scope.trigger()
-                for channel in channels:
-                    wave_array = scope.getwaveform(channel, wavedesc[channel])
-
-                    if sequence_count > 1:
-                        try:
-                            f['channel%i' % channel][i:i+sequence_count] = \
-                                wave_array.reshape(sequence_count, wave_array.size//sequence_count)
-                        except ValueError:
-                            f['channel%i' % channel][i:i+sequence_count] = \
-                                wave_array.reshape(sequence_count, wave_array.size//sequence_count)[:len(f['channel%i' % channel])-i]
-                    else:
-                        f['channel%i' % channel][i] = wave_array
-
-            except (socket.error, struct.error) as e:
-                print '\n' + str(e)
-                scope.clear()
-                continue
-
-            i += sequence_count
-
-            if i >= nevents:
-                print '\rsaving event: %i' % i,
-                break
+        # clear the output queue
+        scope.clear()
 
-        print
+        # get scope configuration
+        settings = scope.settings()
 
-    except KeyboardInterrupt:
-        print '\nresizing datasets...'
+        if panel:
+            settings[PANEL] = np.void(get_panel(scope))
 
-        for channel in channels:
-            f['channel%i' % channel].resize((i, wavedesc[channel]['wave_array_count']//sequence_count))
-            
-        raise
+        # the operator's transfer setup, restored after a windowed run
+        if window is not None or sparsing > 1:
+            waveform_setup = scope.get_waveform_setup()
+        scope.set_window(*(window or (None, None)), sparsing=sparsing)
 
+        acquire(scope, filename, nevents, runattrs, nbuffers, codec, threads,
+                chunkbytes, batch, maxbytes, maxtime, settings, packing)
     finally:
-        f.close()
-        scope.clear()
-        scope.send('display on')
-        scope.check_last_command()
-
-        elapsed = time.time() - time0
-
-        if i > 0:
-            print 'Completed %i events in %.3f seconds.' % (i, elapsed)
-            print 'Averaged %.5f seconds per acquisition.' % (elapsed/i)
-            print "Wrote to file '%s'." % filename
+        # restore the scope whatever happened to the run
+        try:
+            scope.clear()
+            if waveform_setup is not None:
+                scope.restore_waveform_setup(waveform_setup)
+        finally:
+            scope.send('display on')
+            scope.check_last_command()
 
 if __name__ == '__main__':
     import optparse
-    import run_setup
+    from . import run_setup
 
     usage = "usage: %prog <filename/prefix> [-n] [-r]"
     parser = optparse.OptionParser(usage, version="%prog 0.1.0")
     parser.add_option("-n", type="int", dest="nevents",
-                      help="number of events to store per run", default=1000)
+                      help="number of events to store per run (0 to run "
+                      "until interrupted)", default=1000)
     parser.add_option("-r", type="int", dest="nruns",
                       help="number of runs", default=1)
+    parser.add_option("-b", type="int", dest="nbuffers",
+                      help="event buffers queued to a background writer "
+                      "thread (0 writes inline)", default=0)
+    parser.add_option("--codec", dest="codec",
+                      help="compression: none, lzf, gzip[:level], "
+                      "zstd[:level] or blosc[:cname[:level]]",
+                      default="gzip")
+    parser.add_option("-j", type="int", dest="threads",
+                      help="compress gzip chunks on this many threads",
+                      default=0)
+    parser.add_option("--chunk-bytes", type="int", dest="chunkbytes",
+                      help="target size of each hdf5 chunk in bytes",
+                      default=1 << 20)
+    parser.add_option("--batch", type="int", dest="batch",
+                      help="events staged per write (default: one chunk)",
+                      default=None)
+    parser.add_option("--max-bytes", type="int", dest="maxbytes",
+                      help="start a new numbered file after this many bytes",
+                      default=None)
+    parser.add_option("--max-time", type="float", dest="maxtime",
+                      help="start a new numbered file after this many "
+                      "seconds", default=None)
+    parser.add_option("--panel", action="store_true", dest="panel",
+                      help="also save the scope panel setup", default=False)
+    parser.add_option("--word", action="store_const", const="WORD",
+                      dest="comm_format", help="transfer 16 bit samples "
+                      "(full resolution of >8 bit scopes)", default="BYTE")
+    parser.add_option("--packing", dest="packing", choices=packings,
+                      help="storage of 16 bit samples: none, int16 or "
+                      "pack12", default="none")
+    parser.add_option("--window", dest="window",
+                      help="transfer only START,STOP seconds after the "
+                      "trigger, e.g. -50e-9,150e-9", default=None)
+    parser.add_option("--sparse", type="int", dest="sparsing",
+                      help="transfer only every SPARSE samples", default=1)
     parser.add_option("--time", action="store_true", dest="time",
                       help="append time string to filename", default=False)
     parser.add_option("-c", dest="run_config",
@@ -169,9 +164,17 @@ if __name__ == '__main__':
     if len(args) < 1:
         sys.exit(parser.format_help())
     
-    if options.nevents < 1 or options.nruns < 1:
+    if options.nevents < 0 or options.nruns < 1:
         sys.exit("Please specify a number >= 1 for number of events/runs")
 
+    nevents = options.nevents or None
+
+    if options.window is not None:
+        options.window = [float(t) if t else None for t in
+                          options.window.split(',')]
+        if len(options.window) != 2:
+            sys.exit("--window takes START,STOP")
+
     if options.run_config is not None:
         options.run_config = getattr(run_setup, options.run_config)
 
@@ -192,30 +195,30 @@ if __name__ == '__main__':
 
         runattrs = {'/' : {}}
 
-        print '/'
+        print('/')
 
         for key, fmt in options.run_config['file'].items():
             prompt = '/%s? ' % key
             while True:
                 try:
-                    runattrs['/'][key] = fmt(raw_input(prompt))
+                    runattrs['/'][key] = fmt(input(prompt))
                 except ValueError as e:
-                    print e
+                    print(e)
                     continue
                 break
 
         for name in ['channel%i' % i for i in channels]:
             runattrs[name] = {}
 
-            print '/' + name
+            print('/' + name)
 
             for key, fmt in options.run_config['dataset'].items():
                 prompt = '/%s.%s? ' % (name, key)
                 while True:
                     try:
-                        runattrs[name][key] = fmt(raw_input(prompt))
+                        runattrs[name][key] = fmt(input(prompt))
                     except ValueError as e:
-                        print e
+                        print(e)
                         continue
                     break
     else:
@@ -223,21 +226,26 @@ if __name__ == '__main__':
 
     if options.nruns == 1 and not options.time:
         try:
-            fetch(args[0], options.nevents, runattrs)
+            fetch(args[0], nevents, runattrs, options.nbuffers,
+                  options.codec, options.threads, options.chunkbytes,
+                  options.batch, options.maxbytes, options.maxtime,
+                  options.panel, options.comm_format, options.packing,
+                  options.window, options.sparsing)
         except KeyboardInterrupt:
             pass
     else:
-        import time
-        import string
-
         for i in range(options.nruns):
-            timestr = string.replace(time.asctime(time.localtime()), ' ', '-')
+            timestr = time.asctime(time.localtime()).replace(' ', '-')
             filename = args[0] + '_' + timestr + '.hdf5'
-            print '-' * 65
-            print 'Saving to file %s' % filename
-            print '-' * 65
+            print('-' * 65)
+            print('Saving to file %s' % filename)
+            print('-' * 65)
 
             try:
-                fetch(filename, options.nevents, runattrs)
+                fetch(filename, nevents, runattrs, options.nbuffers,
+                      options.codec, options.threads, options.chunkbytes,
+                      options.batch, options.maxbytes, options.maxtime,
+                      options.panel, options.comm_format,
+                      options.packing, options.window, options.sparsing)
             except KeyboardInterrupt:
                 break
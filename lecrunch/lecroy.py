@@ -15,51 +15,65 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import re
+import time
 import array
-import io #StringIO
 import struct
 import numpy as np
 from . import sock
+from .driver import Driver, store_sequences
 
 # data types in lecroy binary blocks, where:
 # length  -- byte length of type
 # string  -- string representation of type
 # packfmt -- format string for struct.unpack()
+# npfmt   -- format for numpy structured dtypes
 class String:
     length = 16
     string = 'string'
+    packfmt = '16s'
+    npfmt = 'S16'
 class Byte:
     length = 1
     string = 'byte'
     packfmt = 'b'
+    npfmt = 'i1'
 class Word:
     length = 2
     string = 'word'
     packfmt = 'h'
+    npfmt = 'i2'
 class Long:
     length = 4
     string = 'long'
     packfmt = 'l'
+    npfmt = 'i4'
 class Enum:
     length = 2
     string = 'enum'
     packfmt = 'h'
+    npfmt = 'i2'
 class Float:
     length = 4
     string = 'float'
     packfmt = 'f'
+    npfmt = 'f4'
 class Double:
     length = 8
     string = 'double'
     packfmt = 'd'
+    npfmt = 'f8'
 class TimeStamp:
     length = 16
     string = 'time_stamp'
     packfmt = 'dbbbbhh'
+    npfmt = [('seconds', 'f8'), ('minutes', 'i1'), ('hours', 'i1'),
+             ('days', 'i1'), ('months', 'i1'), ('year', 'i2'),
+             ('unused', 'i2')]
 class UnitDefinition:
     length = 48
     string = 'unit_definition'
+    packfmt = '48s'
+    npfmt = 'S48'
 
 # byte length of wavedesc block
 wavedesclength = 346
@@ -123,15 +137,236 @@ wavedesc_template = ( ('descriptor_name'    , 0   , String),
                       ('acq_vert_offset'    , 340 , Float),
                       ('wave_source'        , 344 , Enum) )
 
-class LeCroyScope(sock.Socket):
+# the template compiled once per byte order, as a struct.Struct which unpacks
+# a whole wavedesc block in one call and as a numpy structured dtype which
+# decodes an array of wavedesc blocks at once
+wavedesc_structs = {}
+wavedesc_dtypes = {}
+for endian in '<>':
+    wavedesc_structs[endian] = struct.Struct(endian + ''.join(
+        datatype.packfmt for name, pos, datatype in wavedesc_template))
+    wavedesc_dtypes[endian] = np.dtype(
+        { 'names'    : [name for name, pos, datatype in wavedesc_template],
+          'formats'  : [datatype.npfmt for name, pos, datatype in
+                        wavedesc_template],
+          'offsets'  : [pos for name, pos, datatype in wavedesc_template],
+          'itemsize' : wavedesclength }).newbyteorder(endian)
+del endian
+
+wavedesc_names = [name for name, pos, datatype in wavedesc_template]
+string_names = [name for name, pos, datatype in wavedesc_template
+                if datatype in (String, UnitDefinition)]
+# index of the trigger_time stamp in the flat tuple from struct.unpack()
+timestamp_index = [datatype for name, pos, datatype in
+                   wavedesc_template].index(TimeStamp)
+
+assert wavedesc_structs['<'].size == wavedesclength
+
+def wavedesc_endian(buffer, offset=0):
+    """
+    Returns the struct byte order character of the wavedesc block starting
+    at `offset` in `buffer`, read from its comm_order field.
+    """
+    comm_order = struct.unpack_from('<'+Enum.packfmt, buffer, offset+34)[0]
+    return '>' if comm_order == 0 else '<'
+
+def unpack_wavedesc(buffer, offset=0, endian=None):
+    """
+    Decode the wavedesc block starting at `offset` in `buffer` (any object
+    supporting the buffer protocol) into a dictionary in a single call.
+    """
+    if endian is None:
+        endian = wavedesc_endian(buffer, offset)
+
+    values = list(wavedesc_structs[endian].unpack_from(buffer, offset))
+
+    # fold the flattened time stamp back into a single tuple
+    values[timestamp_index:timestamp_index+7] = \
+        [tuple(values[timestamp_index:timestamp_index+7])]
+
+    wavedesc = dict(zip(wavedesc_names, values))
+    for name in string_names:
+        wavedesc[name] = wavedesc[name].rstrip(b'\x00')
+    return wavedesc
+
+def unpack_wavedescs(buffer, count=-1, offset=0, endian=None):
+    """
+    Decode `count` consecutive wavedesc blocks starting at `offset` in
+    `buffer` into a numpy structured array with one record per block and
+    one field per entry in `wavedesc_template`. The array is a view of
+    `buffer`; nothing is copied.
+    """
+    if endian is None:
+        endian = wavedesc_endian(buffer, offset)
+
+    return np.frombuffer(buffer, wavedesc_dtypes[endian], count, offset)
+
+# dtype of one entry of the trigtime array of a sequence acquisition: the
+# time of each segment's trigger relative to the first and the time from the
+# trigger to the first sample of the segment, in seconds
+trigtime_dtype = np.dtype([('trigger_time', 'f8'), ('trigger_offset', 'f8')])
+
+def blockoffset(msg):
+    """
+    Returns the offset of the data in the reply `msg`, which is prefixed by
+    a command header and a definite length block header '#<n><n digits>'.
+    """
+    pos = msg[:64].tobytes().find(b'#')
+    if pos < 0:
+        raise RuntimeError('no definite length block in reply.')
+    return pos + 2 + int(chr(msg[pos+1]))
+
+def blocklength(msg):
+    """
+    Returns the number of bytes in the definite length block of the reply
+    `msg`, as given by its block header.
+    """
+    pos = msg[:64].tobytes().find(b'#')
+    if pos < 0:
+        raise RuntimeError('no definite length block in reply.')
+    ndigits = int(chr(msg[pos+1]))
+    return int(msg[pos+2:pos+2+ndigits].tobytes())
+
+def decodewavedesc(msg, channel):
+    """
+    Decode the reply `msg` to a 'wf? desc' query for `channel` into a
+    dictionary of the wavedesc fields.
+    """
+    if not int(msg[1]) == channel + 48:
+        raise RuntimeError('waveforms out of sync or comm_header is off.')
+
+    # the descriptor follows a short '#9<count>' block header
+    startpos = msg[:64].tobytes().find(b'WAVEDESC')
+    if startpos < 0:
+        raise RuntimeError('no WAVEDESC block in reply.')
+
+    endian = wavedesc_endian(msg, startpos)
+
+    wavedesc = unpack_wavedesc(msg, startpos, endian)
+    wavedesc['little_endian'] = endian == '<'
+
+    # determine data type, in the byte order given by comm_order
+    if wavedesc['comm_type'] == 0:
+        wavedesc['dtype'] = np.dtype(np.int8)
+    elif wavedesc['comm_type'] == 1:
+        wavedesc['dtype'] = np.dtype(np.int16).newbyteorder(endian)
+    else:
+        raise Exception('unknown comm_type.')
+
+    return wavedesc
+
+def decodewaveform(msg, channel, wavedesc, out=None):
+    """
+    Decode the reply `msg` to a 'wf? dat1' query for `channel`. Returns a
+    numpy array which is a view of `msg`, or if `out` is given copies the
+    samples into `out` (converting byte order and dtype as needed) and
+    returns it.
+    """
+    if not int(msg[1]) == channel + 48:
+        raise RuntimeError('waveforms out of sync or comm_header is off.')
+
+    data = np.frombuffer(msg, wavedesc['dtype'],
+                         wavedesc['wave_array_count'], blockoffset(msg))
+
+    if out is None:
+        return data
+
+    np.copyto(out, data.reshape(out.shape), casting='unsafe')
+    return out
+
+def decodesequence(msg, channel):
+    """
+    Decode the reply `msg` to a 'wf? all' query for `channel`, which holds
+    the wavedesc, user text, trigtime array and data array of an
+    acquisition. Returns the tuple (wavedesc, waveforms, trigtimes) where
+    `waveforms` is a (segments, samples) array and `trigtimes` a record
+    array of `trigtime_dtype`, one per segment; both are views of `msg`.
+    """
+    wavedesc = decodewavedesc(msg, channel)
+
+    endian = '<' if wavedesc['little_endian'] else '>'
+    segments = max(1, wavedesc['subarray_count'])
+
+    # the blocks follow the wavedesc in the order of their lengths in it
+    offset = msg[:64].tobytes().find(b'WAVEDESC')
+    offset += wavedesc['wave_descriptor'] + wavedesc['user_text'] + \
+        wavedesc['res_desc1']
+
+    trigtimes = np.frombuffer(msg, trigtime_dtype.newbyteorder(endian),
+                              wavedesc['trigtime_array']//16, offset)
+
+    offset += wavedesc['trigtime_array'] + wavedesc['ris_time_array'] + \
+        wavedesc['res_array1']
+
+    waveforms = np.frombuffer(msg, wavedesc['dtype'],
+                              wavedesc['wave_array_count'], offset)
+
+    return wavedesc, waveforms.reshape(segments, -1), trigtimes
+
+def sequence_count(setting):
+    """
+    Returns the number of segments per trigger given the reply to a
+    'sequence?' query, e.g. 'SEQ ON,100,25E+3 SAMPLE', or 1 if sequence
+    mode is off.
+    """
+    if isinstance(setting, bytes):
+        setting = setting.decode()
+
+    if 'ON' not in setting:
+        return 1
+
+    count = int(setting.split(',')[1])
+    if count < 1:
+        raise Exception('sequence count must be a positive number.')
+    return count
+
+def window_points(wavedesc, start=None, stop=None, sparsing=1):
+    """
+    Returns the (first point, number of points) for WAVEFORM_SETUP which
+    transfer every `sparsing` samples from `start` to `stop` seconds after
+    the trigger (None for the start or end of the record) of the segments
+    of a whole record described by `wavedesc`.
+    """
+    nsamples = wavedesc['wave_array_count'] // \
+        max(1, wavedesc['nom_subarray_count'])
+    dt = wavedesc['horiz_interval']
+    t0 = wavedesc['horiz_offset']
+
+    first = 0
+    last = nsamples - 1
+    if start is not None:
+        first = int(min(max(round((start - t0)/dt), 0), last))
+    if stop is not None:
+        last = int(min(max(round((stop - t0)/dt), first), last))
+
+    return first, (last - first)//max(1, sparsing) + 1
+
+comm_formats = ('BYTE', 'WORD')
+
+class LeCroyScope(sock.Socket, Driver):
     """
     A class for triggering and fetching waveforms from the oscilloscope.
+
+    Samples are transferred as 8 bit bytes or, with `comm_format` 'WORD',
+    as 16 bit words, which keep the full resolution of scopes with more
+    than 8 bits (see `packing` for storing them compactly).
     """
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, comm_format='BYTE', **kwargs):
+        if comm_format.upper() not in comm_formats:
+            raise Exception('comm_format must be one of %s.' %
+                            ', '.join(comm_formats))
         super(LeCroyScope, self).__init__(*args, **kwargs)
+        # receive buffer reused by getwaveform(..., out=...)
+        self.buffer = bytearray()
+        # state of the driver interface, set by descriptors() and
+        # events_per_trigger()
+        self.wavedescs = {}
+        self.sequence_count = 1
+        # (start, stop, sparsing) of the transfer, see set_window()
+        self.window = None
         self.send('comm_header short')
         self.check_last_command()
-        self.send('comm_format DEF9,BYTE,BIN')
+        self.send('comm_format DEF9,%s,BIN' % comm_format.upper())
         self.check_last_command()
 
     def getchannels(self):
@@ -139,7 +374,7 @@ class LeCroyScope(sock.Socket):
         channels = []
         for i in range(1, 5):
             self.send('c%i:trace?' %i)
-            if 'ON' in self.recv():
+            if 'ON' in self.recv().decode():
                 channels.append(i)
         return channels
 
@@ -153,53 +388,17 @@ class LeCroyScope(sock.Socket):
 
         self.send('c%s:wf? desc' % str(channel))
 
-        msg = self.recv() #bytes object
-        if not int(msg[1]) == channel + 48:
-            raise RuntimeError('waveforms out of sync or comm_header is off.')
-
-        data = io.BytesIO(msg)
-        startpos = re.search('WAVEDESC'.encode(), data.read()).start()
-        # startpos = re.search('WAVEDESC'.encode(), msg) #get the start position of the data
-
-        wavedesc = {}
-
-        # check endian
-        data.seek(startpos + 34)
-        if struct.unpack('<'+Enum.packfmt, data.read(Enum.length))[0] == 0:
-            endian = '>'
-            wavedesc['little_endian'] = True
-            np.little_endian = True
-        else:
-            endian = '<'
-            wavedesc['little_endian'] = False
-            np.little_endian = False
-
-        data.seek(startpos)
-
-        # build dictionary of wave description
-        for name, pos, datatype in wavedesc_template:
-            raw = data.read(datatype.length)
-            if datatype in (String, UnitDefinition):
-                wavedesc[name] = raw.rstrip(b'\x00')
-            elif datatype in (TimeStamp,):
-                wavedesc[name] = struct.unpack(endian+datatype.packfmt, raw)
-            else:
-                wavedesc[name] = struct.unpack(endian+datatype.packfmt, raw)[0]
-
-        # determine data type
-        if wavedesc['comm_type'] == 0:
-            wavedesc['dtype'] = np.int8
-        elif wavedesc['comm_type'] == 1:
-            wavedesc['dtype'] = np.int16
-        else:
-            raise Exception('unknown comm_type.')
-            
-        return wavedesc
+        return decodewavedesc(self.recv_buffer(), channel)
 
-    def getwaveform(self, channel, wavedesc):
+    def getwaveform(self, channel, wavedesc, out=None):
         """
         Request, process, and return the voltage array for channel number
         `channel` from the oscilloscope as a numpy array.
+
+        The array is a view of the received reply, so nothing is copied. If
+        `out` is given, the reply is received into a buffer kept by the
+        scope and decoded into `out` (converting byte order and dtype as
+        needed) so acquisition loops can reuse the same memory.
         """ 
 
         if channel not in range(1, 5):
@@ -207,8 +406,175 @@ class LeCroyScope(sock.Socket):
 
         self.send('c%s:wf? dat1' % str(channel))
 
-        msg = self.recv()
-        if not int(msg[1]) == channel + 48:
-            raise RuntimeError('waveforms out of sync or comm_header is off.')
+        return self.readwaveform(channel, wavedesc, out)
+
+    def getwaveforms(self, channels, wavedescs, out=None):
+        """
+        Request the waveforms of every channel in `channels` at once and
+        return a dictionary of numpy arrays keyed by channel number.
+
+        All of the queries are sent back-to-back before any reply is read,
+        so a trigger costs a single round trip rather than one per channel.
+        `wavedescs` and `out` (optional) are dictionaries keyed by channel
+        number as for `getwaveform`.
+        """
+        for channel in channels:
+            if channel not in range(1, 5):
+                raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        self.sendmany(['c%i:wf? dat1' % channel for channel in channels])
+
+        waveforms = {}
+        for channel in channels:
+            waveforms[channel] = self.readwaveform(
+                channel, wavedescs[channel],
+                None if out is None else out[channel])
+        return waveforms
+
+    def getsequence(self, channel):
+        """
+        Fetch the wavedesc, trigger times and every segment of the last
+        acquisition on `channel` in a single 'wf? all' transfer. Returns
+        (wavedesc, waveforms, trigtimes) as `decodesequence`.
+        """
+        if channel not in range(1, 5):
+            raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        self.send('c%s:wf? all' % str(channel))
+
+        return decodesequence(self.recv_buffer(), channel)
+
+    def getsequences(self, channels):
+        """
+        Request 'wf? all' for every channel in `channels` at once and
+        return a dictionary of (wavedesc, waveforms, trigtimes) tuples keyed
+        by channel number.
+        """
+        for channel in channels:
+            if channel not in range(1, 5):
+                raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        self.sendmany(['c%i:wf? all' % channel for channel in channels])
+
+        sequences = {}
+        for channel in channels:
+            sequences[channel] = decodesequence(self.recv_buffer(), channel)
+        return sequences
+
+    def set_waveform_setup(self, sparsing=0, npoints=0, first=0, segment=0):
+        """
+        Limit the samples transferred by 'wf?' (WAVEFORM_SETUP) to every
+        `sparsing` of `npoints` points from point `first` of segment
+        `segment`. 0 means every point, all points, and all segments. The
+        wavedesc sent with the samples gives their first_point and
+        sparsing_factor, see `scaling.time_axis`.
+        """
+        self.send('waveform_setup sp,%i,np,%i,fp,%i,sn,%i' %
+                  (sparsing, npoints, first, segment))
+        self.check_last_command()
+
+    def get_waveform_setup(self):
+        """
+        Returns the current WAVEFORM_SETUP as sent back by the scope, e.g.
+        'SP,0,NP,0,FP,0,SN,0', which `restore_waveform_setup` sends back.
+        """
+        self.send('waveform_setup?')
+        return self.recv().decode().strip().split(' ', 1)[-1]
+
+    def restore_waveform_setup(self, setup):
+        """Restore a WAVEFORM_SETUP saved by `get_waveform_setup`."""
+        self.send('waveform_setup %s' % setup)
+        self.check_last_command()
+
+    def set_window(self, start=None, stop=None, sparsing=1):
+        """
+        Transfer only every `sparsing` samples from `start` to `stop`
+        seconds after the trigger (None for the start or end of the record)
+        from the next call to `descriptors()` on, which works out the points
+        from the whole record, see `window_points`. E.g. the 200 ns around
+        a pulse in a 10 us record is 2% of the bytes.
+        """
+        if start is None and stop is None and sparsing <= 1:
+            self.window = None
+        else:
+            self.window = (start, stop, sparsing)
+
+    # driver interface, see driver.Driver
+
+    def active_channels(self):
+        return self.getchannels()
+
+    def settings(self):
+        from .config import get_settings
+        return get_settings(self)
+
+    def descriptors(self, channels, wait=5.0):
+        if self.window is not None:
+            # the window is worked out from a whole record
+            self.set_waveform_setup()
+
+        # need to trigger in order to get correct wave_array_count
+        self.trigger()
+        time.sleep(wait)
+
+        if self.window is not None and channels:
+            start, stop, sparsing = self.window
+            first, npoints = window_points(self.getwavedesc(channels[0]),
+                                           start, stop, sparsing)
+            self.set_waveform_setup(sparsing, npoints, first)
+
+        self.wavedescs = dict((channel, self.getwavedesc(channel)) for
+                              channel in channels)
+        return self.wavedescs
+
+    def events_per_trigger(self):
+        self.send('sequence?')
+        self.sequence_count = sequence_count(self.recv())
+        return self.sequence_count
+
+    def arm(self):
+        self.trigger()
+
+    def read_batch(self, channels, buffers, rearm=False):
+        """
+        Receive the last acquisition of `channels` into `buffers`: every
+        segment and its trigger time with 'wf? all' in sequence mode, else
+        the waveform with 'wf? dat1'. The queries, and the 'arm;wait' of the
+        next acquisition if `rearm`, are sent in a single write.
+        """
+        for channel in channels:
+            if channel not in range(1, 5):
+                raise Exception('channel must be in %s.' % str(range(1, 5)))
+
+        if self.sequence_count > 1:
+            msgs = ['c%i:wf? all' % channel for channel in channels]
+        else:
+            msgs = ['c%i:wf? dat1' % channel for channel in channels]
+        if rearm:
+            msgs.append('arm;wait')
+        self.sendmany(msgs)
+
+        if self.sequence_count > 1:
+            return store_sequences(dict((channel, decodesequence(
+                self.recv_buffer(), channel)) for channel in channels),
+                buffers)
+
+        for channel in channels:
+            self.readwaveform(channel, self.wavedescs[channel],
+                              buffers[channel])
+        return 1
+
+    def readwaveform(self, channel, wavedesc, out=None):
+        """
+        Receive and decode the reply to a 'wf? dat1' query for `channel`.
+        """
+        if out is None:
+            return decodewaveform(self.recv_buffer(), channel, wavedesc)
 
-        return np.fromstring(msg[22:], wavedesc['dtype'], wavedesc['wave_array_count'])
+        msg = self.recv_buffer(self.buffer)
+        # reuse the buffer if it had to be replaced by a larger one
+        self.buffer = msg.obj
+        try:
+            return decodewaveform(msg, channel, wavedesc, out)
+        finally:
+            msg.release()
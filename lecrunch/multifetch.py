@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Fetch waveforms from several oscilloscopes at once. Every scope is armed and
+read out concurrently from a single asyncio event loop, and the traces are
+saved to one hdf5 file with a group per scope, 'scope0/channel1', ..., in
+which event i of every dataset belongs to the same trigger cycle.
+
+Unlike fetch and the tektronix script this does not go through
+`engine.acquire`: the engine drives a single synchronous `driver.Driver`,
+while here the scopes are read concurrently on the event loop and their
+datasets are grouped by scope. The datasets and the writer are the same.
+
+Example:
+    >>> python -m lecrunch.multifetch test.hdf5 192.168.1.10 192.168.1.11
+    saving event: 1000
+    Completed 1000 events in 8.104 seconds.
+    Averaged 0.00810 seconds per acquisition.
+    Wrote to file 'test.hdf5'.
+"""
+
+import sys
+import time
+import socket
+import struct
+import asyncio
+import h5py
+from .asyncscope import AsyncLeCroyScope
+from . import lecroy
+from .writer import EventWriter
+from .engine import create_datasets
+from .driver import store_sequences
+
+def parse_address(address, port=1861):
+    """Split 'host[:port]' into (host, port)."""
+    host, _, p = address.partition(':')
+    return host, int(p) if p else port
+
+async def prepare(scope):
+    """
+    Returns the active channels, settings, sequence count and wave
+    descriptors of `scope`.
+    """
+    await scope.send('display off')
+    await scope.check_last_command()
+    await scope.clear()
+
+    channels = await scope.getchannels()
+    settings = await scope.get_settings()
+
+    sequence_count = lecroy.sequence_count(settings['SEQUENCE'])
+
+    # need to trigger in order to get correct wave_array_count
+    await scope.trigger()
+
+    wavedesc = {}
+    for channel in channels:
+        wavedesc[channel] = await scope.getwavedesc(channel)
+
+    return channels, settings, sequence_count, wavedesc
+
+async def restore(scope):
+    """Clear `scope`, turn its display back on and close it."""
+    try:
+        await scope.clear()
+        await scope.send('display on')
+        await scope.check_last_command()
+    finally:
+        scope.close()
+
+async def acquire(scope, channels, wavedesc, buffers, sequence_count=1):
+    """
+    Trigger `scope` and receive its waveforms into `buffers`. Returns the
+    number of events received, see `driver.store_sequences`.
+    """
+    await scope.trigger()
+    if sequence_count > 1:
+        return store_sequences(await scope.getsequences(channels), buffers)
+    await scope.getwaveforms(channels, wavedesc, buffers)
+    return 1
+
+async def open_scopes(addresses, timeout):
+    """
+    Connect to the scopes at `addresses`. If any of them fails, the others
+    are closed again before the error is raised.
+    """
+    scopes = await asyncio.gather(*(AsyncLeCroyScope.open(
+        *parse_address(address), timeout=timeout) for address in addresses),
+        return_exceptions=True)
+
+    errors = [scope for scope in scopes if isinstance(scope, BaseException)]
+    if errors:
+        for scope in scopes:
+            if not isinstance(scope, BaseException):
+                scope.close()
+        raise errors[0]
+
+    return scopes
+
+async def afetch(filename, addresses, nevents, nbuffers=0, codec='gzip',
+                 threads=0, chunkbytes=1 << 20, timeout=20.0, maxretries=5):
+    """
+    Coroutine which fetches `nevents` events from the scopes at `addresses`
+    ('host' or 'host:port') into `filename`. See `fetch`.
+    """
+    scopes = await open_scopes(addresses, timeout)
+
+    try:
+        # let every scope finish preparing before restoring any of them
+        setups = await asyncio.gather(*(prepare(scope) for scope in scopes),
+                                      return_exceptions=True)
+        for setup in setups:
+            if isinstance(setup, BaseException):
+                raise setup
+
+        sequence_counts = set(setup[2] for setup in setups)
+        if len(sequence_counts) != 1:
+            raise Exception('every scope must use the same sequence count.')
+        sequence_count = sequence_counts.pop()
+
+        f = h5py.File(filename, 'w')
+
+        try:
+            # datasets of every scope keyed by (scope index, channel)
+            datasets = {}
+            keys = []
+            for k, (address, setup) in enumerate(zip(addresses, setups)):
+                channels, settings, _, wavedesc = setup
+                group = f.create_group('scope%i' % k)
+                group.attrs['address'] = address
+                scope_datasets = create_datasets(group, settings, wavedesc,
+                    sequence_count, nevents, codec, chunkbytes)
+                for key, dataset in scope_datasets.items():
+                    datasets[(k, key)] = dataset
+                keys.append(list(scope_datasets))
+
+            writer = EventWriter(datasets, sequence_count, nbuffers, threads)
+
+            loop = asyncio.get_running_loop()
+
+            time0 = time.time()
+
+            i = 0
+
+            # consecutive failed reads
+            retries = 0
+
+            try:
+                while i < nevents:
+                    print('\rsaving event: %i' % i, end=' ')
+                    sys.stdout.flush()
+
+                    # blocks while every buffer is waiting on the writer, so
+                    # wait off the event loop
+                    buffers = await loop.run_in_executor(None,
+                                                         writer.getbuffers)
+
+                    try:
+                        counts = await asyncio.gather(*(acquire(scope,
+                            channels, wavedesc,
+                            dict((key, buffers[(k, key)]) for key in keys[k]),
+                            sequence_count) for k, (scope,
+                            (channels, _, _, wavedesc)) in
+                            enumerate(zip(scopes, setups))))
+                    except (socket.error, struct.error,
+                            asyncio.TimeoutError) as e:
+                        print('\n' + str(e))
+                        writer.release(buffers)
+                        retries += 1
+                        if retries > maxretries:
+                            print('giving up after %i failed reads.' %
+                                  retries)
+                            raise
+                        await asyncio.gather(*(scope.clear() for scope in
+                                               scopes))
+                        continue
+
+                    retries = 0
+
+                    # events which every scope filled
+                    n = min(min(counts), nevents - i)
+                    writer.put(i, n, buffers)
+
+                    i += n
+
+                print('\rsaving event: %i' % i)
+
+            finally:
+                try:
+                    writer.close()
+                finally:
+                    for dataset in datasets.values():
+                        dataset.resize(i, axis=0)
+
+                elapsed = time.time() - time0
+
+                if i > 0:
+                    print('Completed %i events in %.3f seconds.' %
+                          (i, elapsed))
+                    print('Averaged %.5f seconds per acquisition.' %
+                          (elapsed/i))
+                    print("Wrote to file '%s'." % filename)
+        finally:
+            f.close()
+    finally:
+        # restore every scope even if one of them fails
+        errors = await asyncio.gather(*(restore(scope) for scope in scopes),
+                                      return_exceptions=True)
+        for address, error in zip(addresses, errors):
+            if error is not None:
+                print('\nfailed to restore %s: %s' % (address, error))
+
+def fetch(filename, addresses, nevents, nbuffers=0, codec='gzip',
+          threads=0, chunkbytes=1 << 20, timeout=20.0, maxretries=5):
+    """
+    Fetch and save waveform traces from several oscilloscopes at once.
+
+    Args:
+        - filename: str
+            Filename to store traces in (in hdf5 format).
+        - addresses: list of str
+            Scope addresses as 'host' or 'host:port'.
+        - nevents: int
+            Number of triggered events to save in `filename`.
+        - maxretries: int
+            Failed reads retried in a row, after clearing every scope,
+            before the error is raised.
+
+    The remaining arguments are as for `fetch.fetch`.
+    """
+    asyncio.run(afetch(filename, addresses, nevents, nbuffers, codec,
+                       threads, chunkbytes, timeout, maxretries))
+
+if __name__ == '__main__':
+    import optparse
+
+    usage = "usage: %prog <filename> <host[:port]> [<host[:port]> ...] [-n]"
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-n", type="int", dest="nevents",
+                      help="number of events to store", default=1000)
+    parser.add_option("-b", type="int", dest="nbuffers",
+                      help="event buffers queued to a background writer "
+                      "thread (0 writes inline)", default=0)
+    parser.add_option("--codec", dest="codec",
+                      help="compression: none, lzf, gzip[:level], "
+                      "zstd[:level] or blosc[:cname[:level]]",
+                      default="gzip")
+    parser.add_option("-j", type="int", dest="threads",
+                      help="compress gzip chunks on this many threads",
+                      default=0)
+    (options, args) = parser.parse_args()
+
+    if len(args) < 2:
+        sys.exit(parser.format_help())
+
+    try:
+        fetch(args[0], args[1:], options.nevents, options.nbuffers,
+              options.codec, options.threads)
+    except KeyboardInterrupt:
+        pass
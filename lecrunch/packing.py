@@ -0,0 +1,156 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Store the samples of scopes with more than 8 bits of resolution, read with
+comm_format WORD, without doubling the size of the file. The scope sends
+16 bit words with the `bits` bit ADC code in the high bits; a packing turns
+each block of events into one of:
+
+    int16   the codes shifted down to the low bits, for the hdf5 shuffle
+            filter to pack the mostly constant high bytes away
+    pack12  two 12 bit codes in every three bytes, stored as uint8; the
+            packed bytes hardly compress, so use it without a codec (or
+            with lzf) where disk bandwidth rather than space is the limit
+
+Packed datasets hold the codes, so their vertical_gain, min_value and
+max_value attributes are those of the codes rather than of the words, and
+carry the attributes 'packing', 'packed_bits', 'packed_nsamples' and
+'packed_dtype' from which `Packer.from_attrs` rebuilds the packer that
+`reader`, `scaling` and `writer` use to unpack them.
+
+Example:
+    >>> packer = Packer('pack12', 1000, bits=12)
+    >>> packed = packer.pack(words)           # (n, 1500) uint8
+    >>> codes = packer.unpack(packed)         # (n, 1000) int16
+"""
+
+import numpy as np
+
+packings = ('none', 'int16', 'pack12')
+
+class Packer(object):
+    """
+    Pack rows of `nsamples` words of `dtype` holding `bits` bit codes
+    with `packing`, one of 'int16' or 'pack12'.
+    """
+    def __init__(self, packing, nsamples, bits=12, dtype=np.int16):
+        if packing not in ('int16', 'pack12'):
+            raise Exception('unknown packing %s.' % packing)
+        if packing == 'pack12' and bits > 12:
+            raise Exception('pack12 needs samples of at most 12 bits, not %i.'
+                            % bits)
+
+        self.packing = packing
+        self.nsamples = nsamples
+        self.bits = bits
+        self.shift = 8*np.dtype(dtype).itemsize - bits
+        self.rawdtype = np.dtype(dtype)
+
+        if packing == 'int16':
+            self.dtype = np.dtype(np.int16)
+            self.width = nsamples
+        else:
+            self.dtype = np.dtype(np.uint8)
+            self.width = 3*((nsamples + 1)//2)
+
+    @classmethod
+    def from_attrs(cls, attrs):
+        """
+        Returns the packer of a dataset with the hdf5 attributes `attrs`,
+        or None if it is not packed.
+        """
+        packing = attrs.get('packing')
+        if isinstance(packing, bytes):
+            packing = packing.decode()
+        if packing in (None, 'none'):
+            return None
+
+        dtype = attrs.get('packed_dtype', np.int16)
+        if isinstance(dtype, bytes):
+            dtype = dtype.decode()
+        return cls(packing, int(attrs['packed_nsamples']),
+                   int(attrs['packed_bits']), dtype)
+
+    def attrs(self):
+        """Returns the hdf5 attributes which describe the packing."""
+        return { 'packing'         : self.packing,
+                 'packed_bits'     : self.bits,
+                 'packed_nsamples' : self.nsamples,
+                 'packed_dtype'    : self.rawdtype.str }
+
+    def wavedesc(self, wavedesc):
+        """Returns a copy of `wavedesc` which describes the codes."""
+        wavedesc = dict(wavedesc)
+        factor = 2**self.shift
+        wavedesc['vertical_gain'] = wavedesc['vertical_gain']*factor
+        for name in ('min_value', 'max_value'):
+            if name in wavedesc:
+                wavedesc[name] = wavedesc[name]/factor
+        wavedesc['dtype'] = self.dtype
+        return wavedesc
+
+    def pack(self, words, out=None):
+        """
+        Returns the rows of `words` (the last axis holding `nsamples`
+        samples) packed into `out` or a new array.
+        """
+        shape = words.shape[:-1]
+        if out is None:
+            out = np.empty(shape + (self.width,), self.dtype)
+
+        if self.packing == 'int16':
+            np.right_shift(words, self.shift, out=out, casting='unsafe')
+            return out
+
+        # the codes as 12 bit unsigned, padded to an even number
+        codes = np.zeros(shape + (2*((self.nsamples + 1)//2),), np.uint16)
+        np.right_shift(words, self.shift, out=codes[..., :self.nsamples],
+                       casting='unsafe')
+        codes &= 0xfff
+
+        a = codes[..., 0::2]
+        b = codes[..., 1::2]
+        out[..., 0::3] = a & 0xff
+        out[..., 1::3] = (a >> 8) | ((b & 0xf) << 4)
+        out[..., 2::3] = b >> 4
+        return out
+
+    def unpack(self, packed, out=None):
+        """
+        Returns the codes of the rows of `packed` as int16 in `out` or a
+        new array.
+        """
+        shape = packed.shape[:-1]
+        if out is None:
+            out = np.empty(shape + (self.nsamples,), np.int16)
+
+        if self.packing == 'int16':
+            out[...] = packed
+            return out
+
+        b0 = packed[..., 0::3].astype(np.uint16)
+        b1 = packed[..., 1::3].astype(np.uint16)
+        b2 = packed[..., 2::3].astype(np.uint16)
+
+        codes = np.empty(shape + (2*b0.shape[-1],), np.uint16)
+        codes[..., 0::2] = b0 | ((b1 & 0xf) << 8)
+        codes[..., 1::2] = (b1 >> 4) | (b2 << 4)
+
+        # sign extend from 12 bits
+        codes ^= 0x800
+        np.subtract(codes[..., :self.nsamples].view(np.int16), 0x800,
+                    out=out)
+        return out
@@ -0,0 +1,268 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Read the hdf5 files saved by fetch without loading them into memory.
+
+Each channel is a `Channel` whose events are read and scaled to volts only
+when indexed, and which iterates over events a block of whole chunks at a
+time. Uncompressed datasets with a contiguous layout (e.g. after
+`h5repack -l CONTI`) are memory mapped and read without going through
+hdf5. Packed datasets (see `packing`) are unpacked as they are read. The
+wavedesc of each channel is read once into a `WaveDesc` with typed fields.
+
+Example:
+    >>> with RunFile('run.hdf5') as run:
+    ...     ch1 = run[1]
+    ...     print(len(ch1), ch1.wavedesc.vertical_gain)
+    ...     volts = ch1[1000:2000]
+    ...     for i, events in run.iter_events():
+    ...         pass
+"""
+
+from collections import namedtuple
+import numpy as np
+import h5py
+from .lecroy import wavedesc_template, String, UnitDefinition, Float, \
+    Double, TimeStamp
+from .scaling import scale, iter_raw, time_axis
+from .packing import Packer
+
+class WaveDesc(namedtuple('WaveDesc', [name for name, pos, datatype in
+                                       wavedesc_template] +
+                          ['little_endian'])):
+    """
+    The wavedesc of a saved channel. Fields can be read as attributes or,
+    like the wavedesc dictionaries from `lecroy`, by name.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+def read_wavedesc(attrs):
+    """
+    Returns a `WaveDesc` from the hdf5 attributes `attrs` of a channel with
+    each field converted to the python type of its wavedesc datatype. Fields
+    missing from `attrs` are None.
+    """
+    types = dict((name, datatype) for name, pos, datatype in
+                 wavedesc_template)
+
+    fields = {}
+    for name in WaveDesc._fields:
+        if name not in attrs:
+            fields[name] = None
+            continue
+
+        value = attrs[name]
+        datatype = types.get(name)
+        if datatype in (String, UnitDefinition):
+            fields[name] = value.decode() if isinstance(value, bytes) else \
+                str(value)
+        elif datatype in (Float, Double):
+            fields[name] = float(value)
+        elif datatype is TimeStamp:
+            fields[name] = tuple(np.asarray(value).tolist())
+        elif datatype is None:
+            fields[name] = bool(value)
+        else:
+            fields[name] = int(value)
+
+    return WaveDesc(**fields)
+
+def mmap_dataset(dataset):
+    """
+    Returns a read-only numpy memmap of `dataset` if it is stored
+    contiguously without filters, or None.
+    """
+    if dataset.chunks is not None or dataset.compression is not None:
+        return None
+
+    offset = dataset.id.get_offset()
+    if offset is None:
+        # no data written yet
+        return None
+
+    return np.memmap(dataset.file.filename, dataset.dtype, 'r', offset,
+                     dataset.shape)
+
+class Channel(object):
+    """
+    The events of a channel dataset saved by fetch. Indexing returns events
+    in volts, e.g. `channel[10:20]`; `raw` returns the samples as saved.
+    """
+    def __init__(self, dataset, trigtimes=None, dtype=np.float32):
+        self.dataset = dataset
+        self.name = dataset.name
+        self.wavedesc = read_wavedesc(dataset.attrs)
+        self.packer = Packer.from_attrs(dataset.attrs)
+        self.gain = self.wavedesc.vertical_gain
+        self.offset = self.wavedesc.vertical_offset
+        self.time = time_axis(self.wavedesc, self.shape[1])
+        self.trigtimes = trigtimes
+        self.dtype = np.dtype(dtype)
+        self.mmap = mmap_dataset(dataset)
+
+        if dataset.chunks is not None:
+            self.chunkrows = dataset.chunks[0]
+        else:
+            self.chunkrows = max(1, (1 << 20)//max(1, dataset.shape[1] *
+                                                   dataset.dtype.itemsize))
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    @property
+    def shape(self):
+        if self.packer is None:
+            return self.dataset.shape
+        return (len(self), self.packer.nsamples)
+
+    @property
+    def raw_dtype(self):
+        """The dtype of the raw samples, once unpacked."""
+        if self.packer is None:
+            return self.dataset.dtype
+        return np.dtype(np.int16)
+
+    def raw(self, index=np.s_[:]):
+        """Returns the events selected by `index` as saved (unpacked)."""
+        if self.packer is None:
+            if self.mmap is not None:
+                return np.asarray(self.mmap[index])
+            return self.dataset[index]
+
+        # select the events, then the samples once they are unpacked
+        if not isinstance(index, tuple):
+            index = (index,)
+        if self.mmap is not None:
+            packed = np.asarray(self.mmap[index[0]])
+        else:
+            packed = self.dataset[index[0]]
+        return self.packer.unpack(packed)[(Ellipsis,) + index[1:]]
+
+    def __getitem__(self, index):
+        if self.mmap is None and isinstance(index, slice) and \
+                index.step in (None, 1):
+            # read whole chunks at a time straight into the output
+            start, stop, step = index.indices(len(self))
+            out = np.empty((max(0, stop - start),) + self.shape[1:],
+                           self.dtype)
+            for i, raw in iter_raw(self.dataset, start, stop):
+                scale(raw, self.gain, self.offset,
+                      out[i-start:i-start+len(raw)])
+            return out
+
+        return scale(self.raw(index), self.gain, self.offset,
+                     dtype=self.dtype)
+
+    def iter_blocks(self, start=0, stop=None, rows=None, raw=False,
+                    align=True):
+        """
+        Iterate over the events `start` to `stop` in blocks aligned with
+        the chunks of the dataset, yielding (first event, events). Blocks
+        hold `rows` events (rounded to whole chunks if `align` is true,
+        default one chunk). Events are in volts unless `raw` is true. The
+        arrays yielded are reused, so copy them to keep them.
+        """
+        if align:
+            rows = self.chunkrows*max(1, -(-(rows or 1)//self.chunkrows))
+        else:
+            rows = rows or self.chunkrows
+
+        out = None if raw else np.empty((rows,) + self.shape[1:], self.dtype)
+
+        for i, block in iter_raw(self.dataset, start, stop, rows, self.mmap):
+            if raw:
+                yield i, block
+            else:
+                yield i, scale(block, self.gain, self.offset,
+                               out[:len(block)])
+
+class RunFile(object):
+    """
+    A run file saved by fetch, or one scope `group` of a file saved by
+    multifetch (e.g. 'scope0'). Channels are `Channel` objects found by
+    number, `run[1]`, or by name, `run['channel1']`.
+    """
+    def __init__(self, filename, group='/', dtype=np.float32):
+        self.file = h5py.File(filename, 'r')
+        self.group = self.file[group]
+        self.settings = dict(self.group.attrs.items())
+
+        trigtimes = self.group.get('trigtime')
+
+        self.channels = {}
+        for name, dataset in self.group.items():
+            if not isinstance(dataset, h5py.Dataset) or \
+                    not name.startswith('channel'):
+                continue
+            self.channels[int(name[len('channel'):])] = Channel(
+                dataset, None if trigtimes is None else trigtimes.get(name),
+                dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, channel):
+        if isinstance(channel, str):
+            channel = int(channel[len('channel'):])
+        return self.channels[channel]
+
+    def __iter__(self):
+        return iter(sorted(self.channels))
+
+    def __len__(self):
+        """Returns the number of events common to every channel."""
+        return min([len(channel) for channel in self.channels.values()] or
+                   [0])
+
+    def iter_events(self, start=0, stop=None, rows=None, raw=False):
+        """
+        Iterate over events of every channel together, yielding (first
+        event, dictionary of events keyed by channel number), see
+        `Channel.iter_blocks`.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+
+        # channels saved by fetch share a chunk shape; otherwise read the
+        # same fixed blocks from each
+        chunkrows = set(channel.chunkrows for channel in
+                        self.channels.values())
+        align = len(chunkrows) == 1
+        if not align:
+            rows = rows or max(chunkrows)
+
+        blocks = dict((number, channel.iter_blocks(start, stop, rows, raw,
+                                                   align))
+                      for number, channel in self.channels.items())
+
+        while blocks:
+            events = {}
+            for number in sorted(blocks):
+                try:
+                    i, events[number] = next(blocks[number])
+                except StopIteration:
+                    return
+            yield i, events
+
+    def close(self):
+        self.file.close()
@@ -25,9 +25,7 @@ Example:
     Wrote to file 'test.hdf5'.
 """
 
-import string
-
 default = { 'file' : { 'docstring' : str },
-            'dataset' : { 'pmtid' : string.lower,
+            'dataset' : { 'pmtid' : str.lower,
                           'voltage' : float,
                           'termination' : float } }
@@ -0,0 +1,215 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Convert raw waveform samples to volts and seconds. Samples are scaled as
+
+    volts = vertical_gain*raw - vertical_offset
+
+straight into a single float32 or float64 output array without
+intermediate copies, either from an array received from the scope or
+chunk by chunk from an hdf5 dataset saved by fetch (unpacking packed
+datasets, see `packing`). The time axis is kept as (t0, dt) and only
+expanded to an array when needed.
+"""
+
+import numpy as np
+from .packing import Packer
+
+class TimeAxis(object):
+    """
+    The time of each of `n` samples, t0 + i*dt, without storing them.
+    Converts to an array with `np.asarray(t)` (so it can be passed to
+    plotting functions directly) or `t.materialize()`.
+    """
+    def __init__(self, t0, dt, n):
+        self.t0 = t0
+        self.dt = dt
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.n)
+            return TimeAxis(self.t0 + start*self.dt, step*self.dt,
+                            len(range(start, stop, step)))
+        if index < 0:
+            index += self.n
+        if not 0 <= index < self.n:
+            raise IndexError('time axis index out of range.')
+        return self.t0 + index*self.dt
+
+    def __array__(self, dtype=None, copy=None):
+        return self.materialize(dtype or np.float64)
+
+    def __repr__(self):
+        return 'TimeAxis(t0=%g, dt=%g, n=%i)' % (self.t0, self.dt, self.n)
+
+    def materialize(self, dtype=np.float64):
+        """Returns the sample times as an array of `dtype`."""
+        t = np.arange(self.n, dtype=dtype)
+        t *= self.dt
+        t += self.t0
+        return t
+
+def field(wavedesc, name, default):
+    """Returns the field `name` of `wavedesc`, or `default` if it is
+    missing."""
+    try:
+        value = wavedesc[name]
+    except KeyError:
+        return default
+    return default if value is None else value
+
+def time_axis(wavedesc, nsamples=None, t0=None):
+    """
+    Returns the `TimeAxis` of a waveform described by `wavedesc` (a
+    wavedesc dictionary or the attributes of a dataset saved by fetch). The
+    axis starts at the time of the first point transferred (the horizontal
+    offset plus first_point samples) unless `t0` is given, and steps by
+    the sampling interval times the sparsing_factor; `nsamples` defaults to
+    the samples per segment.
+    """
+    if nsamples is None:
+        nsamples = wavedesc['wave_array_count'] // \
+            max(1, wavedesc['nom_subarray_count'])
+
+    dt = float(wavedesc['horiz_interval'])
+    if t0 is None:
+        t0 = float(wavedesc['horiz_offset']) + \
+            field(wavedesc, 'first_point', 0)*dt
+    dt *= max(1, field(wavedesc, 'sparsing_factor', 1))
+
+    return TimeAxis(float(t0), dt, nsamples)
+
+def scale(raw, gain, offset, out=None, dtype=np.float32):
+    """
+    Returns `gain*raw - offset` computed into `out`, or into a new array of
+    `dtype` if `out` is None. If `raw` is already a float array of the
+    right type it may be passed as `out` to scale it in place.
+    """
+    if out is None:
+        out = np.empty(np.shape(raw), dtype)
+    np.multiply(raw, out.dtype.type(gain), out=out, casting='unsafe')
+    np.subtract(out, out.dtype.type(offset), out=out)
+    return out
+
+def scale_waveform(raw, wavedesc, out=None, dtype=np.float32):
+    """
+    Scale the raw samples `raw` of a waveform described by `wavedesc` to
+    volts, see `scale`.
+    """
+    return scale(raw, wavedesc['vertical_gain'], wavedesc['vertical_offset'],
+                 out, dtype)
+
+def event_shape(dataset):
+    """Returns the shape of one event of `dataset` once unpacked."""
+    packer = Packer.from_attrs(dataset.attrs)
+    if packer is None:
+        return dataset.shape[1:]
+    return (packer.nsamples,)
+
+def iter_raw(dataset, start=0, stop=None, rows=None, mmap=None):
+    """
+    Iterate over the events `start` to `stop` of an hdf5 `dataset` a block
+    of `rows` events (default one chunk) at a time, yielding (first event,
+    raw events), unpacked if the dataset is packed. Blocks are aligned with
+    multiples of `rows`, so that with whole chunks each chunk is
+    decompressed once. If `mmap` (a memory map of the dataset, see
+    `reader.mmap_dataset`) is given, blocks are read from it instead. The
+    array yielded is reused.
+    """
+    stop = len(dataset) if stop is None else min(stop, len(dataset))
+
+    if rows is None:
+        rows = dataset.chunks[0] if dataset.chunks else max(1, stop - start)
+    raw = np.empty((rows,) + dataset.shape[1:], dataset.dtype)
+
+    packer = Packer.from_attrs(dataset.attrs)
+    if packer is not None:
+        codes = np.empty((rows, packer.nsamples), np.int16)
+
+    i = start
+    while i < stop:
+        n = min(rows - i % rows, stop - i)
+        if mmap is not None:
+            block = mmap[i:i+n]
+        else:
+            dataset.read_direct(raw, np.s_[i:i+n], np.s_[:n])
+            block = raw[:n]
+        if packer is None:
+            yield i, block
+        else:
+            yield i, packer.unpack(block, codes[:n])
+        i += n
+
+def iter_scaled(dataset, start=0, stop=None, dtype=np.float32):
+    """
+    Iterate over the events `start` to `stop` of an hdf5 `dataset` saved by
+    fetch a chunk at a time, yielding (first event, events in volts). The
+    arrays yielded are reused, so copy them to keep them.
+    """
+    gain = dataset.attrs['vertical_gain']
+    offset = dataset.attrs['vertical_offset']
+
+    out = None
+    for i, raw in iter_raw(dataset, start, stop):
+        if out is None or len(out) < len(raw):
+            out = np.empty((dataset.chunks or raw.shape)[:1] +
+                           event_shape(dataset), dtype)
+        yield i, scale(raw, gain, offset, out[:len(raw)])
+
+def scale_dataset(dataset, start=0, stop=None, out=None, dtype=np.float32):
+    """
+    Returns the events `start` to `stop` of an hdf5 `dataset` saved by
+    fetch in volts, read a chunk at a time and scaled into `out` (or a new
+    array of `dtype`).
+    """
+    stop = len(dataset) if stop is None else min(stop, len(dataset))
+
+    if out is None:
+        out = np.empty((stop - start,) + event_shape(dataset), dtype)
+
+    gain = dataset.attrs['vertical_gain']
+    offset = dataset.attrs['vertical_offset']
+
+    for i, raw in iter_raw(dataset, start, stop):
+        scale(raw, gain, offset, out[i-start:i-start+len(raw)])
+    return out
+
+def decimate(x, y, width):
+    """
+    Reduce the last axis of the events `y` sampled at `x` (an array or a
+    `TimeAxis`) to a min/max envelope of about `width` pixels: each pixel
+    becomes the minimum and maximum of its samples, so that peaks are not
+    lost. Returns the new (x, y) as arrays; records of 2*`width` samples or
+    fewer are not decimated.
+    """
+    nsamples = y.shape[-1]
+    if nsamples <= 2*width:
+        return np.asarray(x), y
+
+    starts = np.arange(0, nsamples, -(-nsamples//width))
+    envelope = np.empty(y.shape[:-1] + (2*len(starts),), y.dtype)
+    envelope[..., 0::2] = np.minimum.reduceat(y, starts, axis=-1)
+    envelope[..., 1::2] = np.maximum.reduceat(y, starts, axis=-1)
+
+    if isinstance(x, TimeAxis):
+        x = x.t0 + starts*x.dt
+    else:
+        x = np.asarray(x)[starts]
+    return np.repeat(x, 2), envelope
@@ -20,9 +20,71 @@ errors = { 1  : 'unrecognized command/query header',
            13 : 'extra bytes detected during definite length data block '
                 'transfer' }
 
+def pack_messages(msgs):
+    """
+    Returns the strings (or bytes) in `msgs` each formatted as its own VICP
+    message, joined so that they can be sent in a single write.
+    """
+    packets = []
+    for msg in msgs:
+        if isinstance(msg, str):
+            msg = msg.encode()
+        if not msg.endswith(b'\n'):
+            msg += b'\n'
+        packets.append(struct.pack(headerformat, 129, 1, 1, 0, len(msg)))
+        packets.append(msg)
+    return b''.join(packets)
+
+def last_command_error(reply):
+    """Returns the error described by the reply to 'cmr?', or None if the
+    last command was received okay."""
+    if isinstance(reply, bytes):
+        reply = reply.decode()
+    return errors.get(int(reply.split(' ')[-1].rstrip('\n')))
+
+def series_views(buffer=None):
+    """
+    The framing of a 'logical series' of blocks, shared by the blocking and
+    the asyncio sockets. A generator which yields each memoryview that has
+    to be filled completely from the connection in turn (a block header,
+    then its block) and returns a memoryview of the bytes of the series,
+    received into `buffer` or a new bytearray. A `buffer` too small for
+    the series is never resized in place, since a caller may still hold a
+    view of it: a larger bytearray is allocated instead, and is the `obj`
+    of the returned view.
+    """
+    if buffer is None:
+        buffer = bytearray()
+
+    header = bytearray(8)
+    nbytes = 0
+    while True:
+        yield memoryview(header)
+
+        operation, headerver, seqnum, spare, totalbytes = \
+            struct.unpack(headerformat, header)
+
+        if len(buffer) < nbytes + totalbytes:
+            # grow geometrically so long series stay linear
+            grown = bytearray(max(nbytes + totalbytes, 2*len(buffer)))
+            grown[:nbytes] = buffer[:nbytes]
+            buffer = grown
+
+        yield memoryview(buffer)[nbytes:nbytes+totalbytes]
+
+        nbytes += totalbytes
+
+        if operation % 2:
+            break
+
+    return memoryview(buffer)[:nbytes]
+
 class Socket(object):
     def __init__(self, host, port=1861, timeout=5.0):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # don't let Nagle's algorithm hold back short commands such as
+        # 'arm;wait' while the previous segment is waiting on a delayed ack
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.sock.connect((host, port))
         self.sock.settimeout(timeout)
 
@@ -41,11 +103,16 @@ class Socket(object):
         self.sock.settimeout(t)
 
     def send(self, msg):
-        """Format and send the string `msg`."""
-        if not msg.endswith('\n'):
-            msg += '\n'
-        header = struct.pack(headerformat, 129, 1, 1, 0, len(msg))
-        self.sock.sendall(header + msg.encode())
+        """Format and send the string (or bytes) `msg`."""
+        self.sendmany([msg])
+
+    def sendmany(self, msgs):
+        """
+        Format each string in `msgs` as its own message and send them all
+        back-to-back in a single write, so that several queries can be in
+        flight before the first reply is received.
+        """
+        self.sock.sendall(pack_messages(msgs))
 
     def check_last_command(self):
         """
@@ -53,39 +120,47 @@ class Socket(object):
         an exception with details about the error.
         """
         self.send('cmr?')
-        rec = self.recv().decode() #decode() converts to string
-        err = int(rec.split(' ')[-1].rstrip('\n'))
+        error = last_command_error(self.recv())
 
-        if err in errors:
+        if error is not None:
             self.sock.close()
-            raise Exception(errors[err])
+            raise Exception(error)
 
-    def recv(self):
-        """Return a message from the scope."""
+    def _recv_exact(self, view):
+        """Fill the memoryview `view` completely from the socket."""
+        while view:
+            nbytes = self.sock.recv_into(view)
+            if nbytes == 0:
+                raise socket.error('connection closed by the oscilloscope.')
+            view = view[nbytes:]
 
-        reply = ''.encode()
+    def recv_buffer(self, buffer=None):
+        """
+        Receive a 'logical series' of blocks from the scope into a single
+        bytearray and return a memoryview of the bytes received.
+
+        The first block is received directly into a buffer preallocated
+        from the block header; any further blocks of the series are
+        appended in place, so the reply is never copied. If `buffer` is
+        given, it is reused instead of allocating a new bytearray unless the
+        reply does not fit, in which case a larger one is allocated; keep
+        the `obj` of the returned view to reuse next time. A view of a
+        reused buffer is only valid until the next call with it.
+        """
+        series = series_views(buffer)
+        view = next(series)
         while True:
-            header = ''.encode()
+            self._recv_exact(view)
+            view.release()
+            try:
+                view = next(series)
+            except StopIteration as e:
+                return e.value
 
-            while len(header) < 8:
-                header += self.sock.recv(8 - len(header))
-
-            operation, headerver, seqnum, spare, totalbytes = \
-                struct.unpack(headerformat, header)
-
-            buffer = ''.encode()
-
-            while len(buffer) < totalbytes:
-                buffer += self.sock.recv(totalbytes - len(buffer))
-
-            # print('buffer: {}'.format(buffer))
-            # print(reply)
-            reply += buffer
-
-            if operation % 2:
-                break
-
-        return reply
+    def recv(self):
+        """Return a message from the scope."""
+        with self.recv_buffer() as reply:
+            return reply.tobytes()
 
     def __del__(self):
         self.sock.close()
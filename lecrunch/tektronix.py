@@ -1,6 +1,10 @@
 import socket
 import re
+import calendar
+import time
 import numpy as np
+from .lecroy import trigtime_dtype
+from .driver import Driver
 
 preamble_fields = {'BYT_NR': int, # data width for waveform
                    'BIT_NR': int, # number of bits per waveform point
@@ -20,8 +24,6 @@ preamble_fields = {'BYT_NR': int, # data width for waveform
                    'YUNIT' : str,
                    'NR_FR' : int }
 
-header_regex = re.compile('(?::HEADER ){0,1}(\d)')
-
 def get_dtype(preamble):
     """Returns the numpy dtype for the raw waveform data given the preamble."""
     if preamble['BYT_OR'] == 'MSB':
@@ -38,7 +40,7 @@ def get_dtype(preamble):
     else:
         raise Exception('unknown binary format string %s' % preamble['BN_FMT'])
 
-    return byteorder + signedchar + str(preamble['BYT_NR'])
+    return np.dtype(byteorder + signedchar + str(preamble['BYT_NR']))
 
 def convert_waveform(waveform, preamble):
     """Converts a waveform returned by the scope into voltage values."""
@@ -47,151 +49,480 @@ def convert_waveform(waveform, preamble):
 def build_time_array(preamble):
     return preamble['XZERO'] + (np.arange(preamble['NR_PT']) - preamble['PT_OFF'])*preamble['XINCR']
 
-class TekScope(object):
-    def __init__(self, host, port):
+def parse_fields(reply):
+    """
+    Split a reply to a query made with `header 1`, such as
+    ':WFMPRE:BYT_NR 1;BIT_NR 8;...', into a list of (field, value).
+    """
+    fields = []
+    for s in reply.split(';'):
+        key, value = s.split(' ', 1)
+        fields.append((key.rsplit(':', 1)[-1], value))
+    return fields
+
+def split_replies(line):
+    """
+    Split a reply line holding the replies to several queries sent in one
+    message, which the scope joins with ';', into a list of the replies.
+    Semicolons inside quoted strings are kept.
+    """
+    return [m.group(0) for m in re.finditer(r'(?:"[^"]*"|[^;"])+', line)]
+
+timestamp_regex = re.compile(r'(\d+ \w+ \d+) (\d+):(\d+):(\d+)\.([\d ]+)')
+
+def parse_timestamps(reply):
+    """
+    Returns the trigger time of each frame in the reply to a
+    `horizontal:fastframe:timestamp:all` query, a list of time stamps such
+    as "02 Mar 2020 10:11:12.123 456 789 012", in seconds relative to the
+    first frame. The fraction of each stamp is kept to the picosecond.
+    """
+    seconds = []
+    picoseconds = []
+    for m in timestamp_regex.finditer(reply):
+        date, hours, minutes, secs, fraction = m.groups()
+        seconds.append(calendar.timegm(time.strptime(date, '%d %b %Y')) +
+                       3600*int(hours) + 60*int(minutes) + int(secs))
+        fraction = fraction.replace(' ', '')[:12]
+        picoseconds.append(int(fraction.ljust(12, '0')))
+
+    seconds = np.array(seconds, dtype=np.int64)
+    picoseconds = np.array(picoseconds, dtype=np.int64)
+    if len(seconds) == 0:
+        return np.empty(0)
+    return (seconds - seconds[0]) + (picoseconds - picoseconds[0])*1e-12
+
+def preamble_wavedesc(preamble, frames=1):
+    """
+    Returns a dictionary of the preamble with the wavedesc fields that
+    fetch and the readers (see `reader`, `scaling`) expect of a LeCroy
+    channel, for `frames` FastFrame frames per acquisition.
+    """
+    wavedesc = dict(preamble)
+    wavedesc['dtype'] = get_dtype(preamble)
+    wavedesc['wave_array_count'] = preamble['NR_PT']*frames
+    wavedesc['subarray_count'] = frames
+    wavedesc['nom_subarray_count'] = frames
+    # volts = YZERO + (raw - YOFF)*YMULT = gain*raw - offset
+    wavedesc['vertical_gain'] = preamble['YMULT']
+    wavedesc['vertical_offset'] = preamble['YOFF']*preamble['YMULT'] - \
+        preamble['YZERO']
+    wavedesc['horiz_interval'] = preamble['XINCR']
+    wavedesc['horiz_offset'] = preamble['XZERO'] - \
+        preamble['PT_OFF']*preamble['XINCR']
+    iinfo = np.iinfo(wavedesc['dtype'])
+    wavedesc['min_value'] = iinfo.min
+    wavedesc['max_value'] = iinfo.max
+    return wavedesc
+
+class TekScope(Driver):
+    """
+    A client for the raw socket interface of Tektronix oscilloscopes.
+
+    Replies are read through a receive buffer: short replies are split off
+    it line by line, and definite length blocks ('#<x><y>' followed by y
+    bytes, e.g. the reply to `curve?`) are received straight into their
+    destination array with recv_into.
+
+    The state of the commands which select what a query returns (header,
+    data:source, wfmpre:pt_fmt) and the preamble of each channel are
+    cached, so repeated reads of a waveform only send `curve?`. Call
+    `invalidate()` after changing settings behind the client's back, e.g.
+    with `send()` or from the front panel.
+
+    With `multisource` the driver interface reads every channel with a
+    single curve? query, see `get_fastframes`.
+    """
+    def __init__(self, host, port=4000, timeout=5.0, multisource=False):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((host,port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect((host, port))
+        self.sock.settimeout(timeout)
+
+        # bytes received but not read yet are buffer[start:end]
+        self.buffer = bytearray(1 << 16)
+        self.start = 0
+        self.end = 0
+
+        self.state = {}
+        self.preambles = {}
+
+        self.multisource = multisource
+        # FastFrame frames per acquisition, set by events_per_trigger()
+        self.frames = 1
 
     def send(self, msg):
-        if not msg.endswith('\n'):
-            msg += '\n'
+        if isinstance(msg, str):
+            msg = msg.encode()
+        if not msg.endswith(b'\n'):
+            msg += b'\n'
 
         self.sock.sendall(msg)
 
-    def clear(self):
-        self.send('*cls')
+    def set_state(self, command, value):
+        """Send '`command` `value`' unless it is already set."""
+        value = str(value)
+        if self.state.get(command) != value:
+            self.send('%s %s' % (command, value))
+            self.state[command] = value
+
+    def invalidate(self):
+        """Forget the cached command state and preambles."""
+        self.state.clear()
+        self.preambles.clear()
+
+    def clear(self, timeout=0.5):
+        """Clear the status and discard any replies waiting to be read."""
+        t = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            while self.sock.recv(4096):
+                pass
+        except socket.timeout:
+            pass
+        finally:
+            self.sock.settimeout(t)
+        self.start = self.end = 0
 
-    def recv(self, size=None):
-        buffer = ''
+        self.send('*cls')
 
-        if size is None:
-            while True:
-                buffer += self.sock.recv(4096)
+    def _fill(self):
+        """Receive more bytes into the receive buffer."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            n = self.end - self.start
+            if self.start == 0:
+                # a single reply larger than the buffer
+                self.buffer.extend(bytes(len(self.buffer)))
+            else:
+                self.buffer[:n] = self.buffer[self.start:self.end]
+                self.start, self.end = 0, n
+
+        with memoryview(self.buffer) as view:
+            nbytes = self.sock.recv_into(view[self.end:])
+        if nbytes == 0:
+            raise socket.error('connection closed by the oscilloscope.')
+        self.end += nbytes
+
+    def _read_exact(self, view):
+        """Fill the memoryview `view` from the receive buffer, then the socket."""
+        n = min(len(view), self.end - self.start)
+        view[:n] = self.buffer[self.start:self.start+n]
+        self.start += n
+        view = view[n:]
+
+        while view:
+            nbytes = self.sock.recv_into(view)
+            if nbytes == 0:
+                raise socket.error('connection closed by the oscilloscope.')
+            view = view[nbytes:]
+
+    def readline(self):
+        """Returns the next reply line, without the newline, as bytes."""
+        while True:
+            pos = self.buffer.find(b'\n', self.start, self.end)
+            if pos >= 0:
+                break
+            self._fill()
 
-                if buffer.endswith('\n'):
-                    break
-        else:
-            while len(buffer) < size:
-                buffer += self.sock.recv(min(size-len(buffer),4096))
+        line = bytes(self.buffer[self.start:pos])
+        self.start = pos + 1
+        return line
 
-        return buffer
+    def recv(self, size=None):
+        """Returns the next reply line, or exactly `size` bytes, as bytes."""
+        if size is None:
+            return self.readline()
+
+        out = bytearray(size)
+        self._read_exact(memoryview(out))
+        return bytes(out)
+
+    def read_block(self, out=None):
+        """
+        Read a reply holding a definite length block, skipping any header
+        before it, and return a memoryview of its bytes. The bytes are
+        received into `out` (any writable buffer, e.g. a numpy array), which
+        must be large enough, or into a new bytearray.
+        """
+        while True:
+            pos = self.buffer.find(b'#', self.start, self.end)
+            if pos >= 0 and self.end - pos >= 2 and \
+                    self.end - pos >= 2 + int(chr(self.buffer[pos+1])):
+                break
+            self._fill()
+
+        ndigits = int(chr(self.buffer[pos+1]))
+        if ndigits == 0:
+            raise Exception('indefinite length blocks are not supported.')
+
+        nbytes = int(self.buffer[pos+2:pos+2+ndigits])
+        self.start = pos + 2 + ndigits
+
+        if out is None:
+            out = bytearray(nbytes)
+        view = memoryview(out).cast('B')
+        if len(view) < nbytes:
+            raise ValueError('block of %i bytes does not fit in %i bytes.' %
+                             (nbytes, len(view)))
+        self._read_exact(view[:nbytes])
+
+        # blocks end the message with a newline, or are followed by the
+        # next block of a multiple source curve?
+        while self.start == self.end:
+            self._fill()
+        end = self.buffer[self.start]
+        self.start += 1
+        if end not in b'\n;':
+            raise Exception('extra bytes after definite length block.')
+
+        return view[:nbytes]
 
     def query(self, msg):
         """Sends a query to the oscilloscope and returns the response."""
         self.send(msg)
-        return self.recv().strip()
+        return self.readline().decode().strip()
+
+    def wait(self, timeout=None):
+        """
+        Wait for every pending operation to complete with `*opc?`, for at
+        most `timeout` seconds (default forever).
+        """
+        t = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            self.query('*opc?')
+        finally:
+            self.sock.settimeout(t)
 
     def enable_fastframe(self, count):
         self.send('horizontal:fastframe:state 1')
         self.send('horizontal:fastframe:count %i' % count)
+        self.preambles.clear()
 
     def set_sequence_mode(self):
         """Sets the oscilloscope in single acquisition mode."""
-        self.send('acquire:stopafter sequence\n')
-
-    def acquire(self):
-        """Trigger and acquire a new waveform."""
-        self.send('acquire:state run\n')
-
-        acquire_regex = re.compile('(?::ACQUIRE:STATE ){0,1}(\d)')
-
-        while int(acquire_regex.match(self.query('acquire:state?')).group(1)):
-            pass
-
-    def get_preamble(self, channel):
+        self.set_state('acquire:stopafter', 'sequence')
+
+    def acquire(self, timeout=None):
+        """
+        Trigger and acquire a new waveform. Returns once the acquisition is
+        complete, which the scope signals by answering `*opc?`, rather than
+        by polling `acquire:state?`.
+        """
+        self.send('acquire:state run')
+        self.wait(timeout)
+
+    def get_preamble(self, channel, refresh=False):
         """Returns a dictionary containing information about the waveform
-        format for a channel."""
-        header = int(header_regex.match(self.query('header?\n')).group(1))
+        format for a channel. The preamble is cached until `refresh` is true
+        or `invalidate()` is called."""
+        if not refresh and channel in self.preambles:
+            return self.preambles[channel]
 
         # turn header on so that we know preamble field names
-        self.send('header 1\n')
-
-        source = self.query('data:source?')
-
-        self.send('data:source ch%i\n' % channel)
+        self.set_state('header', 1)
+        self.set_state('wfmpre:pt_fmt', 'y')
+        self.set_state('data:source', 'ch%i' % channel)
 
         preamble = {}
-        for s in self.query('wfmpre?\n').strip()[8:].split(';'):
-            key, value = s.split(' ',1)
-
-            preamble[key] = preamble_fields[key](value)
-
-        # reset header format and data:source
-        self.send('header %i' % header)
-        self.send(source)
+        for key, value in parse_fields(self.query('wfmpre?')):
+            preamble[key] = preamble_fields.get(key, str)(value)
 
+        self.preambles[channel] = preamble
         return preamble
 
     def get_active_channels(self):
         """Returns a list of the active (displayed) channel numbers."""
-        header = int(header_regex.match(self.query('header?\n')).group(1))
-
-        self.send('header 1\n')
+        self.set_state('header', 1)
 
         channels = []
-        for s in self.query('select?').strip()[8:].split(';'):
-            m = re.match('CH(\d) (\d)', s)
-
-            if m is not None:
-                ch, state = map(int,m.groups())
+        for key, value in parse_fields(self.query('select?')):
+            m = re.match(r'CH(\d)$', key)
 
-                if state != 0:
-                    channels.append(ch)
-
-        self.send('header %i' % header)
+            if m is not None and int(value) != 0:
+                channels.append(int(m.group(1)))
 
         return channels
 
-    def get_waveform(self, channel, dtype=None):
+    def get_waveform(self, channel, dtype=None, out=None):
         """Returns the waveform from channel as a numpy array. If dtype is
-        specified, the function does not need to query the scope for the data
-        format which will be much quicker."""
-        header = int(header_regex.match(self.query('header?\n')).group(1))
-
-        self.send('header 0\n')
-
+        specified, the function does not need to know the data format. If
+        `out` is given, the samples are received straight into it, and it
+        is returned."""
         # not sure what pt_fmt env is, so we'll always transmit
         # in pt_fmt y format
-        self.send('wfmpre:pt_fmt y\n')
-
-        self.send('data:source ch%i\n' % channel)
+        self.set_state('header', 0)
+        self.set_state('wfmpre:pt_fmt', 'y')
 
-        if dtype is None:
+        if dtype is None and out is None:
             dtype = get_dtype(self.get_preamble(channel))
 
-        self.send('curve?\n')
-
-        # the initial response from curve looks like '#x<y>' where x is
-        # the number of y characters, and y is the number of bytes in the
-        # waveform.
-        # for example: '#41000' at the beginning of a curve? response means
-        # that there are 1000 bytes in the waveform
-        x = self.sock.recv(2)
-
-        assert x.startswith('#')
-
-        y = int(self.sock.recv(int(x[1])))
-
-        waveform = np.fromstring(self.recv(y),dtype)
-
-        # messages end with a newline
-        eom = self.sock.recv(1024)
-
-        if eom != '\n':
-            raise Exception("eom != '\n'")
-
-        self.send('header %i' % header)
-
-        return waveform
+        self.set_state('data:source', 'ch%i' % channel)
+        self.send('curve?')
+
+        if out is not None:
+            nbytes = len(self.read_block(out))
+            if nbytes != out.nbytes:
+                raise ValueError('received %i bytes for an array of %i bytes.'
+                                 % (nbytes, out.nbytes))
+            return out
+
+        return np.frombuffer(self.read_block(), dtype)
+
+    def get_fastframe_count(self):
+        """Returns the number of FastFrame frames per acquisition (1 if
+        FastFrame is off)."""
+        self.set_state('header', 0)
+        if not int(self.query('horizontal:fastframe:state?')):
+            return 1
+        return int(self.query('horizontal:fastframe:count?'))
+
+    def get_timestamps(self, channel, frames):
+        """Returns the trigger times of the first `frames` frames of
+        `channel` relative to the first, see `parse_timestamps`."""
+        self.set_state('header', 0)
+        return parse_timestamps(self.query(
+            'horizontal:fastframe:timestamp:all:ch%i? 1,%i' % (channel, frames)))
+
+    def get_fastframes(self, channels, frames=None, out=None,
+                       multisource=False, timestamps=True, rearm=False):
+        """
+        Read every FastFrame frame of every channel in `channels` from the
+        last acquisition in one exchange. Returns a dictionary of
+        (preamble, waveforms, trigtimes) keyed by channel, where
+        `waveforms` is a (frames, samples) array and `trigtimes` a record
+        array of `lecroy.trigtime_dtype` (None if `timestamps` is false), as
+        `LeCroyScope.getsequences`.
+
+        The waveforms are views of the received blocks, or of `out[channel]`
+        if `out` (a dictionary of arrays of at least `frames` rows keyed by
+        channel, e.g. the buffers of a `writer.EventWriter`) is given, so
+        they are never copied. The curve? queries, one per channel or one
+        for every channel at once with `multisource` on scopes which accept
+        several data:source channels, are written together with the time
+        stamp queries before any reply is read, followed by the start of
+        the next acquisition if `rearm` is true.
+        """
+        if frames is None:
+            frames = self.get_fastframe_count()
+
+        preambles = dict((channel, self.get_preamble(channel)) for channel
+                         in channels)
+
+        self.set_state('header', 0)
+        self.set_state('wfmpre:pt_fmt', 'y')
+        self.set_state('data:start', 1)
+        self.set_state('data:stop', max(preamble['NR_PT'] for preamble in
+                                        preambles.values()))
+        if frames > 1:
+            self.set_state('data:framestart', 1)
+            self.set_state('data:framestop', frames)
+
+        if multisource:
+            sources = [','.join('ch%i' % channel for channel in channels)]
+        else:
+            sources = ['ch%i' % channel for channel in channels]
+
+        msgs = []
+        for source in sources:
+            if self.state.get('data:source') != source:
+                msgs.append('data:source %s' % source)
+                self.state['data:source'] = source
+            msgs.append('curve?')
+
+        if timestamps and frames > 1:
+            for channel in channels:
+                msgs.append('horizontal:fastframe:timestamp:all:ch%i? 1,%i' %
+                            (channel, frames))
+        if rearm:
+            msgs.append('acquire:state run')
+        # without a leading ':' each command would be read relative to the
+        # header path of the previous one, e.g. curve? as data:curve?
+        self.send(';'.join(':' + msg for msg in msgs))
+
+        sequences = {}
+        for channel in channels:
+            preamble = preambles[channel]
+            dtype = get_dtype(preamble)
+            if out is None:
+                data = np.frombuffer(self.read_block(), dtype)
+            else:
+                data = out[channel].reshape(-1)
+                data = data[:len(self.read_block(data))//dtype.itemsize]
+            sequences[channel] = (preamble, data.reshape(-1, preamble['NR_PT']),
+                                  None)
+
+        # the time stamps of every channel come back on one line
+        if timestamps and frames > 1:
+            stamps = split_replies(self.readline().decode())
+            if len(stamps) != len(channels):
+                raise Exception('expected %i time stamp replies, got %i.' %
+                                (len(channels), len(stamps)))
+            stamps = dict(zip(channels, stamps))
+
+        for channel in channels:
+            preamble, waveforms, trigtimes = sequences[channel]
+            trigtimes = np.zeros(len(waveforms), trigtime_dtype)
+            if timestamps and frames > 1:
+                trigtimes['trigger_time'] = parse_timestamps(
+                    stamps[channel])[:len(waveforms)]
+            trigtimes['trigger_offset'] = preamble['XZERO'] - \
+                preamble['PT_OFF']*preamble['XINCR']
+            sequences[channel] = (preamble, waveforms,
+                                  trigtimes if timestamps else None)
+
+        return sequences
+
+    # driver interface, see driver.Driver
+
+    def active_channels(self):
+        return self.get_active_channels()
+
+    def settings(self):
+        # with headers, so that the settings can be sent back as they are
+        self.set_state('header', 1)
+        return { 'settings' : self.query('*lrn?') }
+
+    def descriptors(self, channels):
+        return dict((channel, preamble_wavedesc(self.get_preamble(channel),
+                                                self.frames)) for channel in
+                    channels)
+
+    def events_per_trigger(self):
+        self.frames = self.get_fastframe_count()
+        return self.frames
+
+    def arm(self):
+        self.set_sequence_mode()
+        self.send('acquire:state run')
+
+    def read_batch(self, channels, buffers, rearm=False):
+        """
+        Wait for the acquisition with `*opc?` and receive every frame of
+        `channels` straight into `buffers`, see `get_fastframes`.
+        """
+        self.wait()
+
+        sequences = self.get_fastframes(channels, self.frames, buffers,
+                                        self.multisource, self.frames > 1,
+                                        rearm)
+        if self.frames > 1:
+            for channel, (preamble, waveforms, trigtimes) in sequences.items():
+                buffers[('trigtime', channel)][:len(trigtimes)] = trigtimes
+
+        # frames every channel returned
+        return min(len(waveforms) for preamble, waveforms, trigtimes in
+                   sequences.values())
 
 if __name__ == '__main__':
-    import h5py
     import optparse
-    import setup
+    from . import setup
+    from .engine import acquire
     import sys
     import os
     import math
-    import time
 
     usage = 'usage: %prog <filename> [-n]'
     parser = optparse.OptionParser(usage)
@@ -199,6 +530,19 @@ if __name__ == '__main__':
                       help='number of events per run', default=1000)
     parser.add_option('-r', type='int', dest='nruns',
                       help='number of runs', default=1)
+    parser.add_option('-b', type='int', dest='nbuffers',
+                      help='event buffers queued to a background writer '
+                      'thread (0 writes inline)', default=0)
+    parser.add_option('--codec', dest='codec',
+                      help='compression: none, lzf, gzip[:level], '
+                      'zstd[:level] or blosc[:cname[:level]]',
+                      default='gzip')
+    parser.add_option('-j', type='int', dest='threads',
+                      help='compress gzip chunks on this many threads',
+                      default=0)
+    parser.add_option('--multisource', action='store_true',
+                      dest='multisource', help='read every channel with a '
+                      'single curve? query', default=False)
     options, args = parser.parse_args()
 
     if len(args) < 1:
@@ -207,7 +551,8 @@ if __name__ == '__main__':
     if options.nevents < 1 or options.nruns < 1:
         sys.exit('nevents and nruns must be greater than 1.')
 
-    scope = TekScope(setup.scope_ip, setup.port)
+    scope = TekScope(setup.scope_ip, setup.port, timeout=20.0,
+                     multisource=options.multisource)
 
     scope.clear()
 
@@ -224,68 +569,12 @@ if __name__ == '__main__':
 
         filename = root + fileid + ext
 
-        print 'saving to %s' % filename
-
-        t0 = time.time()
-
-        with h5py.File(filename, 'w') as f:
-            f.attrs['settings'] = scope.query('*lrn?')
-
-            active_channels = scope.get_active_channels()
-
-            for channel in active_channels:
-                preamble = scope.get_preamble(channel)
-
-                dataset = f.create_dataset('channel%i' % channel, (options.nevents, preamble['NR_PT']), dtype=get_dtype(preamble), chunks=(max(1,min(100, options.nevents//100)), preamble['NR_PT']), compression='gzip')
-
-                for key, value in preamble.iteritems():
-                    dataset.attrs[key] = value
-
-            # enable single acquisition mode
-            scope.set_sequence_mode()
-
-            scope.send('header 0\n')
-
-            fastframe_state = int(scope.query('horizontal:fastframe:state?'))
-            fastframe_count = int(scope.query('horizontal:fastframe:count?'))
-
-            i = 0
-            try:
-                while i < options.nevents:
-                    print '\rsaving event: %i' % (i+1),
-                    sys.stdout.flush()
-
-                    scope.acquire()
-
-                    if fastframe_state:
-                        n = min(fastframe_count,options.nevents-i)
-                    else:
-                        n = 1
-
-                    for channel in active_channels:
-                        dataset = f['channel%i' % channel]
-
-                        data = scope.get_waveform(channel, dataset.dtype)
-
-                        if fastframe_state:
-                            data = data.reshape((fastframe_count,-1))
-                            dataset[i:i+n] = data[:n]
-                        else:
-                            dataset[i] = data
-
-                    i += n
-            except KeyboardInterrupt:
-                print
-                print 'resizing datasets...'
-
-                for channel in active_channels:
-                    dataset = f['channel%i' % channel]
-                    dataset.resize((i,dataset.shape[1]))
-
-                break
-            else:
-                print
-
-        elapsed = time.time() - t0
+        print('saving to %s' % filename)
 
-        print 'saved %s. elapsed %f sec.' % (filename,elapsed)
+        try:
+            acquire(scope, filename, options.nevents, None, options.nbuffers,
+                    options.codec, options.threads)
+        except KeyboardInterrupt:
+            break
+        finally:
+            scope.clear()
@@ -16,8 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import sys
 import numpy as np
-import h5py
 from ROOT import *
+from .reader import RunFile
 gROOT.SetStyle('Plain')
 
 import optparse
@@ -25,28 +25,22 @@ parser = optparse.OptionParser('%prog file')
 parser.add_option('-n', type='int', dest='events', default=500)
 options, args = parser.parse_args()
 
-f = h5py.File(sys.argv[1], 'r')
+# TGraph wants doubles
+run = RunFile(args[0], dtype=np.float64)
 
 mg = {}
-for dataset in [f[name] for name in f]:
-    mg[dataset.name] = TMultiGraph()
+for number in run:
+    channel = run[number]
+    mg[channel.name] = TMultiGraph()
 
-    samples = dataset.attrs['wave_array_count']//dataset.attrs['nom_subarray_count']
-    dx = dataset.attrs['horiz_interval']
-    dy = dataset.attrs['vertical_gain']
-    xoffset = dataset.attrs['horiz_offset']
-    yoffset = dataset.attrs['vertical_offset']
+    x = np.asarray(channel.time)
 
-    x = np.linspace(xoffset, xoffset + dx*samples, samples)
-
-    for i, waveform in enumerate(dataset[:min(options.events, len(dataset))]):
-        print '\rreading waveform: %i' % (i+1),
+    for i, waveform in enumerate(channel[:options.events]):
+        print('\rreading waveform: %i' % (i+1), end=' ')
         sys.stdout.flush()
 
-        y = waveform.astype(np.float64)*dy - yoffset
-
-        mg[dataset.name].Add(TGraph(len(x), x, y))
-    print
+        mg[channel.name].Add(TGraph(len(x), x, waveform))
+    print()
 
 c = TCanvas('c', '', 800, 600)
 c.Divide(1, len(mg))
@@ -56,4 +50,4 @@ for i, key in enumerate(mg):
     mg[key].Draw('AL')
     c.cd(i+1).Update()
 
-raw_input('press enter')
+input('press enter')
@@ -0,0 +1,400 @@
+# LeCrunch
+# Copyright (C) 2010 Anthony LaTorre
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Write events to hdf5 datasets, either inline or from a background thread
+which drains a bounded queue of preallocated event buffers so that the
+acquisition loop does not wait on compression. Chunks may also be
+compressed on a pool of threads and stored with direct chunk writes.
+"""
+
+import zlib
+import threading
+import queue
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .packing import Packer
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+def compression_options(codec='gzip', shuffle=False):
+    """
+    Returns the keyword arguments to h5py's create_dataset() for the codec
+    string `codec`, one of:
+
+        none                    no compression
+        lzf                     lzf (fast, bundled with h5py)
+        gzip[:level]            deflate at `level` 0-9 (default 4)
+        zstd[:level]            zstandard, requires hdf5plugin
+        blosc[:cname[:level]]   blosc with compressor `cname` (default lz4),
+                                requires hdf5plugin
+
+    If `shuffle` is true the hdf5 byte shuffle filter is applied before
+    compression, which helps multi-byte samples (blosc shuffles itself).
+    """
+    name, _, args = codec.lower().partition(':')
+    args = [arg for arg in args.split(':') if arg]
+
+    if name == 'none':
+        return {}
+    elif name == 'lzf':
+        options = { 'compression' : 'lzf' }
+    elif name == 'gzip':
+        level = int(args[0]) if args else 4
+        options = { 'compression' : 'gzip', 'compression_opts' : level }
+    elif name in ('zstd', 'blosc'):
+        if hdf5plugin is None:
+            raise Exception('codec %s requires the hdf5plugin package.' % name)
+        if name == 'zstd':
+            level = int(args[0]) if args else 3
+            return dict(hdf5plugin.Zstd(clevel=level), shuffle=shuffle)
+        cname = args[0] if args else 'lz4'
+        level = int(args[1]) if len(args) > 1 else 5
+        return dict(hdf5plugin.Blosc(cname=cname, clevel=level,
+                                     shuffle=hdf5plugin.Blosc.SHUFFLE))
+    else:
+        raise Exception('unknown codec %s.' % codec)
+
+    options['shuffle'] = shuffle
+    return options
+
+def chunk_shape(nsamples, dtype, nevents=None, target=1 << 20):
+    """
+    Returns the hdf5 chunk shape for events of `nsamples` samples of `dtype`
+    which holds about `target` bytes: as many whole events as fit (but no
+    more than `nevents`), or a single event split into equal pieces for
+    records bigger than `target`.
+    """
+    rowbytes = nsamples*np.dtype(dtype).itemsize
+
+    if rowbytes >= target:
+        pieces = -(-rowbytes//target)
+        return (1, -(-nsamples//pieces))
+
+    rows = target//rowbytes
+    if nevents is not None:
+        rows = max(1, min(rows, nevents))
+    return (rows, nsamples)
+
+def reserve(dataset, nrows):
+    """
+    Make sure `dataset` has at least `nrows` rows, growing a resizable
+    dataset to at least twice its length so that appending is amortized.
+    Rows beyond those written take no space in a chunked dataset.
+    """
+    if dataset.shape[0] < nrows and dataset.maxshape[0] is None:
+        dataset.resize(max(nrows, 2*dataset.shape[0]), axis=0)
+
+def shuffle_bytes(data):
+    """
+    Returns the bytes of `data` in the order written by the hdf5 shuffle
+    filter: the first byte of every element, then the second, and so on.
+    """
+    return data.view(np.uint8).reshape(-1, data.itemsize).T.tobytes()
+
+class EventBatch(object):
+    """
+    Stage rows written to a dataset in memory and store them `rows` at a
+    time with a single contiguous hyperslab write.
+
+    Rows must be written in order starting from row 0. Resizable datasets
+    grow as needed.
+    """
+    def __init__(self, dataset, rows):
+        self.dataset = dataset
+        self.stage = np.empty((rows,) + dataset.shape[1:], dataset.dtype)
+        self.filled = 0
+        self.row = 0
+
+    def write(self, rows):
+        """Append the array `rows` to the dataset."""
+        while len(rows):
+            n = min(len(rows), len(self.stage) - self.filled)
+            self.stage[self.filled:self.filled+n] = rows[:n]
+            self.filled += n
+            rows = rows[n:]
+
+            if self.filled == len(self.stage):
+                self.flush()
+
+    def flush(self):
+        """Write the rows staged so far."""
+        if self.filled:
+            reserve(self.dataset, self.row + self.filled)
+            self.dataset.write_direct(self.stage, np.s_[:self.filled],
+                                      np.s_[self.row:self.row+self.filled])
+            self.row += self.filled
+            self.filled = 0
+
+class ChunkCompressor(object):
+    """
+    Stage rows written to a gzip compressed dataset into whole chunks,
+    deflate the chunks on a thread pool (zlib releases the GIL) and store
+    them with write_direct_chunk() so that compression runs on several
+    cores while the hdf5 library only copies bytes. Chunks which split an
+    event into pieces are handled a row of chunks at a time.
+
+    Rows must be written in order starting from row 0. At most
+    `maxpending` chunks are held in memory waiting to be compressed.
+    """
+    def __init__(self, dataset, pool, maxpending=8):
+        if dataset.compression != 'gzip' or dataset.chunks is None:
+            raise Exception('parallel compression requires a chunked gzip '
+                            'dataset.')
+
+        self.dataset = dataset
+        self.pool = pool
+        self.level = dataset.compression_opts
+        self.shuffle = dataset.shuffle and dataset.dtype.itemsize > 1
+        self.chunk = np.zeros((dataset.chunks[0],) + dataset.shape[1:],
+                              dataset.dtype)
+        self.filled = 0
+        self.row = 0
+        self.pending = []
+        self.maxpending = maxpending
+
+    def compress(self, chunk):
+        chunk = np.ascontiguousarray(chunk)
+        if self.shuffle:
+            return zlib.compress(shuffle_bytes(chunk), self.level)
+        return zlib.compress(chunk, self.level)
+
+    def write(self, rows):
+        """Append the array `rows` to the dataset."""
+        while len(rows):
+            n = min(len(rows), len(self.chunk) - self.filled)
+            self.chunk[self.filled:self.filled+n] = rows[:n]
+            self.filled += n
+            rows = rows[n:]
+
+            if self.filled == len(self.chunk):
+                self.submit()
+
+        self.collect(block=False)
+
+    def submit(self):
+        reserve(self.dataset, self.row + len(self.chunk))
+        if self.chunk.ndim == 1:
+            # a 1-d dataset (e.g. trigger times) has one chunk per row block
+            future = self.pool.submit(self.compress, self.chunk)
+            self.pending.append(((self.row,), future))
+        else:
+            width = self.dataset.chunks[1]
+            for column in range(0, self.chunk.shape[1], width):
+                piece = self.chunk[:, column:column+width]
+                if piece.shape[1] < width:
+                    # pad the last piece out to a whole chunk
+                    padded = np.zeros(self.dataset.chunks, self.dataset.dtype)
+                    padded[:, :piece.shape[1]] = piece
+                    piece = padded
+                future = self.pool.submit(self.compress, piece)
+                self.pending.append(((self.row, column), future))
+        self.row += len(self.chunk)
+        self.chunk = np.zeros_like(self.chunk)
+        self.filled = 0
+
+        # don't let chunks pile up faster than they are compressed
+        while len(self.pending) > self.maxpending:
+            offset, future = self.pending.pop(0)
+            self.dataset.id.write_direct_chunk(offset, future.result())
+
+    def collect(self, block=True):
+        """Store compressed chunks in order as they become ready."""
+        while self.pending and (block or self.pending[0][1].done()):
+            offset, future = self.pending.pop(0)
+            self.dataset.id.write_direct_chunk(offset, future.result())
+
+    def flush(self):
+        """Write any partially filled chunk and wait for all chunks."""
+        if self.filled:
+            # the part of the chunk beyond the dataset extent is ignored
+            self.submit()
+        self.collect()
+
+class EventWriter(object):
+    """
+    Write blocks of events to a dictionary of hdf5 datasets keyed by
+    channel number.
+
+    Event buffers are preallocated: the acquisition loop takes a free
+    buffer with `getbuffers()`, fills it, and hands it back with `put()`.
+    With `nbuffers` > 0 a background thread writes the buffers to disk and
+    returns them to the free list; when all of them are waiting to be
+    written `getbuffers()` blocks, which throttles the acquisition to the
+    rate the disk can keep up with. With `nbuffers` = 0 events are written
+    inline by `put()`.
+
+    Buffers of packed datasets (see `packing`) hold the samples as received
+    and are packed as they are written, i.e. on the writer thread.
+
+    Args:
+        - datasets: dict
+            hdf5 datasets keyed by channel number.
+        - nrows: int
+            Number of events received per trigger (the sequence count).
+        - nbuffers: int
+            Number of event buffers in flight to the writer thread.
+        - threads: int
+            If > 0, compress chunks of the (gzip) datasets on a pool of
+            this many threads and store them with direct chunk writes.
+        - batch: int
+            Number of events staged in memory per channel and written with
+            a single hyperslab write; None uses the rows in a chunk.
+    """
+    def __init__(self, datasets, nrows, nbuffers=0, threads=0, batch=None):
+        self.datasets = datasets
+        self.nrows = nrows
+        self.nbuffers = nbuffers
+        self.error = None
+        self.maxdepth = 0
+
+        self.packers = {}
+        self.packed = {}
+        for channel, dataset in datasets.items():
+            packer = Packer.from_attrs(dataset.attrs)
+            if packer is not None:
+                self.packers[channel] = packer
+                self.packed[channel] = np.empty((nrows, packer.width),
+                                                packer.dtype)
+
+        if threads > 0:
+            self.pool = ThreadPoolExecutor(threads)
+            self.batches = dict((channel, ChunkCompressor(dataset,
+                self.pool, 2*threads)) for channel, dataset in
+                datasets.items())
+        else:
+            self.pool = None
+            self.batches = dict((channel, EventBatch(dataset,
+                batch or (dataset.chunks or (1,))[0])) for channel, dataset
+                in datasets.items())
+
+        if nbuffers > 0:
+            self.queue = queue.Queue(nbuffers)
+            self.free = queue.Queue()
+            for i in range(nbuffers):
+                self.free.put(self.allocate())
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.queue = None
+            self.thread = None
+            self.buffers = self.allocate()
+
+    def allocate(self):
+        """Returns a new dictionary of event buffers keyed by channel."""
+        buffers = {}
+        for channel, dataset in self.datasets.items():
+            if channel in self.packers:
+                packer = self.packers[channel]
+                buffers[channel] = np.empty((self.nrows, packer.nsamples),
+                                            packer.rawdtype)
+            else:
+                buffers[channel] = np.empty((self.nrows,) + dataset.shape[1:],
+                                            dataset.dtype)
+        return buffers
+
+    def depth(self):
+        """Returns the number of event blocks waiting to be written."""
+        if self.queue is None:
+            return 0
+        return self.queue.qsize()
+
+    def getbuffers(self):
+        """
+        Returns a free dictionary of event buffers keyed by channel,
+        blocking until the writer thread has released one.
+        """
+        if self.thread is None:
+            return self.buffers
+
+        while True:
+            self.check()
+            try:
+                return self.free.get(timeout=0.5)
+            except queue.Empty:
+                pass
+
+    def release(self, buffers):
+        """Return `buffers` to the free list without writing them."""
+        if self.thread is not None:
+            self.free.put(buffers)
+
+    def put(self, i, n, buffers):
+        """Write the first `n` events in `buffers` starting at event `i`."""
+        if self.thread is None:
+            self.write(i, n, buffers)
+            return
+
+        self.check()
+        self.queue.put((i, n, buffers))
+        self.maxdepth = max(self.maxdepth, self.queue.qsize())
+
+    def write(self, i, n, buffers):
+        for channel, batch in self.batches.items():
+            if batch.row + batch.filled != i:
+                raise Exception('events must be written in order.')
+            rows = buffers[channel][:n]
+            if channel in self.packers:
+                rows = self.packers[channel].pack(rows,
+                                                  self.packed[channel][:n])
+            batch.write(rows)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is None:
+                try:
+                    self.write(*item)
+                except Exception as e:
+                    self.error = e
+            self.free.put(item[2])
+
+    def check(self):
+        """Raise any exception from the writer thread in the caller."""
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Wait for every queued event to be written and flush the batches,
+        then raise any exception from the writer thread. The batches are
+        flushed and the pool shut down even if the writer thread failed.
+        """
+        try:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.thread = None
+
+            if self.batches is not None:
+                batches, self.batches = self.batches, None
+                for batch in batches.values():
+                    batch.flush()
+        except Exception:
+            # report the first error rather than one it caused
+            if self.error is None:
+                raise
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+        self.check()
@@ -9,8 +9,10 @@ import os, sys
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-from my_canvas import MyCanvas
-from constants import BASEDIR, ICONDIR, DEBUG
+from my_canvas import MyCanvas, LiveCanvas
+from constants import BASEDIR, ICONDIR, DEBUG, SCOPE_IP, LIVE_FPS
+from acquisition import AcquisitionWorker
+import time
 import numpy as np
 
 '''
@@ -31,13 +33,46 @@ class Main(QMainWindow): #You can only add menus to QMainWindows
 #        self.createMenu()
 
         self.canvas = MyCanvas()
+        self.live_canvas = LiveCanvas()
         self.vbox1 = QVBoxLayout() #used to display plugin
 #        self.f = None #this is set in import_data(). Used by controller and loop gains  
         
+        #Scope controls
+        self.ip_edit = QLineEdit(SCOPE_IP)
+        self.connect_button = QPushButton('Connect')
+        self.connect_button.clicked.connect(self.connect_scope)
+        self.live_button = QPushButton('Live')
+        self.live_button.setCheckable(True)
+        self.live_button.setEnabled(False)
+        self.live_button.toggled.connect(self.toggle_live)
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.clicked.connect(self.cancel)
+        self.vbox1.addWidget(QLabel('Scope IP'))
+        self.vbox1.addWidget(self.ip_edit)
+        self.vbox1.addWidget(self.connect_button)
+        self.vbox1.addWidget(self.live_button)
+        self.vbox1.addWidget(self.cancel_button)
+        self.vbox1.addStretch()
+        
+        #all scope i/o happens on the worker's thread
+        self.channels = []
+        self.worker = AcquisitionWorker()
+        self.worker.connected.connect(self.on_connected)
+        self.worker.error.connect(self.on_error)
+        self.worker.cancelled.connect(self.on_cancelled)
+        self.worker.start()
+        
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh_live)
+        
         ######################################################
         #For the right hand side content - matplotlib bode plot
+        #the static plot and the live view share the space
+        self.stack = QStackedWidget()
+        self.stack.addWidget(self.canvas)
+        self.stack.addWidget(self.live_canvas)
         vbox2 = QVBoxLayout()
-        vbox2.addWidget(self.canvas)
+        vbox2.addWidget(self.stack)
         vbox2.setContentsMargins(0,0,0,0) #remove margin between boxlayout and canvas
         widget = QWidget()
         
@@ -70,6 +105,72 @@ class Main(QMainWindow): #You can only add menus to QMainWindows
         self.resize(800, 600) #width, height
         self.show() #display and activate focus
         self.raise_() #comment out for mac
+    
+    def connect_scope(self):
+        self.statusBar().showMessage('Connecting...')
+        self.worker.submit('connect', self.ip_edit.text())
+    
+    def on_connected(self, channels):
+        self.channels = channels
+        self.live_button.setEnabled(True)
+        self.statusBar().showMessage('Connected, channels %s' % channels)
+    
+    def on_error(self, message):
+        self.statusBar().showMessage(message)
+    
+    def on_cancelled(self):
+        self.live_button.setChecked(False)
+        self.statusBar().showMessage('Cancelled')
+    
+    def cancel(self):
+        self.worker.cancel()
+    
+    def toggle_live(self, checked):
+        if checked:
+            self.start_live()
+        else:
+            self.stop_live()
+    
+    def start_live(self):
+        '''Start live frames on the worker and refresh the live canvas at
+        LIVE_FPS.
+        '''
+        self.stack.setCurrentWidget(self.live_canvas)
+        self.worker.width = self.live_canvas.width()
+        self.worker.submit('live', self.channels)
+        self.frames = 0
+        self.dropped = self.worker.frames.dropped
+        self.time0 = time.time()
+        self.timer.start(1000//LIVE_FPS)
+    
+    def stop_live(self):
+        self.timer.stop()
+        self.worker.cancel()
+        self.stack.setCurrentWidget(self.canvas)
+    
+    def refresh_live(self):
+        '''Draw the newest frame, if there is one we have not drawn.
+        '''
+        frame = self.worker.frames.take()
+        if frame is None:
+            return
+        self.live_canvas.update_frame(frame.traces)
+        self.worker.width = self.live_canvas.width()
+        
+        self.frames += 1
+        elapsed = time.time() - self.time0
+        if elapsed > 1.0:
+            dropped = self.worker.frames.dropped
+            self.statusBar().showMessage('%.1f fps, %i frames dropped' %
+                                         (self.frames/elapsed, dropped - self.dropped))
+            self.frames = 0
+            self.dropped = dropped
+            self.time0 = time.time()
+    
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.worker.stop()
+        super(Main, self).closeEvent(event)
         
 if __name__ == '__main__':
     print('Python 3')
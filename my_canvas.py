@@ -70,6 +70,81 @@ class MyCanvas(FigureCanvas):
         #self.canvas.draw()
         self.draw()
         
+
+
+#Scope channel colours
+CHANNEL_COLORS = {1: 'y', 2: 'm', 3: 'c', 4: 'g'}
+
+
+class LiveCanvas(FigureCanvas):
+    '''
+    Displays a live trace per channel. The lines are animated artists: each
+    frame only restores the cached background, redraws the lines and blits
+    the axes instead of redrawing the whole figure.
+    '''
+    def __init__(self, channels=(1, 2, 3, 4), parent=None):
+        fig = Figure()
+        FigureCanvas.__init__(self, fig)
+        fig.patch.set_facecolor([1,1,1])
+        self.setParent(parent)
+
+        self.ax = fig.add_subplot(111)
+        self.ax.grid()
+        self.ax.set_xlabel('Time (s)')
+        self.ax.set_ylabel('Voltage (V)')
+
+        self.lines = {}
+        for channel in channels:
+            self.lines[channel], = self.ax.plot([], [], lw=1, animated=True,
+                                                c=CHANNEL_COLORS.get(channel, 'k'),
+                                                label='C%i' % channel)
+        self.ax.legend(loc='upper right')
+
+        self.background = None
+        self.scaled = False #limits fitted to a frame yet
+        self.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        '''Cache the static parts of the figure after every full redraw.
+        '''
+        self.background = self.copy_from_bbox(self.ax.bbox)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+
+    def update_frame(self, frame):
+        '''Show *frame*, a dictionary of (t, volts) keyed by channel.
+        '''
+        xmin = ymin = float('inf')
+        xmax = ymax = float('-inf')
+        for channel, (t, data) in frame.items():
+            if channel not in self.lines or len(t) == 0:
+                continue
+            self.lines[channel].set_data(t, data)
+            xmin, xmax = min(xmin, t[0]), max(xmax, t[-1])
+            ymin, ymax = min(ymin, data.min()), max(ymax, data.max())
+
+        if xmin > xmax:
+            return
+
+        x0, x1 = self.ax.get_xlim()
+        y0, y1 = self.ax.get_ylim()
+        if not self.scaled or self.background is None or \
+                (x0, x1) != (xmin, xmax) or ymin < y0 or ymax > y1:
+            #the axes change: redraw everything (and cache a new background)
+            margin = 0.1*(ymax - ymin) or 1e-3
+            if self.scaled:
+                ymin, ymax = min(y0, ymin), max(y1, ymax)
+            self.ax.set_xlim(xmin, xmax)
+            self.ax.set_ylim(ymin - margin, ymax + margin)
+            self.scaled = True
+            self.draw()
+            return
+
+        self.restore_region(self.background)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+        self.blit(self.ax.bbox)
+
      
 #if __name__ == '__main__':
 #    
@@ -0,0 +1,52 @@
+import os
+import h5py
+import numpy as np
+import pytest
+from lecrunch import analysis
+
+def pulses(nevents=6, nsamples=200, rise=10):
+    """Negative pulses with a linear leading edge of `rise` samples from
+    sample 100, on a baseline of 0.1 V."""
+    t = np.arange(nsamples)
+    edge = np.clip((t - 100)/rise, 0.0, 1.0)
+    heights = np.linspace(0.1, 0.6, nevents)
+    return (0.1 - heights[:, np.newaxis]*edge).astype(np.float32)
+
+def test_features():
+    events = pulses()
+    out = analysis.features(events, 0.0, 1e-9)
+    assert np.allclose(out['baseline'], 0.1)
+    assert np.allclose(out['height'], np.linspace(0.1, 0.6, 6), rtol=1e-5)
+    assert np.allclose(out['peak_time'], 110e-9)
+    assert np.allclose(out['rise_time'], 8e-9, rtol=1e-3)
+
+def test_rise_time_without_leading_edge():
+    events = pulses()
+    # already at the peak in the first sample, so i90 is 0
+    events[0, :] = 0.1
+    events[0, 0] = -0.5
+    out = analysis.features(events, 0.0, 1e-9)
+    assert np.isnan(out['rise_time'][0])
+    assert np.allclose(out['rise_time'][1:], 8e-9, rtol=1e-3)
+
+def test_analyze(tmp_path):
+    events = np.round(pulses(100)*1000).astype(np.int16)
+    filename = str(tmp_path / 'run.hdf5')
+    with h5py.File(filename, 'w') as f:
+        dataset = f.create_dataset('channel1', data=events, chunks=(8, 200))
+        dataset.attrs.update({ 'vertical_gain'      : 1e-3,
+                               'vertical_offset'    : 0.0,
+                               'horiz_interval'     : 1e-9,
+                               'horiz_offset'       : 0.0,
+                               'wave_array_count'   : 200,
+                               'nom_subarray_count' : 1 })
+
+    assert analysis.analyze(filename, processes=2, rows=16) == { 1 : 100 }
+
+    with h5py.File(filename, 'r') as f:
+        saved = f['features/channel1'][:]
+    expected = analysis.features(events*1e-3, 0.0, 1e-9)
+    for name in analysis.feature_dtype.names:
+        assert np.allclose(saved[name], expected[name], rtol=1e-5)
+    # the spool file is removed
+    assert os.listdir(str(tmp_path)) == ['run.hdf5']
@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from lecrunch.asyncscope import AsyncLeCroyScope
+from lecrunch.emulator import start
+
+@pytest.fixture
+def server():
+    server = start(nsamples=100)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_open_comm_format(server):
+    async def open(comm_format):
+        scope = await AsyncLeCroyScope.open('127.0.0.1',
+            server.server_address[1], comm_format=comm_format)
+        scope.close()
+
+    asyncio.run(open('word'))
+    assert server.settings['CFMT'] == 'DEF9,WORD,BIN'
+
+    with pytest.raises(Exception, match='comm_format'):
+        asyncio.run(open('DOUBLE'))
@@ -0,0 +1,150 @@
+import socket
+import h5py
+import numpy as np
+import pytest
+from lecrunch import engine
+from lecrunch.driver import Driver
+
+class FakeScope(Driver):
+    """A scope with one channel of `nsamples` int8 samples per event whose
+    reads fail with `error` while it is not None."""
+    def __init__(self, nsamples=10, error=None):
+        self.nsamples = nsamples
+        self.error = error
+        self.arms = 0
+        self.clears = 0
+        self.reads = 0
+
+    def active_channels(self):
+        return [1]
+
+    def settings(self):
+        return { 'TIME_DIV' : '1e-6' }
+
+    def events_per_trigger(self):
+        return 1
+
+    def descriptors(self, channels):
+        return { 1 : { 'dtype'            : np.dtype(np.int8),
+                       'wave_array_count' : self.nsamples,
+                       'vertical_gain'    : 0.01,
+                       'vertical_offset'  : 0.0,
+                       'horiz_interval'   : 1e-9,
+                       'horiz_offset'     : 0.0 } }
+
+    def arm(self):
+        self.arms += 1
+
+    def read_batch(self, channels, buffers, rearm=False):
+        self.reads += 1
+        if self.error is not None:
+            raise self.error
+        buffers[1][0] = self.reads
+        return 1
+
+    def clear(self):
+        self.clears += 1
+
+def test_acquire(tmp_path):
+    scope = FakeScope()
+    filename = str(tmp_path / 'run.hdf5')
+    assert engine.acquire(scope, filename, 5) == [filename]
+
+    with h5py.File(filename, 'r') as f:
+        assert f.attrs['TIME_DIV'] == '1e-6'
+        assert (f['channel1'][:, 0] == [1, 2, 3, 4, 5]).all()
+
+def test_acquire_gives_up(tmp_path):
+    scope = FakeScope(error=socket.timeout('timed out'))
+    filename = str(tmp_path / 'run.hdf5')
+    with pytest.raises(socket.timeout):
+        engine.acquire(scope, filename, 5, maxretries=3)
+
+    assert scope.reads == 4
+    assert scope.clears == 3
+
+    # the file is closed and trimmed
+    with h5py.File(filename, 'r') as f:
+        assert f['channel1'].shape == (0, 10)
+
+def test_acquire_rollover_open_error(tmp_path, monkeypatch):
+    create_file = engine.create_file
+    def fail_second(filename, *args, **kwargs):
+        if filename.endswith('_0001.hdf5'):
+            raise OSError('disk full')
+        return create_file(filename, *args, **kwargs)
+    monkeypatch.setattr(engine, 'create_file', fail_second)
+
+    filename = str(tmp_path / 'run.hdf5')
+    with pytest.raises(OSError, match='disk full'):
+        engine.acquire(FakeScope(), filename, 5, maxbytes=0)
+
+    # the first run was closed and trimmed once
+    with h5py.File(str(tmp_path / 'run_0000.hdf5'), 'r') as f:
+        assert (f['channel1'][:, 0] == [1]).all()
+
+@pytest.mark.parametrize('nbuffers,threads', [(0, 0), (2, 0), (2, 2)])
+def test_acquire_writer_error(tmp_path, monkeypatch, nbuffers, threads):
+    def write(self, i, n, buffers):
+        raise OSError('disk full')
+    monkeypatch.setattr(engine.EventWriter, 'write', write)
+
+    filename = str(tmp_path / 'run.hdf5')
+    with pytest.raises(OSError):
+        engine.acquire(FakeScope(), filename, 5, nbuffers=nbuffers,
+                       threads=threads)
+
+    # the file was closed, so it can be opened again
+    with h5py.File(filename, 'r') as f:
+        assert 'channel1' in f
+
+class ShortScope(FakeScope):
+    """A sequence mode scope which returns 3 segments every other trigger
+    instead of 4, leaving the last row of its buffers stale."""
+    def events_per_trigger(self):
+        return 4
+
+    def descriptors(self, channels):
+        wavedesc = FakeScope.descriptors(self, channels)
+        wavedesc[1]['wave_array_count'] = 4*self.nsamples
+        return wavedesc
+
+    def read_batch(self, channels, buffers, rearm=False):
+        self.reads += 1
+        n = 3 if self.reads % 2 else 4
+        buffers[1][:n] = np.arange(n)[:, np.newaxis] + 10*self.reads
+        buffers[('trigtime', 1)][:n]['trigger_time'] = self.reads
+        return n
+
+def test_acquire_short_batches(tmp_path):
+    scope = ShortScope()
+    filename = str(tmp_path / 'run.hdf5')
+    engine.acquire(scope, filename, 10, nbuffers=2)
+
+    with h5py.File(filename, 'r') as f:
+        events = f['channel1'][:, 0]
+        trigtimes = f['trigtime/channel1'][:]['trigger_time']
+    # 3 + 4 + 3 events, none of them stale
+    assert list(events) == [10, 11, 12, 20, 21, 22, 23, 30, 31, 32]
+    assert list(trigtimes) == [1]*3 + [2]*4 + [3]*3
+
+def test_store_sequences_short():
+    from lecrunch.driver import store_sequences
+    from lecrunch.lecroy import trigtime_dtype
+    buffers = {}
+    for channel in (1, 2):
+        buffers[channel] = np.zeros((4, 5), np.int8)
+        buffers[('trigtime', channel)] = np.zeros(4, trigtime_dtype)
+    sequences = { 1 : (None, np.ones((4, 5), np.int8),
+                       np.ones(4, trigtime_dtype)),
+                  2 : (None, np.ones((3, 5), np.int8),
+                       np.ones(3, trigtime_dtype)) }
+    assert store_sequences(sequences, buffers) == 3
+
+def test_driver_is_abstract():
+    class Incomplete(Driver):
+        def active_channels(self):
+            return [1]
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,117 @@
+import functools
+import h5py
+import numpy as np
+import pytest
+from lecrunch import fetch, lecroy
+from lecrunch.emulator import start
+from lecrunch.packing import Packer
+from lecrunch.scaling import time_axis
+
+@pytest.fixture
+def emulator(monkeypatch):
+    """Start an emulator and point fetch at it."""
+    servers = []
+    def emulator(**kwargs):
+        server = start(**kwargs)
+        servers.append(server)
+        monkeypatch.setattr(fetch, 'LeCroyScope', functools.partial(
+            lecroy.LeCroyScope, port=server.server_address[1]))
+        return server
+    # don't wait for a real trigger before reading the descriptors
+    monkeypatch.setattr(lecroy.LeCroyScope.descriptors, '__defaults__', (0.0,))
+    monkeypatch.setattr(fetch.setup, 'scope_ip', '127.0.0.1')
+    yield emulator
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def events(server, channel, nevents, first=2):
+    """Returns the waveforms the emulator sent for `nevents` events,
+    starting at acquisition `first`."""
+    pool = server.waveforms[(channel, server.comm_type, server.segments,
+                             server.nsamples)]
+    segments = server.segments
+    return np.array([pool[((k//segments + first) % server.pool)*segments +
+                          k % segments] for k in range(nevents)])
+
+def trigtimes(server, nevents, first=2):
+    """Returns the trigtimes the emulator sent for `nevents` events."""
+    acquisition = server.acquisition
+    try:
+        times = []
+        for k in range(0, nevents, server.segments):
+            server.acquisition = k//server.segments + first
+            times.append(server.trigtimes())
+    finally:
+        server.acquisition = acquisition
+    return np.concatenate(times)[:nevents]
+
+@pytest.mark.parametrize('segments,sparsing', [(1, 1), (4, 3)])
+def test_fetch_window(tmp_path, emulator, segments, sparsing):
+    server = emulator(nsamples=2000, segments=segments)
+    server.settings['WFSU'] = 'SP,0,NP,0,FP,0,SN,0'
+    filename = str(tmp_path / 'window.hdf5')
+
+    fetch.fetch(filename, 3*segments, window=(-20e-9, 180e-9),
+                sparsing=sparsing)
+
+    # the operator's setup is restored
+    assert server.settings['WFSU'] == 'SP,0,NP,0,FP,0,SN,0'
+
+    wavedesc = server.wavedesc(1)
+    t = wavedesc['horiz_offset'] + \
+        np.arange(2000)*wavedesc['horiz_interval']
+    first = int(round((-20e-9 - wavedesc['horiz_offset']) /
+                      wavedesc['horiz_interval']))
+    with h5py.File(filename, 'r') as f:
+        dataset = f['channel1']
+        assert dataset.attrs['first_point'] == first
+        assert dataset.attrs['sparsing_factor'] == sparsing
+        expected = events(server, 1, len(dataset))[:, first::sparsing]
+        expected = expected[:, :dataset.shape[1]]
+        assert (dataset[:] == expected).all()
+        axis = time_axis(dataset.attrs)
+        assert np.allclose(np.asarray(axis), t[first::sparsing][:len(axis)])
+        assert axis.t0 == pytest.approx(-20e-9)
+        assert axis[len(axis) - 1] <= 180e-9 + 1e-12
+
+def test_fetch_window_keeps_setup(tmp_path, emulator):
+    server = emulator(nsamples=1000)
+    server.settings['WFSU'] = 'SP,2,NP,0,FP,0,SN,0'
+    fetch.fetch(str(tmp_path / 'window.hdf5'), 2, window=(0.0, None))
+    assert server.settings['WFSU'].upper() == 'SP,2,NP,0,FP,0,SN,0'
+
+@pytest.mark.parametrize('segments,nbuffers,threads', [(1, 0, 0), (4, 0, 0),
+                                                       (4, 8, 2)])
+def test_fetch(tmp_path, emulator, segments, nbuffers, threads):
+    server = emulator(nsamples=500, segments=segments)
+    filename = str(tmp_path / 'fetch.hdf5')
+
+    fetch.fetch(filename, 5*segments, nbuffers=nbuffers, threads=threads)
+
+    with h5py.File(filename, 'r') as f:
+        for channel in (1, 2):
+            dataset = f['channel%i' % channel]
+            assert len(dataset) >= 5*segments
+            assert (dataset[:] == events(server, channel,
+                                         len(dataset))).all()
+            if segments > 1:
+                assert (f['trigtime/channel%i' % channel][:] ==
+                        trigtimes(server, len(dataset))).all()
+
+@pytest.mark.parametrize('packing', ['none', 'int16', 'pack12'])
+def test_fetch_word(tmp_path, emulator, packing):
+    server = emulator(nsamples=501, segments=2, bits=12)
+    filename = str(tmp_path / 'word.hdf5')
+
+    fetch.fetch(filename, 6, comm_format='WORD', packing=packing)
+
+    with h5py.File(filename, 'r') as f:
+        dataset = f['channel1']
+        expected = events(server, 1, len(dataset))
+        packer = Packer.from_attrs(dataset.attrs)
+        if packer is None:
+            assert (dataset[:] == expected).all()
+        else:
+            assert (packer.unpack(dataset[:]) ==
+                    expected >> (16 - packer.bits)).all()
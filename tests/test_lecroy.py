@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from lecrunch.lecroy import sequence_count, window_points, decodewavedesc, \
+    decodesequence, trigtime_dtype
+from lecrunch.emulator import Emulator
+from lecrunch.scaling import time_axis
+
+def test_sequence_count():
+    assert sequence_count(b'SEQ OFF,10,25E+3 SAMPLE') == 1
+    assert sequence_count('SEQ ON,100,25E+3 SAMPLE') == 100
+    with pytest.raises(Exception):
+        sequence_count('SEQ ON,0,25E+3 SAMPLE')
+
+wavedesc = { 'wave_array_count'   : 4000,
+             'nom_subarray_count' : 2,
+             'horiz_interval'     : 1e-9,
+             'horiz_offset'       : -1e-6 }
+
+def test_window_points():
+    # -1 us + 1000 ns = 0
+    assert window_points(wavedesc, 0.0, 200e-9) == (1000, 201)
+    assert window_points(wavedesc, 0.0, 200e-9, 10) == (1000, 21)
+    assert window_points(wavedesc) == (0, 2000)
+    assert window_points(wavedesc, sparsing=3) == (0, 667)
+    # clipped to the record
+    assert window_points(wavedesc, -5e-6, 5e-6) == (0, 2000)
+    assert window_points(wavedesc, 900e-9, None) == (1900, 100)
+
+def test_time_axis_window():
+    t = time_axis(dict(wavedesc, first_point=1000, sparsing_factor=10,
+                       wave_array_count=42))
+    assert len(t) == 21
+    assert t.t0 == pytest.approx(0.0)
+    assert t.dt == pytest.approx(10e-9)
+    # older files have neither field
+    t = time_axis(wavedesc)
+    assert (t.t0, t.dt, len(t)) == (-1e-6, 1e-9, 2000)
+
+@pytest.fixture
+def emulator():
+    server = Emulator(('127.0.0.1', 0), nsamples=500, segments=3)
+    yield server
+    server.server_close()
+
+def reply(block):
+    """The decoders take the reply as read off the socket, header and all."""
+    return memoryview(block)
+
+def test_decode_emulator_replies(emulator):
+    emulator.acquisition = 1
+    desc = decodewavedesc(reply(emulator.query_waveform(1, 'DESC')), 1)
+    assert desc['wave_array_count'] == 1500
+    assert desc['subarray_count'] == 3
+    assert desc['horiz_interval'] == pytest.approx(
+        emulator.wavedesc(1)['horiz_interval'])
+
+    desc, waveforms, trigtimes = decodesequence(
+        reply(emulator.query_waveform(1, 'ALL')), 1)
+    assert (waveforms == emulator.waveform(1)).all()
+    assert trigtimes.dtype.names == trigtime_dtype.names
+    assert (trigtimes == emulator.trigtimes()).all()
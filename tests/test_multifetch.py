@@ -0,0 +1,79 @@
+import socket
+import h5py
+import numpy as np
+import pytest
+from lecrunch import multifetch
+from lecrunch.emulator import start
+
+@pytest.fixture
+def servers():
+    servers = [start(nsamples=200, segments=2, seed=k) for k in range(2)]
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def addresses(servers):
+    return ['127.0.0.1:%i' % server.server_address[1] for server in servers]
+
+@pytest.mark.parametrize('nbuffers', [0, 2])
+def test_fetch(tmp_path, servers, nbuffers):
+    filename = str(tmp_path / 'multi.hdf5')
+    multifetch.fetch(filename, addresses(servers), 10, nbuffers)
+
+    with h5py.File(filename, 'r') as f:
+        for k, server in enumerate(servers):
+            assert f['scope%i/channel1' % k].shape == (10, 200)
+            assert f['scope%i/trigtime/channel1' % k].shape == (10,)
+            # every event is one of the emulator's waveforms
+            pool = server.waveforms[(1, 0, 2, 200)]
+            for event in f['scope%i/channel1' % k][:]:
+                assert (pool == event).all(axis=1).any()
+
+    for server in servers:
+        assert server.settings['DISP'].upper() == 'ON'
+
+def test_fetch_writer_error(tmp_path, servers, monkeypatch):
+    def write(self, i, n, buffers):
+        raise OSError('disk full')
+    monkeypatch.setattr(multifetch.EventWriter, 'write', write)
+
+    filename = str(tmp_path / 'multi.hdf5')
+    with pytest.raises(OSError):
+        multifetch.fetch(filename, addresses(servers), 10, 2)
+
+    with h5py.File(filename, 'r') as f:
+        assert 'scope1' in f
+    for server in servers:
+        assert server.settings['DISP'].upper() == 'ON'
+
+def test_fetch_open_error(tmp_path, servers):
+    # nothing listens on the port of a closed server
+    server = servers.pop()
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(OSError):
+        multifetch.fetch(str(tmp_path / 'multi.hdf5'),
+                         addresses(servers) + addresses([server]), 10)
+
+def test_fetch_sequence_mismatch(tmp_path, servers):
+    servers[1].settings['SEQ'] = 'ON,4,10E+3 SAMPLE'
+    with pytest.raises(Exception, match='sequence count'):
+        multifetch.fetch(str(tmp_path / 'multi.hdf5'), addresses(servers), 10)
+    for server in servers:
+        assert server.settings['DISP'].upper() == 'ON'
+
+def test_fetch_gives_up(tmp_path, servers, monkeypatch):
+    calls = []
+    async def acquire(*args):
+        calls.append(args)
+        raise socket.timeout('timed out')
+    monkeypatch.setattr(multifetch, 'acquire', acquire)
+
+    with pytest.raises(socket.timeout):
+        multifetch.fetch(str(tmp_path / 'multi.hdf5'), addresses(servers), 10,
+                         maxretries=3)
+    # every scope is read once per attempt
+    assert len(calls) == 4*len(servers)
+    for server in servers:
+        assert server.settings['DISP'].upper() == 'ON'
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from lecrunch.packing import Packer
+
+@pytest.mark.parametrize('packing,bits', [('int16', 12), ('int16', 14),
+                                          ('pack12', 12), ('pack12', 10)])
+@pytest.mark.parametrize('nsamples', [1000, 999])
+def test_round_trip(packing, bits, nsamples):
+    rng = np.random.default_rng(0)
+    codes = rng.integers(-2**(bits-1), 2**(bits-1), (7, nsamples))
+    codes[0, :2] = [-2**(bits-1), 2**(bits-1) - 1]
+    # the scope sends the codes in the high bits of each word
+    words = (codes << (16 - bits)).astype(np.int16)
+
+    packer = Packer(packing, nsamples, bits)
+    packed = packer.pack(words)
+    assert packed.shape == (7, packer.width)
+    assert packed.dtype == packer.dtype
+    if packing == 'pack12':
+        assert packed.nbytes == 7*3*((nsamples + 1)//2)
+
+    assert (packer.unpack(packed) == codes).all()
+
+def test_pack12_needs_12_bits():
+    with pytest.raises(Exception):
+        Packer('pack12', 100, 14)
+
+def test_attrs_and_wavedesc():
+    packer = Packer('pack12', 100, 12)
+    assert Packer.from_attrs(packer.attrs()).width == packer.width
+    assert Packer.from_attrs({ 'packing' : b'none' }) is None
+    assert Packer.from_attrs({}) is None
+
+    wavedesc = packer.wavedesc({ 'vertical_gain' : 1.0/256,
+                                 'max_value'     : 32512.0,
+                                 'min_value'     : -32768.0 })
+    # the codes are the words shifted down by 4 bits
+    assert wavedesc['vertical_gain'] == 16.0/256
+    assert wavedesc['max_value'] == 2032.0
+    assert wavedesc['min_value'] == -2048.0
@@ -0,0 +1,62 @@
+import h5py
+import numpy as np
+import pytest
+from lecrunch.packing import Packer
+from lecrunch.reader import RunFile
+from lecrunch.scaling import iter_raw, scale_dataset
+
+wavedesc = { 'vertical_gain'      : 0.5,
+             'vertical_offset'    : 1.0,
+             'horiz_interval'     : 1e-9,
+             'horiz_offset'       : -1e-7,
+             'wave_array_count'   : 100,
+             'nom_subarray_count' : 1 }
+
+def save(filename, events, chunks=(4, 100), packing=None):
+    with h5py.File(filename, 'w') as f:
+        data = events
+        attrs = dict(wavedesc)
+        if packing is not None:
+            packer = Packer(packing, events.shape[1], 12)
+            data = packer.pack(events << 4)
+            attrs = packer.wavedesc(dict(wavedesc, vertical_gain=0.5/16))
+            attrs.update(packer.attrs())
+            del attrs['dtype']
+        dataset = f.create_dataset('channel1', data=data, chunks=chunks)
+        dataset.attrs.update(attrs)
+
+@pytest.mark.parametrize('chunks,packing', [((4, 100), None), (None, None),
+                                            ((4, 150), 'pack12'),
+                                            ((4, 100), 'int16')])
+def test_iter_blocks(tmp_path, chunks, packing):
+    rng = np.random.default_rng(0)
+    events = rng.integers(-2048, 2047, (30, 100)).astype(np.int16)
+    filename = str(tmp_path / 'run.hdf5')
+    save(filename, events, chunks, packing)
+
+    with RunFile(filename) as run:
+        channel = run[1]
+        assert (channel.mmap is not None) == (chunks is None)
+        assert channel.shape == events.shape
+        volts = 0.5*events - 1.0
+
+        blocks = list((i, block.copy()) for i, block in
+                      channel.iter_blocks(3, 25, raw=True))
+        assert blocks[0][0] == 3
+        assert (np.concatenate([block for i, block in blocks]) ==
+                events[3:25]).all()
+
+        scaled = np.concatenate([block.copy() for i, block in
+                                 channel.iter_blocks(rows=8)])
+        assert np.allclose(scaled, volts)
+        assert np.allclose(channel[5:17], volts[5:17])
+        assert np.allclose(scale_dataset(channel.dataset), volts)
+
+def test_iter_raw_aligned(tmp_path):
+    events = np.arange(30*100, dtype=np.int16).reshape(30, 100)
+    filename = str(tmp_path / 'run.hdf5')
+    save(filename, events)
+    with h5py.File(filename, 'r') as f:
+        starts = [(i, len(raw)) for i, raw in iter_raw(f['channel1'], 3, 13)]
+    # the first block runs to the end of its chunk
+    assert starts == [(3, 1), (4, 4), (8, 4), (12, 1)]
@@ -0,0 +1,59 @@
+import struct
+from lecrunch.sock import headerformat, pack_messages, last_command_error, \
+    series_views
+from lecrunch.config import settings_query, parse_settings
+
+def block(payload, last=True):
+    return struct.pack(headerformat, 129 if last else 128, 1, 1, 0,
+                       len(payload)) + payload
+
+def receive(data, buffer=None):
+    """Run `series_views` over the bytes `data` as a socket would."""
+    series = series_views(buffer)
+    view = next(series)
+    while True:
+        n = len(view)
+        view[:] = data[:n]
+        data = data[n:]
+        view.release()
+        try:
+            view = next(series)
+        except StopIteration as e:
+            return e.value
+
+def test_pack_messages():
+    packed = pack_messages(['arm', b'wait\n'])
+    assert packed == block(b'arm\n') + block(b'wait\n')
+
+def test_series_views():
+    data = block(b'first ', last=False) + block(b'second')
+    assert receive(data).tobytes() == b'first second'
+
+    # a buffer which is large enough is reused
+    buffer = bytearray(16)
+    reply = receive(data, buffer)
+    assert reply.tobytes() == b'first second'
+    assert reply.obj is buffer
+
+def test_series_views_grow_with_view_held():
+    buffer = bytearray(8)
+    small = receive(block(b'small'), buffer)
+    assert small.obj is buffer
+
+    # the view of the first reply is still held while a larger one arrives,
+    # so the buffer cannot be resized in place
+    data = block(b'a much ', last=False) + block(b'larger reply')
+    large = receive(data, small.obj)
+    assert large.tobytes() == b'a much larger reply'
+    assert large.obj is not buffer
+
+def test_last_command_error():
+    assert last_command_error(b'CMR 0\n') is None
+    assert last_command_error('CMR 1') == 'unrecognized command/query header'
+
+def test_settings_query():
+    group = ['TIME_DIV', 'SEQUENCE']
+    assert settings_query(group) == 'TIME_DIV?;SEQUENCE?;cmr?'
+    assert parse_settings(group, b'TDIV 1E-6;SEQ OFF,10,1000;CMR 0\n') == \
+        { 'TIME_DIV' : b'TDIV 1E-6', 'SEQUENCE' : b'SEQ OFF,10,1000' }
+    assert parse_settings(group, b'TDIV 1E-6;CMR 1\n') is None
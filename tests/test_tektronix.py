@@ -0,0 +1,141 @@
+import socket
+import numpy as np
+import pytest
+from lecrunch import tektronix
+from lecrunch.tektronix import TekScope
+
+preamble = { 'BYT_NR' : 1,
+             'BIT_NR' : 8,
+             'ENCDG'  : 'BIN',
+             'BN_FMT' : 'RI',
+             'BYT_OR' : 'MSB',
+             'NR_PT'  : 4,
+             'WFID'   : 'Ch1, DC',
+             'PT_FMT' : 'Y',
+             'XINCR'  : 1e-9,
+             'PT_OFF' : 0,
+             'XZERO'  : -5e-7,
+             'XUNIT'  : 's',
+             'YMULT'  : 4e-3,
+             'YZERO'  : 0.0,
+             'YOFF'   : 0.0,
+             'YUNIT'  : 'V',
+             'NR_FR'  : 2 }
+
+class FakeSocket(object):
+    """A socket which records what is sent and replies with the bytes in
+    `replies`, timing out once they run out, as a scope which has nothing
+    more to say."""
+    replies = b''
+
+    def __init__(self, *args):
+        self.sent = []
+        self.pending = bytearray(FakeSocket.replies)
+        self.timeout = None
+
+    def setsockopt(self, *args):
+        pass
+
+    def connect(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def sendall(self, msg):
+        self.sent.append(bytes(msg))
+
+    def recv_into(self, view):
+        if not self.pending:
+            raise socket.timeout('timed out')
+        n = min(len(view), len(self.pending))
+        view[:n] = self.pending[:n]
+        del self.pending[:n]
+        return n
+
+    def recv(self, size):
+        if not self.pending:
+            raise socket.timeout('timed out')
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+def stamps(offset):
+    return ','.join('"02 Mar 2020 10:11:12.%03i 000 000 000"' % (offset + 250*k)
+                    for k in range(2))
+
+@pytest.fixture
+def scope(monkeypatch):
+    monkeypatch.setattr(tektronix.socket, 'socket', FakeSocket)
+    def connect(replies):
+        FakeSocket.replies = replies
+        scope = TekScope('127.0.0.1')
+        scope.preambles = {1: preamble, 2: preamble}
+        return scope
+    return connect
+
+def test_fastframes_concatenated_replies(scope):
+    """The replies to the curve? and time stamp queries of every channel
+    come back on a single line, separated by ';'."""
+    ch1 = np.arange(8, dtype=np.int8)
+    ch2 = -np.arange(8, dtype=np.int8)
+    replies = b'#18' + ch1.tobytes() + b';#18' + ch2.tobytes() + b';' + \
+        (stamps(0) + ';' + stamps(1)).encode() + b'\n'
+    s = scope(replies)
+
+    sequences = s.get_fastframes([1, 2], 2, multisource=True, rearm=True)
+
+    assert s.sock.sent[-1] == b':data:source ch1,ch2;:curve?;' \
+        b':horizontal:fastframe:timestamp:all:ch1? 1,2;' \
+        b':horizontal:fastframe:timestamp:all:ch2? 1,2;:acquire:state run\n'
+    for channel, data in ((1, ch1), (2, ch2)):
+        pre, waveforms, trigtimes = sequences[channel]
+        assert (waveforms == data.reshape(2, 4)).all()
+        assert np.allclose(trigtimes['trigger_time'], [0.0, 0.25])
+        assert np.allclose(trigtimes['trigger_offset'], -5e-7)
+
+def test_fastframes_into_buffers(scope):
+    ch1 = np.arange(8, dtype=np.int8)
+    replies = b'#18' + ch1.tobytes() + b';' + stamps(0).encode() + b'\n'
+    s = scope(replies)
+
+    out = {1: np.zeros((3, 4), np.int8)}
+    sequences = s.get_fastframes([1], 2, out)
+
+    assert (out[1][:2] == ch1.reshape(2, 4)).all()
+    assert np.shares_memory(sequences[1][1], out[1])
+
+def test_fastframes_missing_stamps(scope):
+    ch1 = np.arange(8, dtype=np.int8)
+    replies = b'#18' + ch1.tobytes() + b';#18' + ch1.tobytes() + b';' + \
+        stamps(0).encode() + b'\n'
+    s = scope(replies)
+
+    with pytest.raises(Exception):
+        s.get_fastframes([1, 2], 2, multisource=True)
+
+def test_split_replies():
+    assert tektronix.split_replies('"a;b",1;2;"c"') == ['"a;b",1', '2', '"c"']
+
+def test_parse_timestamps():
+    t = tektronix.parse_timestamps(
+        '"02 Mar 2020 23:59:59.999 999 999 999",'
+        '"03 Mar 2020 00:00:00.000 000 000 001"')
+    assert t[0] == 0.0
+    assert t[1] == pytest.approx(2e-12, abs=1e-15)
+
+def test_preamble_wavedesc():
+    wavedesc = tektronix.preamble_wavedesc(dict(preamble, YOFF=10.0,
+                                                YZERO=0.5, PT_OFF=100), 2)
+    assert wavedesc['wave_array_count'] == 8
+    assert wavedesc['nom_subarray_count'] == 2
+    # volts = YZERO + (raw - YOFF)*YMULT
+    raw = np.array([-5, 0, 17])
+    volts = 0.5 + (raw - 10.0)*4e-3
+    assert np.allclose(wavedesc['vertical_gain']*raw -
+                       wavedesc['vertical_offset'], volts)
+    assert wavedesc['horiz_offset'] == pytest.approx(-5e-7 - 100e-9)
+    assert wavedesc['min_value'] == -128 and wavedesc['max_value'] == 127
@@ -0,0 +1,35 @@
+import h5py
+import numpy as np
+import pytest
+from lecrunch.writer import EventWriter, compression_options, chunk_shape
+
+def create(f, nevents=20, nsamples=100, codec='gzip'):
+    return { 1 : f.create_dataset('channel1', (nevents, nsamples), np.int8,
+                                  maxshape=(None, nsamples),
+                                  chunks=chunk_shape(nsamples, np.int8,
+                                                     nevents, 1000),
+                                  **compression_options(codec)) }
+
+@pytest.mark.parametrize('nbuffers,threads', [(0, 0), (3, 0), (0, 2), (3, 2)])
+def test_write(tmp_path, nbuffers, threads):
+    rng = np.random.default_rng(0)
+    events = rng.integers(-128, 127, (20, 100)).astype(np.int8)
+    with h5py.File(str(tmp_path / 'w.hdf5'), 'w') as f:
+        datasets = create(f)
+        writer = EventWriter(datasets, 4, nbuffers, threads)
+        for i in range(0, 20, 4):
+            buffers = writer.getbuffers()
+            buffers[1][:] = events[i:i+4]
+            writer.put(i, 4, buffers)
+        writer.close()
+        assert (datasets[1][:] == events).all()
+
+def test_close_after_error(tmp_path):
+    with h5py.File(str(tmp_path / 'w.hdf5'), 'w') as f:
+        writer = EventWriter(create(f), 1, 2, 2)
+        writer.put(0, 1, writer.getbuffers())
+        # out of order, fails on the writer thread
+        writer.put(5, 1, writer.getbuffers())
+        with pytest.raises(Exception, match='in order'):
+            writer.close()
+        assert writer.pool is None and writer.batches is None